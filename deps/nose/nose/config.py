@@ -147,6 +147,7 @@ class Config(object):
       self.configSection = 'nosetests'
       self.debug = env.get('NOSE_DEBUG')
       self.debugLog = env.get('NOSE_DEBUG_LOG')
+      self.discoveryCache = env.get('NOSE_DISCOVERY_CACHE')
       self.exclude = None
       self.getTestCaseNamesCompat = False
       self.includeExe = env.get('NOSE_INCLUDE_EXE',
@@ -181,6 +182,7 @@ class Config(object):
         self.configSection = 'nosetests'
         self.debug = env.get('NOSE_DEBUG')
         self.debugLog = env.get('NOSE_DEBUG_LOG')
+        self.discoveryCache = env.get('NOSE_DISCOVERY_CACHE')
         self.exclude = None
         self.getTestCaseNamesCompat = False
         self.includeExe = env.get('NOSE_INCLUDE_EXE',
@@ -301,6 +303,7 @@ class Config(object):
         self.debug = options.debug
         self.debugLog = options.debugLog
         self.loggingConfig = options.loggingConfig
+        self.discoveryCache = options.discoveryCache
         self.firstPackageWins = options.firstPackageWins
         self.configureLogging()
 
@@ -520,6 +523,14 @@ class Config(object):
             "--traverse-namespace", action="store_true",
             default=self.traverseNamespace, dest="traverseNamespace",
             help="Traverse through all path entries of a namespace package")
+        parser.add_option(
+            "--discovery-cache", action="store",
+            dest="discoveryCache", default=self.discoveryCache,
+            metavar="FILE",
+            help="Remember which directories and modules hold tests in "
+            "this file, relative to the working directory, and skip "
+            "unchanged ones that held none on the next run "
+            "[NOSE_DISCOVERY_CACHE]")
         parser.add_option(
             "--first-package-wins", "--first-pkg-wins", "--1st-pkg-wins",
             default=False, dest="firstPackageWins",
@@ -0,0 +1,237 @@
+"""
+Discovery cache
+---------------
+
+Test discovery walks every directory under the working directory, asks
+the selector about every entry and imports every test-like module, on
+every run. On a large tree most of that work gives the same answer as
+last time. A :class:`DiscoveryCache` remembers, across runs:
+
+* for each directory, the entries the selector wanted and what kind of
+  entry each one is (module, other file, package or plain directory),
+  valid as long as the directory's mtime is unchanged; and
+* which of those modules, files, packages and directories yielded no
+  tests at all, valid as long as the module or file (or, for packages
+  and directories, everything wanted below them) is unchanged.
+
+With the cache, :meth:`nose.loader.TestLoader.loadTestsFromDir` skips
+``os.listdir`` and the selector for unchanged directories, and skips
+importing unchanged modules and packages that held no tests. Modules
+that do hold tests are still imported and loaded as usual, so fixtures,
+generators and plugins see exactly the same tests.
+
+The cache is enabled with ``--discovery-cache=FILE``
+[NOSE_DISCOVERY_CACHE]. It is discarded whenever the options that
+affect selection (test match, include and exclude patterns, enabled
+plugins, ...) change. Tests are assumed to be defined in the module
+that holds them: a test module whose tests are all imported from
+another module should not be left empty between runs.
+"""
+import cPickle
+import logging
+import os
+
+from nose.suite import LazySuite
+
+log = logging.getLogger(__name__)
+
+__all__ = ['DiscoveryCache', 'isEmptySuite', 'selectionKey']
+
+# entry kinds
+MODULE = 'module'
+FILE = 'file'
+PACKAGE = 'package'
+DIR = 'dir'
+
+_init_files = ('__init__.py', '__init__.pyc', '__init__.pyo')
+
+
+def selectionKey(config, selector=None):
+    """Return a picklable summary of everything in config (and the
+    selector class) that affects which tests are discovered.
+    """
+    def patterns(regexes):
+        return tuple([getattr(r, 'pattern', r) for r in (regexes or ())])
+    plugins = getattr(config.plugins, 'plugins', ())
+    return (getattr(config.testMatch, 'pattern', config.testMatch),
+            patterns(config.include),
+            patterns(config.exclude),
+            patterns(config.ignoreFiles),
+            bool(config.includeExe),
+            tuple(config.srcDirs or ()),
+            bool(config.traverseNamespace),
+            selector.__class__.__name__,
+            tuple([getattr(p, 'name', p.__class__.__name__)
+                   for p in plugins]))
+
+
+def isEmptySuite(test):
+    """Is test a suite that is already fully loaded and holds no tests?
+
+    Suites still waiting on a generator may hold tests, so they are not
+    empty; neither is anything that is not a suite.
+    """
+    if not isinstance(test, LazySuite):
+        return False
+    if test.test_generator is not None:
+        return False
+    for t in test._precache:
+        if not isEmptySuite(t):
+            return False
+    return True
+
+
+class DiscoveryCache(object):
+    """Per-directory selection results and known-empty entries, saved in
+    a pickle file between runs.
+    """
+    version = 1
+
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.key = key
+        self.dirs = {}
+        self.empty = {}
+        self.dirty = False
+        self._checked = {}
+        self.load()
+
+    def load(self):
+        """Load the cache file, if there is one made with the same key.
+        """
+        try:
+            fh = open(self.filename, 'rb')
+            try:
+                data = cPickle.load(fh)
+            finally:
+                fh.close()
+        except IOError:
+            log.debug("No discovery cache in %s", self.filename)
+            return
+        except Exception, e:
+            log.warning("Ignoring unreadable discovery cache %s: %s",
+                        self.filename, e)
+            return
+        if (not isinstance(data, dict)
+            or data.get('version') != self.version
+            or data.get('key') != self.key):
+            log.debug("Discovery cache %s is stale", self.filename)
+            self.dirty = True
+            return
+        self.dirs = data['dirs']
+        self.empty = data['empty']
+
+    def save(self):
+        """Write the cache file, if anything changed since it was loaded.
+        Records of directories that no longer exist are dropped.
+        """
+        if not self.dirty:
+            return
+        for path in self.dirs.keys():
+            if not os.path.isdir(path):
+                del self.dirs[path]
+        for path, kind in self.empty.keys():
+            if not os.path.exists(path):
+                del self.empty[(path, kind)]
+        data = {'version': self.version,
+                'key': self.key,
+                'dirs': self.dirs,
+                'empty': self.empty}
+        tmp = self.filename + '.tmp'
+        try:
+            fh = open(tmp, 'wb')
+            try:
+                cPickle.dump(data, fh, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError), e:
+            log.warning("Unable to save discovery cache %s: %s",
+                        self.filename, e)
+            return
+        self.dirty = False
+        log.debug("Saved discovery cache %s", self.filename)
+
+    def stamp(self, path, kind):
+        """Return what has to stay the same for a cached result about the
+        entry at path to remain valid, or None if it is gone.
+        """
+        if kind == DIR:
+            # a plain directory is checked through its entries
+            return ()
+        if kind == PACKAGE:
+            for init in _init_files:
+                init_path = os.path.join(path, init)
+                if os.path.isfile(init_path):
+                    path = init_path
+                    break
+            else:
+                return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def dirStamp(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def entries(self, path):
+        """Return the cached list of (entry_path, kind) wanted in the
+        directory at path, or None if the directory has changed.
+        """
+        record = self.dirs.get(path)
+        if record is None or record[0] != self.dirStamp(path):
+            return None
+        return record[1]
+
+    def setEntries(self, path, mtime, entries):
+        """Remember the (entry_path, kind) list wanted in the directory at
+        path, as of the given directory mtime.
+        """
+        self.dirs[path] = (mtime, entries)
+        self._checked.clear()
+        self.dirty = True
+
+    def isEmpty(self, path, kind):
+        """Is the entry at path known to hold no tests, and unchanged
+        since that was found out?
+        """
+        key = (path, kind)
+        if key not in self._checked:
+            self._checked[key] = self._isEmpty(path, kind)
+        return self._checked[key]
+
+    def _isEmpty(self, path, kind):
+        stamp = self.empty.get((path, kind))
+        if stamp is None or stamp != self.stamp(path, kind):
+            return False
+        if kind in (PACKAGE, DIR):
+            entries = self.entries(path)
+            if entries is None:
+                return False
+            for entry_path, entry_kind in entries:
+                if not self.isEmpty(entry_path, entry_kind):
+                    return False
+        return True
+
+    def setEmpty(self, path, kind, empty=True):
+        """Record whether the entry at path held no tests this run.
+        """
+        key = (path, kind)
+        if empty:
+            stamp = self.stamp(path, kind)
+            if stamp is None or self.empty.get(key) == stamp:
+                return
+            self.empty[key] = stamp
+        elif key in self.empty:
+            del self.empty[key]
+        else:
+            return
+        self._checked.clear()
+        self.dirty = True
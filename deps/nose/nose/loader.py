@@ -13,6 +13,7 @@ import os
 import sys
 import unittest
 from inspect import isfunction, ismethod
+from nose import discovery
 from nose.case import FunctionTestCase, MethodTestCase
 from nose.failure import Failure
 from nose.config import Config
@@ -51,6 +52,7 @@ class TestLoader(unittest.TestLoader):
     workingDir = None
     selector = None
     suiteClass = None
+    discoveryCache = None
     
     def __init__(self, config=None, importer=None, workingDir=None,
                  selector=None):
@@ -71,6 +73,10 @@ class TestLoader(unittest.TestLoader):
           provided, it will be instantiated with one argument, the
           current config. If not provided, a `nose.selector.Selector`_
           is used.
+
+        If config.discoveryCache names a file, a
+        `nose.discovery.DiscoveryCache`_ saved in that file is used to
+        skip unchanged directories and modules without tests.
         """
         if config is None:
             config = Config()
@@ -89,6 +95,13 @@ class TestLoader(unittest.TestLoader):
         if config.addPaths:
             add_path(workingDir, config)        
         self.suiteClass = ContextSuiteFactory(config=config)
+        if (getattr(config, 'discoveryCache', None)
+            and not getattr(config, 'worker', False)):
+            filename = op_join(self.workingDir,
+                               os.path.expanduser(config.discoveryCache))
+            self.discoveryCache = discovery.DiscoveryCache(
+                filename, discovery.selectionKey(config, selector))
+        self._dirDepth = 0
         unittest.TestLoader.__init__(self)     
 
     def getTestCaseNames(self, testCaseClass):
@@ -127,6 +140,70 @@ class TestLoader(unittest.TestLoader):
         if self.config.addPaths:
             paths_added = add_path(path, self.config)
 
+        cache = self.discoveryCache
+        if cache is None:
+            entries = self._wantedEntries(path)
+        else:
+            self._dirDepth += 1
+            entries = cache.entries(path)
+            if entries is None:
+                mtime = cache.dirStamp(path)
+                entries = list(self._wantedEntries(path))
+                cache.setEntries(path, mtime, entries)
+        found = False
+        for entry_path, kind in entries:
+            if cache is not None and cache.isEmpty(entry_path, kind):
+                log.debug("%s held no tests last run, skipping", entry_path)
+                continue
+            if kind in (discovery.MODULE, discovery.FILE):
+                plugins.beforeContext()
+                if kind == discovery.MODULE:
+                    test = self.loadTestsFromName(entry_path, discovered=True)
+                else:
+                    test = self.loadTestsFromFile(entry_path)
+            elif kind == discovery.PACKAGE:
+                # Load the entry as a package: given the full path,
+                # loadTestsFromName() will figure it out
+                test = self.loadTestsFromName(entry_path, discovered=True)
+            else:
+                # Another test dir in this one: recurse lazily
+                test = self.suiteClass(
+                    lambda: self.loadTestsFromDir(entry_path))
+            if cache is not None:
+                empty = discovery.isEmptySuite(test)
+                cache.setEmpty(entry_path, kind, empty)
+                found = found or not empty
+            yield test
+            if kind in (discovery.MODULE, discovery.FILE):
+                plugins.afterContext()
+        tests = []
+        for test in plugins.loadTestsFromDir(path):
+            tests.append(test)
+        # TODO: is this try/except needed?
+        try:
+            if tests:
+                yield self.suiteClass(tests)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            yield self.suiteClass([Failure(*sys.exc_info())])
+        
+        if cache is not None:
+            cache.setEmpty(path, discovery.DIR, not (found or tests))
+            self._dirDepth -= 1
+            if not self._dirDepth:
+                cache.save()
+
+        # pop paths
+        if self.config.addPaths:
+            map(remove_path, paths_added)
+        plugins.afterDirectory(path)
+
+    def _wantedEntries(self, path):
+        """Yield (entry_path, kind) for each entry of the directory at
+        path that the selector wants, in loading order. kind is one of
+        the entry kinds in `nose.discovery`.
+        """
         entries = os.listdir(path)
         entries.sort(lambda a, b: match_last(a, b, self.config.testMatch))
         for entry in entries:
@@ -151,38 +228,14 @@ class TestLoader(unittest.TestLoader):
             is_package = ispackage(entry_path)
             if wanted:
                 if is_file:
-                    plugins.beforeContext()
                     if entry.endswith('.py'):
-                        yield self.loadTestsFromName(
-                            entry_path, discovered=True)
+                        yield entry_path, discovery.MODULE
                     else:
-                        yield self.loadTestsFromFile(entry_path)
-                    plugins.afterContext()
+                        yield entry_path, discovery.FILE
                 elif is_package:
-                    # Load the entry as a package: given the full path,
-                    # loadTestsFromName() will figure it out
-                    yield self.loadTestsFromName(
-                        entry_path, discovered=True)
+                    yield entry_path, discovery.PACKAGE
                 else:
-                    # Another test dir in this one: recurse lazily
-                    yield self.suiteClass(
-                        lambda: self.loadTestsFromDir(entry_path))
-        tests = []
-        for test in plugins.loadTestsFromDir(path):
-            tests.append(test)
-        # TODO: is this try/except needed?
-        try:
-            if tests:
-                yield self.suiteClass(tests)
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except:
-            yield self.suiteClass([Failure(*sys.exc_info())])
-        
-        # pop paths
-        if self.config.addPaths:
-            map(remove_path, paths_added)
-        plugins.afterDirectory(path)
+                    yield entry_path, discovery.DIR
 
     def loadTestsFromFile(self, filename):
         """Load tests from a non-module file. Default is to raise a
@@ -13,8 +13,10 @@ builtins = (
     ('nose.plugins.isolate', 'IsolationPlugin'),
     ('nose.plugins.failuredetail', 'FailureDetail'),
     ('nose.plugins.prof', 'Profile'),
+    ('nose.plugins.cprof', 'CProfile'),
     ('nose.plugins.skip', 'Skip'),
     ('nose.plugins.testid', 'TestId'),
+    ('nose.plugins.impact', 'ChangeImpact'),
     ('nose.plugins.multiprocess', 'MultiProcess'),
     ('nose.plugins.xunit', 'Xunit'),
     ('nose.plugins.allmodules', 'AllModules'),
@@ -0,0 +1,300 @@
+"""This plugin profiles each test with :mod:`cProfile`, which is part of the
+standard library since Python 2.5, and reports the slowest tests together
+with the functions that took the most time in each of them. To turn it
+on, use the ``--with-cprofile`` option or set the NOSE_WITH_CPROFILE
+environment variable.
+
+Unlike the :doc:`hotshot profile plugin <prof>`, which profiles the whole
+test run as one, this plugin keeps the profile of every test apart. The
+report lists the ``--cprofile-top`` slowest tests (10 by default), by wall
+clock time, each followed by its ``--cprofile-functions`` hottest
+functions (5 by default), then the hottest functions over all tests::
+
+  Slowest tests (cProfile)
+  ------------------------
+      2.031s  tests.test_search.test_reindex
+               tottime  cumtime    calls  function
+                 1.250    1.380    20000  search/index.py:88(tokenize)
+                 0.412    0.412      310  <method 'sort' of 'list' objects>
+      ...
+
+Functions are ranked by their own time; use ``--cprofile-sort=cumulative``
+to rank them by the time spent in them and the functions they call, or
+``--cprofile-sort=calls`` to rank them by number of calls.
+
+With ``--cprofile-by=module`` the profiles of all tests in a module are
+added together, and the report lists the slowest test modules instead.
+Module and class fixtures are not profiled in either mode.
+
+When tests run in ``--processes`` workers, each worker profiles the tests
+it runs and the main process merges them all into one report. Use
+``--cprofile-stats-file`` to also save the merged profile of all tests,
+in the format of :meth:`pstats.Stats.dump_stats`, for further analysis
+with :mod:`pstats` or other tools.
+
+Do not combine this plugin with ``--with-profile``: only one profiler can
+be active at a time.
+"""
+
+try:
+    import cProfile
+    import pstats
+except ImportError:
+    cProfile, pstats = None, None
+import heapq
+import logging
+import os
+import shutil
+import tempfile
+import time
+from nose.plugins.base import Plugin
+
+try:
+    from cPickle import dump, load, HIGHEST_PROTOCOL
+except ImportError:
+    from pickle import dump, load, HIGHEST_PROTOCOL
+
+log = logging.getLogger('nose.plugins')
+
+_sort_fields = {'tottime': 2, 'time': 2, 'cumulative': 3, 'cumtime': 3,
+                'calls': 1, 'ncalls': 1}
+
+
+class _Snapshot(object):
+    """Profile data in the form that :class:`pstats.Stats` loads from a
+    profiler.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class CProfile(Plugin):
+    """
+    Profile each test with cProfile, and report the slowest tests and the
+    hottest functions in each.
+    """
+    name = 'cprofile'
+    statsDir = None
+
+    def options(self, parser, env):
+        """Register commandline options.
+        """
+        if not self.available():
+            return
+        Plugin.options(self, parser, env)
+        parser.add_option('--cprofile-by', action='store',
+                          dest='cprofile_by', metavar="UNIT",
+                          type='choice', choices=('test', 'module'),
+                          default=env.get('NOSE_CPROFILE_BY', 'test'),
+                          help="Report profiles per 'test' (the default) or "
+                          "per test 'module' [NOSE_CPROFILE_BY]")
+        parser.add_option('--cprofile-top', action='store', type='int',
+                          dest='cprofile_top', metavar="N",
+                          default=env.get('NOSE_CPROFILE_TOP', 10),
+                          help="Number of slowest tests or modules to "
+                          "report; default 10 [NOSE_CPROFILE_TOP]")
+        parser.add_option('--cprofile-functions', action='store', type='int',
+                          dest='cprofile_functions', metavar="N",
+                          default=env.get('NOSE_CPROFILE_FUNCTIONS', 5),
+                          help="Number of hottest functions to report for "
+                          "each; default 5 [NOSE_CPROFILE_FUNCTIONS]")
+        parser.add_option('--cprofile-sort', action='store',
+                          dest='cprofile_sort', metavar="SORT",
+                          type='choice', choices=_sort_fields.keys(),
+                          default=env.get('NOSE_CPROFILE_SORT', 'tottime'),
+                          help="Rank functions by 'tottime' (the default), "
+                          "'cumulative' or 'calls' [NOSE_CPROFILE_SORT]")
+        parser.add_option('--cprofile-stats-file', action='store',
+                          dest='cprofile_stats_file', metavar="FILE",
+                          default=env.get('NOSE_CPROFILE_STATS_FILE'),
+                          help="Save the merged profile of all tests in "
+                          "this file [NOSE_CPROFILE_STATS_FILE]")
+
+    def available(cls):
+        return cProfile is not None
+    available = classmethod(available)
+
+    def configure(self, options, conf):
+        """Configure plugin.
+        """
+        if not self.available():
+            self.enabled = False
+            return
+        Plugin.configure(self, options, conf)
+        if not self.enabled:
+            return
+        self.byModule = options.cprofile_by == 'module'
+        self.top = int(options.cprofile_top)
+        self.functions = int(options.cprofile_functions)
+        self.sortField = _sort_fields[options.cprofile_sort]
+        self.statsFile = options.cprofile_stats_file
+        # {unit: wall clock seconds} and {unit: pstats.Stats}; in test
+        # mode only the stats of the slowest tests are kept
+        self.durations = {}
+        self.stats = {}
+        self._slowest = []
+        self.total = None
+        self._prof = None
+        self._start = None
+        self._depth = 0
+        self._workerFile = None
+
+    def begin(self):
+        """Set up the directory in which --processes workers leave the
+        profiles of the tests they run, or open this worker's file there.
+        """
+        if self.conf.worker:
+            statsDir = getattr(self.conf, 'cprofile_stats_dir', None)
+            if statsDir:
+                self._workerFile = open(
+                    os.path.join(statsDir, 'worker-%d' % os.getpid()), 'ab')
+        elif getattr(self.conf, 'multiprocess_workers', 0):
+            self.statsDir = tempfile.mkdtemp(prefix='nose-cprofile-')
+            # passed on to the workers with the rest of the config
+            self.conf.cprofile_stats_dir = self.statsDir
+
+    def beforeTest(self, test):
+        # tests that run tests are profiled as one
+        self._depth += 1
+        if self._depth > 1:
+            return
+        self._prof = cProfile.Profile()
+        self._start = time.time()
+        self._prof.enable()
+
+    def afterTest(self, test):
+        self._depth -= 1
+        prof = self._prof
+        if self._depth or prof is None:
+            return
+        prof.disable()
+        duration = time.time() - self._start
+        self._prof = None
+        prof.create_stats()
+        unit = self.unit(test)
+        if self._workerFile is not None:
+            dump((unit, duration, prof.stats), self._workerFile,
+                 HIGHEST_PROTOCOL)
+            self._workerFile.flush()
+        else:
+            self.add(unit, duration, prof.stats)
+
+    def unit(self, test):
+        """Return the name of the test, or of its module when profiling
+        by module.
+        """
+        if self.byModule:
+            try:
+                module = test.address()[1]
+            except (AttributeError, TypeError):
+                module = None
+            if module is not None:
+                return module
+        try:
+            return test.id()
+        except AttributeError:
+            return str(test)
+
+    def add(self, unit, duration, stats):
+        """Add the profile data of one test run to the totals and to the
+        test's (or module's) profile.
+        """
+        self.durations[unit] = self.durations.get(unit, 0) + duration
+        if not stats:
+            return
+        # Stats objects take over the dict they load, so the totals get
+        # a copy
+        if self.total is None:
+            self.total = pstats.Stats(_Snapshot(dict(stats)))
+        else:
+            self.total.add(_Snapshot(dict(stats)))
+        stats = pstats.Stats(_Snapshot(stats))
+        if unit in self.stats:
+            self.stats[unit].add(stats)
+            return
+        self.stats[unit] = stats
+        if not self.byModule:
+            # a test's duration is final: only keep the slowest ones
+            heapq.heappush(self._slowest, (duration, unit))
+            if len(self._slowest) > self.top:
+                duration, unit = heapq.heappop(self._slowest)
+                del self.stats[unit]
+
+    def collectWorkerStats(self):
+        """Add the profiles that --processes workers left in the stats
+        directory.
+        """
+        if not self.statsDir:
+            return
+        for name in sorted(os.listdir(self.statsDir)):
+            fh = open(os.path.join(self.statsDir, name), 'rb')
+            try:
+                while True:
+                    try:
+                        unit, duration, stats = load(fh)
+                    except EOFError:
+                        break
+                    self.add(unit, duration, stats)
+            finally:
+                fh.close()
+        shutil.rmtree(self.statsDir, ignore_errors=True)
+        self.statsDir = None
+
+    def report(self, stream):
+        """Output the slowest tests and their hottest functions.
+        """
+        if self.conf.worker:
+            return
+        self.collectWorkerStats()
+        if self.total is None:
+            return
+        if self.byModule:
+            title = 'Slowest test modules (cProfile)'
+        else:
+            title = 'Slowest tests (cProfile)'
+        stream.writeln(title)
+        stream.writeln('-' * len(title))
+        slowest = [(duration, unit) for unit, duration
+                   in self.durations.iteritems() if unit in self.stats]
+        slowest.sort()
+        slowest.reverse()
+        for duration, unit in slowest[:self.top]:
+            stream.writeln('  %7.3fs  %s' % (duration, unit))
+            self.writeFunctions(stream, self.stats[unit])
+        title = 'Hottest functions over all tests (cProfile)'
+        stream.writeln()
+        stream.writeln(title)
+        stream.writeln('-' * len(title))
+        self.writeFunctions(stream, self.total)
+        if self.statsFile:
+            self.total.dump_stats(self.statsFile)
+            stream.writeln('Profile of all tests saved in %s' % self.statsFile)
+
+    def writeFunctions(self, stream, stats):
+        field = self.sortField
+        hottest = heapq.nlargest(self.functions, stats.stats.iteritems(),
+                                 key=lambda (func, data): data[field])
+        stream.writeln('  %18s %8s %8s  %s' % (
+            'tottime', 'cumtime', 'calls', 'function'))
+        for func, (cc, nc, tt, ct, callers) in hottest:
+            stream.writeln('  %18.3f %8.3f %8d  %s' % (
+                tt, ct, nc, self.funcName(func)))
+
+    def funcName(self, func):
+        filename, line, name = func
+        if filename.startswith(self.conf.workingDir + os.sep):
+            filename = filename[len(self.conf.workingDir) + 1:]
+        if filename == '~':
+            # built-in functions
+            return name
+        return '%s:%d(%s)' % (filename, line, name)
+
+    def finalize(self, result):
+        """Remove the workers' stats directory, if it is left.
+        """
+        if self.statsDir:
+            shutil.rmtree(self.statsDir, ignore_errors=True)
+            self.statsDir = None
@@ -0,0 +1,303 @@
+"""
+This plugin runs only the tests that may be affected by what changed
+since the last run. While tests run, it records which source files each
+test touched: its own module, every module whose functions or methods
+it called, and the modules whose functions ran while its test module was
+imported. On the next run it selects only the test functions and methods
+for which one of those files has changed, tests that failed last time,
+and tests it has never seen.
+
+Activate it with ``--with-impact``. The first run records every test::
+
+  % nosetests -v --with-impact
+  tests.test_a ... ok
+  tests.test_b ... ok
+  tests.test_c ... ok
+
+After changing a module used only by ``tests.test_b``, only that test
+runs::
+
+  % nosetests -v --with-impact
+  tests.test_b ... ok
+
+And when nothing has changed, nothing runs.
+
+The record is kept in the file ``.noseimpact``, next to the test ids file
+of the :doc:`testid plugin <testid>` (``.noseids`` in the working
+directory, unless ``--id-file`` says otherwise); use ``--impact-file`` to
+put it elsewhere. Only files below the working directory are recorded,
+unless directories are given with ``--impact-path``. Pass
+``--impact-all`` to run (and record) all tests without selecting.
+
+.. note ::
+
+  Only calls made from the main thread while a test, its setup or its
+  teardown runs, or while its module is being imported, are recorded.
+  Module and class fixtures and data files are not tracked, nor are the
+  top-level code and class bodies of other modules: a test that only
+  reads a constant from another module, without calling any of its
+  functions or methods, is not selected when that constant changes.
+  Tests are not recorded while another tracer (such as coverage or a
+  debugger) is active, nor in ``--processes`` workers: those tests are
+  selected again on every run until they are recorded. Tests that other
+  plugins load (such as doctests) are never deselected.
+"""
+__test__ = False
+
+import logging
+import os
+import sys
+from nose.plugins.base import Plugin
+from nose.util import set, src, test_address, tolist
+
+try:
+    from cPickle import dump, load, HIGHEST_PROTOCOL
+except ImportError:
+    from pickle import dump, load, HIGHEST_PROTOCOL
+
+log = logging.getLogger(__name__)
+
+# code flag of function bodies, see Include/code.h
+CO_OPTIMIZED = 0x0001
+
+
+class ChangeImpact(Plugin):
+    """
+    Run only the tests affected by the source files changed since the
+    last run.
+    """
+    name = 'impact'
+    version = 1
+
+    def options(self, parser, env):
+        """Register commandline options.
+        """
+        Plugin.options(self, parser, env)
+        parser.add_option('--impact-file', action='store',
+                          dest='impactFile', metavar="FILE",
+                          default=env.get('NOSE_IMPACT_FILE'),
+                          help="Store the files each test touched in this "
+                          "file. Default is the file .noseimpact next to the "
+                          "test ids file. [NOSE_IMPACT_FILE]")
+        parser.add_option('--impact-path', action='append',
+                          dest='impactPaths', metavar="PATH",
+                          default=env.get('NOSE_IMPACT_PATH'),
+                          help="Record only source files below this "
+                          "directory. May be specified multiple times. "
+                          "Default is the working directory. "
+                          "[NOSE_IMPACT_PATH]")
+        parser.add_option('--impact-all', action='store_true',
+                          dest='impactAll', default=False,
+                          help="Run all tests, recording the files they "
+                          "touch, instead of only the tests affected by "
+                          "changes.")
+
+    def configure(self, options, conf):
+        """Configure plugin.
+        """
+        Plugin.configure(self, options, conf)
+        if not self.enabled:
+            return
+        if options.impactFile:
+            self.impactFile = os.path.expanduser(options.impactFile)
+        else:
+            idfile = getattr(options, 'testIdFile', None) or '.noseids'
+            self.impactFile = os.path.join(
+                os.path.dirname(os.path.expanduser(idfile)), '.noseimpact')
+        if not os.path.isabs(self.impactFile):
+            self.impactFile = os.path.join(conf.workingDir, self.impactFile)
+        paths = []
+        for path in tolist(options.impactPaths or [conf.workingDir]):
+            path = os.path.join(conf.workingDir, os.path.expanduser(path))
+            paths.append(os.path.normcase(os.path.abspath(path)) + os.sep)
+        self.paths = tuple(paths)
+        self.selectAll = options.impactAll
+        self.recording = not conf.worker
+        # {test address: {source file: stamp}} and failed test addresses
+        self.tests = {}
+        self.failed = set()
+        # this run's records
+        self.ran = {}
+        self.failedNow = set()
+        self.importDeps = {}
+        self._stamps = {}
+        self._filenames = {}
+        self._touched = None
+        self._depth = 0
+        self._warned = False
+
+    def begin(self):
+        """Load the record of the last run.
+        """
+        try:
+            fh = open(self.impactFile, 'rb')
+            try:
+                data = load(fh)
+            finally:
+                fh.close()
+        except IOError:
+            log.debug("No impact file %s, running all tests", self.impactFile)
+            return
+        except Exception, e:
+            log.warning("Ignoring unreadable impact file %s: %s",
+                        self.impactFile, e)
+            return
+        if data.get('version') != self.version:
+            return
+        self.tests = data['tests']
+        self.failed = data['failed']
+        log.debug("Loaded impact records of %s tests from %s",
+                  len(self.tests), self.impactFile)
+
+    def finalize(self, result):
+        """Save the files touched by the tests that ran.
+        """
+        if not self.recording:
+            return
+        self.tests.update(self.ran)
+        self.failed = (self.failed - set(self.ran)) | self.failedNow
+        for addr in self.tests.keys():
+            if addr[0] is not None and not os.path.exists(addr[0]):
+                del self.tests[addr]
+                self.failed.discard(addr)
+        fh = open(self.impactFile, 'wb')
+        try:
+            dump({'version': self.version,
+                  'tests': self.tests,
+                  'failed': self.failed}, fh, HIGHEST_PROTOCOL)
+        finally:
+            fh.close()
+        log.debug("Saved impact records of %s tests (%s ran) to %s",
+                  len(self.tests), len(self.ran), self.impactFile)
+
+    def wantFunction(self, function):
+        """Deselect the test function if nothing it touched has changed.
+        """
+        return self.affected(function)
+
+    def wantMethod(self, method):
+        """Deselect the test method if nothing it touched has changed.
+        """
+        return self.affected(method)
+
+    def affected(self, test):
+        """Return False if the test is recorded and none of the files it
+        touched has changed, None (no opinion) otherwise.
+        """
+        if self.selectAll:
+            return None
+        try:
+            addr = test_address(test)
+        except (TypeError, KeyError):
+            return None
+        deps = self.tests.get(addr)
+        if deps is None or addr in self.failed:
+            return None
+        stamp = self.stamp
+        for filename, recorded in deps.iteritems():
+            if stamp(filename) != recorded:
+                log.debug("%s changed, selecting %s", filename, addr)
+                return None
+        return False
+
+    def stamp(self, filename):
+        """Return the (mtime, size) of a file as of its first use in this
+        run, or None if it does not exist.
+        """
+        try:
+            return self._stamps[filename]
+        except KeyError:
+            try:
+                st = os.stat(filename)
+                stamp = (st.st_mtime, st.st_size)
+            except OSError:
+                stamp = None
+            self._stamps[filename] = stamp
+            return stamp
+
+    def beforeImport(self, filename, module):
+        self._start()
+
+    def afterImport(self, filename, module):
+        touched = self._stop()
+        if touched is not None:
+            self.importDeps[self._filename(filename)] = touched
+
+    def beforeTest(self, test):
+        self._start()
+
+    def afterTest(self, test):
+        touched = self._stop()
+        if touched is None:
+            return
+        try:
+            addr = test.address()
+        except (TypeError, KeyError):
+            return
+        filename = self._filename(addr[0] or '')
+        if filename is not None:
+            touched.add(filename)
+            touched.update(self.importDeps.get(filename, ()))
+        deps = self.ran.setdefault(addr, {})
+        for filename in touched:
+            deps[filename] = self.stamp(filename)
+        if test.passed is False:
+            self.failedNow.add(addr)
+
+    def _start(self):
+        # imports and tests may nest (when tests load tests); only the
+        # outermost one is recorded
+        self._depth += 1
+        if self._depth > 1 or not self.recording:
+            return
+        gettrace = getattr(sys, 'gettrace', None)
+        if gettrace is not None and gettrace() is not None:
+            if not self._warned:
+                log.warning("Another tracer is active: not recording which "
+                            "files tests touch")
+                self._warned = True
+            return
+        self._touched = {}
+        sys.settrace(self._trace)
+
+    def _stop(self):
+        self._depth -= 1
+        touched = self._touched
+        if self._depth or touched is None:
+            return None
+        sys.settrace(None)
+        self._touched = None
+        result = set()
+        for co_filename in touched:
+            filename = self._filename(co_filename)
+            if filename is not None:
+                result.add(filename)
+        return result
+
+    def _trace(self, frame, event, arg):
+        # only 'call' events reach a global trace function that returns
+        # None, so this costs one dict store per function call. The
+        # top-level code and class bodies of imported modules only define
+        # what their functions hold, which is recorded when those are
+        # called; counting them would make every test depend on every
+        # module its test module imports. Only function code (including
+        # lambdas and generator expressions) is compiled with
+        # CO_OPTIMIZED; module, class and exec code is not.
+        code = frame.f_code
+        if code.co_flags & CO_OPTIMIZED:
+            self._touched[code.co_filename] = 1
+
+    def _filename(self, co_filename):
+        """Return the normalized source file of a code filename, or None
+        if it is not a recorded source file.
+        """
+        try:
+            return self._filenames[co_filename]
+        except KeyError:
+            filename = None
+            if co_filename:
+                path = src(os.path.normcase(os.path.abspath(co_filename)))
+                if path.startswith(self.paths) and os.path.isfile(path):
+                    filename = path
+            self._filenames[co_filename] = filename
+            return filename
@@ -50,6 +50,29 @@ initializes a shared database -- then set ``_multiprocess_shared_ = True`` in
 the context. These fixtures will then execute in the primary nose process, and
 tests in those contexts will be individually dispatched to run in parallel.
 
+Scheduling long tests first
+^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+By default, tests are dispatched in the order they are collected, so a few
+long tests collected last can keep one worker busy long after the others
+have finished. Use ``--process-durations=FILE`` to record how long each
+dispatched test or suite took in that file. In later runs, tests are
+dispatched longest first, with tests that have no recorded duration yet
+ahead of all others.
+
+Forking workers after import
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+Workers are started only once all tests have been collected, so on platforms
+where multiprocessing forks, the test modules imported in the main process
+are already loaded in each worker. Normally, each worker still loads every
+test it is sent again, by name. Use ``--process-fork-after-import`` to have
+workers run the test objects collected in the main process instead, which
+avoids resolving names and building suites again for each test. Tests with
+class, module or package fixtures, and the tests generators yield, are still
+loaded by name, since only that runs their fixtures and every generated
+test. This option has no effect on platforms without ``os.fork``.
+
 How results are collected and reported
 ======================================
 
@@ -88,14 +111,18 @@ import time
 import traceback
 import unittest
 import pickle
+try:
+    from cPickle import dump, load
+except ImportError:
+    from pickle import dump, load
 import nose.case
 from nose.core import TextTestRunner
 from nose import failure
 from nose import loader
 from nose.plugins.base import Plugin
 from nose.result import TextTestResult
-from nose.suite import ContextSuite
-from nose.util import test_address
+from nose.suite import ContextSuite, ContextSuiteFactory
+from nose.util import isclass, test_address
 try:
     # 2.7+
     from unittest.runner import _WritelnDecorator
@@ -112,6 +139,10 @@ log = logging.getLogger(__name__)
 
 Process = Queue = Pool = Event = None
 
+# Tests collected in the main process, by address, for workers forked with
+# --process-fork-after-import. Only filled while the workers are started.
+_forked_tests = {}
+
 def _import_mp():
     global Process, Queue, Pool, Event
     try:
@@ -167,6 +198,20 @@ class MultiProcess(Plugin):
                           metavar="SECONDS",
                           help="Set timeout for return of results from each "
                           "test runner process. [NOSE_PROCESS_TIMEOUT]")
+        parser.add_option("--process-durations", action="store",
+                          default=env.get('NOSE_PROCESS_DURATIONS'),
+                          dest="multiprocess_durations",
+                          metavar="FILE",
+                          help="Record how long each dispatched test takes "
+                          "in this file, and dispatch the longest tests "
+                          "first in later runs. [NOSE_PROCESS_DURATIONS]")
+        parser.add_option("--process-fork-after-import", action="store_true",
+                          default=env.get('NOSE_PROCESS_FORK_AFTER_IMPORT'),
+                          dest="multiprocess_fork_after_import",
+                          help="Have workers run the tests collected in the "
+                          "main process instead of loading each test again "
+                          "by name. Only used where workers are forked. "
+                          "[NOSE_PROCESS_FORK_AFTER_IMPORT]")
 
     def configure(self, options, config):
         """
@@ -195,6 +240,15 @@ class MultiProcess(Plugin):
             self.enabled = True
             self.config.multiprocess_workers = workers
             self.config.multiprocess_timeout = int(options.multiprocess_timeout)
+            durations = getattr(options, 'multiprocess_durations', None)
+            if durations:
+                durations = os.path.expanduser(durations)
+                if not os.path.isabs(durations):
+                    durations = os.path.join(config.workingDir, durations)
+            self.config.multiprocess_durations = durations
+            self.config.multiprocess_fork_after_import = bool(
+                getattr(options, 'multiprocess_fork_after_import', False)
+                and hasattr(os, 'fork'))
             self.status['active'] = True
 
     def prepareTestLoader(self, loader):
@@ -245,6 +299,15 @@ class MultiProcessTestRunner(TextTestRunner):
         to_teardown = []
         shouldStop = Event()
 
+        durations_file = getattr(self.config, 'multiprocess_durations', None)
+        fork_after_import = getattr(
+            self.config, 'multiprocess_fork_after_import', False)
+        durations = self.loadDurations(durations_file)
+        # addresses to dispatch, in collection order, and the collected
+        # test for each
+        addresses = []
+        cases = {}
+
         result = self._makeResult()
         start = time.time()
 
@@ -271,18 +334,28 @@ class MultiProcessTestRunner(TextTestRunner):
                     to_teardown.append(case)
                     for _t in case:
                         test_addr = self.address(_t)
-                        testQueue.put(test_addr, block=False)
+                        addresses.append(test_addr)
+                        self.collectCase(cases, test_addr, _t)
                         tasks[test_addr] = None
-                        log.debug("Queued shared-fixture test %s (%s) to %s",
-                                  len(tasks), test_addr, testQueue)
+                        log.debug("Collected shared-fixture test %s (%s)",
+                                  len(tasks), test_addr)
 
             else:
                 test_addr = self.address(case)
-                testQueue.put(test_addr, block=False)
+                addresses.append(test_addr)
+                self.collectCase(cases, test_addr, case)
                 tasks[test_addr] = None
-                log.debug("Queued test %s (%s) to %s",
-                          len(tasks), test_addr, testQueue)
+                log.debug("Collected test %s (%s)", len(tasks), test_addr)
+
+        for test_addr in self.schedule(addresses, durations):
+            testQueue.put(test_addr, block=False)
+            log.debug("Queued test %s to %s", test_addr, testQueue)
 
+        if fork_after_import:
+            # workers inherit the collected tests when forked
+            for test_addr, case in cases.items():
+                if case is not None:
+                    _forked_tests[test_addr] = case
         log.debug("Starting %s workers", self.config.multiprocess_workers)
         for i in range(self.config.multiprocess_workers):
             p = Process(target=runner, args=(i,
@@ -296,13 +369,15 @@ class MultiProcessTestRunner(TextTestRunner):
             p.start()
             workers.append(p)
             log.debug("Started worker process %s", i+1)
+        _forked_tests.clear()
+        cases.clear()
 
         num_tasks = len(tasks)
         while tasks:
             log.debug("Waiting for results (%s/%s tasks)",
                       len(completed), num_tasks)
             try:
-                addr, batch_result = resultQueue.get(
+                addr, batch_result, duration = resultQueue.get(
                     timeout=self.config.multiprocess_timeout)
                 log.debug('Results received for %s', addr)
                 try:
@@ -311,6 +386,7 @@ class MultiProcessTestRunner(TextTestRunner):
                     log.debug("Got result for unknown task? %s", addr)
                 else:
                     completed[addr] = batch_result
+                    durations[addr] = duration
                 self.consolidate(result, batch_result)
                 if (self.config.stopOnError
                     and not result.wasSuccessful()):
@@ -341,6 +417,7 @@ class MultiProcessTestRunner(TextTestRunner):
 
         stop = time.time()
 
+        self.saveDurations(durations_file, durations)
         result.printErrors()
         result.printSummary(start, stop)
         self.config.plugins.finalize(result)
@@ -376,6 +453,109 @@ class MultiProcessTestRunner(TextTestRunner):
             parts.append(call)
         return ':'.join(map(str, parts))
 
+    def collectCase(self, cases, test_addr, case):
+        """Record a collected test in cases, by address, if workers
+        forked with --process-fork-after-import can run it as it is.
+
+        Loading a test by name wraps it in the suites that run the
+        fixtures of its class, module and packages, and runs all the
+        tests a generator yields. A collected test object carries none of
+        that, so only plain tests without fixtures around them are
+        reused. Tests that share their address with another, such as
+        the tests a generator yields, are always loaded by name.
+        """
+        if test_addr in cases:
+            cases[test_addr] = None
+        elif self.canReuse(case):
+            cases[test_addr] = case
+        else:
+            cases[test_addr] = None
+
+    def canReuse(self, case):
+        """Is case a single, non-generated test with no class, module or
+        package fixtures?
+        """
+        if not isinstance(case, nose.case.Test):
+            return False
+        if getattr(case.test, 'arg', None):
+            # yielded by a generator
+            return False
+        try:
+            context = case.context
+            contexts = [context]
+            contexts.extend(ContextSuiteFactory().ancestry(context))
+        except (AttributeError, ImportError, TypeError):
+            return False
+        for context in contexts:
+            if isclass(context):
+                names = ContextSuite.classSetup + ContextSuite.classTeardown
+            else:
+                names = ContextSuite.moduleSetup + ContextSuite.moduleTeardown
+                if hasattr(context, '__path__'):
+                    names += (ContextSuite.packageSetup +
+                              ContextSuite.packageTeardown)
+            for name in names:
+                if hasattr(context, name):
+                    return False
+        return True
+
+    def schedule(self, addresses, durations):
+        """Return test addresses in the order they should be dispatched.
+
+        Without recorded durations, that is the order in which they were
+        collected. Otherwise tests are ordered longest first, and tests
+        with no recorded duration come before all others, in collection
+        order.
+        """
+        if not durations:
+            return addresses
+        longest = max(durations.values())
+        return sorted(addresses,
+                      key=lambda addr: -durations.get(addr, longest + 1))
+
+    def loadDurations(self, durations_file):
+        """Load the test durations recorded in durations_file, a dict
+        of {test address: seconds}.
+        """
+        if not durations_file:
+            return {}
+        try:
+            fh = open(durations_file, 'rb')
+            try:
+                durations = load(fh)
+            finally:
+                fh.close()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception, e:
+            log.debug("Unable to load test durations from %s: %s",
+                      durations_file, e)
+            return {}
+        if not isinstance(durations, dict):
+            return {}
+        log.debug("Loaded %s test durations from %s",
+                  len(durations), durations_file)
+        return durations
+
+    def saveDurations(self, durations_file, durations):
+        """Save test durations, including those recorded in earlier runs
+        for tests that did not run this time.
+        """
+        if not durations_file:
+            return
+        try:
+            fh = open(durations_file, 'wb')
+            try:
+                dump(durations, fh)
+            finally:
+                fh.close()
+        except (IOError, OSError), e:
+            log.warning("Unable to save test durations to %s: %s",
+                        durations_file, e)
+            return
+        log.debug("Saved %s test durations to %s",
+                  len(durations), durations_file)
+
     def nextBatch(self, test):
         # allows tests or suites to mark themselves as not safe
         # for multiprocess execution
@@ -493,18 +673,23 @@ def runner(ix, testQueue, resultQueue, shouldStop,
                 if shouldStop.is_set():
                     break
                 result = makeResult()
-                test = loader.loadTestsFromNames([test_addr])
+                start = time.time()
+                test = _forked_tests.pop(test_addr, None)
+                if test is None:
+                    test = loader.loadTestsFromNames([test_addr])
                 log.debug("Worker %s Test is %s (%s)", ix, test_addr, test)
 
                 try:
                     test(result)
-                    resultQueue.put((test_addr, batch(result)))
+                    resultQueue.put((test_addr, batch(result),
+                                     time.time() - start))
                 except KeyboardInterrupt, SystemExit:
                     raise
                 except:
                     log.exception("Error running test or returning results")
                     failure.Failure(*sys.exc_info())(result)
-                    resultQueue.put((test_addr, batch(result)))
+                    resultQueue.put((test_addr, batch(result),
+                                     time.time() - start))
         except Empty:
             log.debug("Worker %s timed out waiting for tasks", ix)
     finally:
@@ -0,0 +1,143 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from nose import discovery
+from nose.config import Config
+from nose.importer import Importer
+from nose.loader import TestLoader
+from nose.suite import LazySuite
+
+
+def write(path, text):
+    fh = open(path, 'w')
+    try:
+        fh.write(text)
+    finally:
+        fh.close()
+
+
+def touch_later(path):
+    # make sure the mtime changes even on coarse-grained filesystems
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+
+class CountingImporter(Importer):
+    def __init__(self, config=None):
+        Importer.__init__(self, config)
+        self.imported = []
+
+    def importFromPath(self, path, fqname):
+        self.imported.append(fqname)
+        return Importer.importFromPath(self, path, fqname)
+
+
+class TestDiscoveryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.dir, '.discovery')
+        self.tree = os.path.join(self.dir, 'tree')
+        os.mkdir(self.tree)
+        self.mods = sys.modules.keys()
+        self.path = sys.path[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        sys.path[:] = self.path
+        for mod in sys.modules.keys():
+            if mod not in self.mods:
+                del sys.modules[mod]
+
+    def test_is_empty_suite(self):
+        assert discovery.isEmptySuite(LazySuite([]))
+        assert discovery.isEmptySuite(LazySuite([LazySuite([])]))
+        assert not discovery.isEmptySuite(LazySuite([lambda: None]))
+        assert not discovery.isEmptySuite(LazySuite(lambda: iter([])))
+        assert not discovery.isEmptySuite(None)
+
+    def test_save_and_load(self):
+        test_file = os.path.join(self.tree, 'test_x.py')
+        write(test_file, '')
+        cache = discovery.DiscoveryCache(self.cache_file, 'key')
+        cache.setEntries(self.tree, cache.dirStamp(self.tree),
+                         [(test_file, discovery.MODULE)])
+        cache.setEmpty(test_file, discovery.MODULE)
+        cache.setEmpty(self.tree, discovery.DIR)
+        cache.save()
+
+        cache = discovery.DiscoveryCache(self.cache_file, 'key')
+        self.assertEqual(cache.entries(self.tree),
+                         [(test_file, discovery.MODULE)])
+        assert cache.isEmpty(self.tree, discovery.DIR)
+
+        other = discovery.DiscoveryCache(self.cache_file, 'other key')
+        self.assertEqual(other.entries(self.tree), None)
+        assert not other.isEmpty(self.tree, discovery.DIR)
+
+    def test_changes_invalidate(self):
+        test_file = os.path.join(self.tree, 'test_x.py')
+        write(test_file, '')
+        cache = discovery.DiscoveryCache(self.cache_file, 'key')
+        cache.setEntries(self.tree, cache.dirStamp(self.tree),
+                         [(test_file, discovery.MODULE)])
+        cache.setEmpty(test_file, discovery.MODULE)
+        cache.setEmpty(self.tree, discovery.DIR)
+        assert cache.isEmpty(self.tree, discovery.DIR)
+
+        touch_later(test_file)
+        cache._checked.clear()
+        assert not cache.isEmpty(test_file, discovery.MODULE)
+        assert not cache.isEmpty(self.tree, discovery.DIR)
+        assert cache.entries(self.tree) is not None
+
+        touch_later(self.tree)
+        self.assertEqual(cache.entries(self.tree), None)
+
+    def test_loader_skips_modules_without_tests(self):
+        pkg = os.path.join(self.tree, 'dcpkg')
+        os.mkdir(pkg)
+        write(os.path.join(pkg, '__init__.py'), '')
+        write(os.path.join(pkg, 'test_some.py'), 'def test_a():\n    pass\n')
+        write(os.path.join(pkg, 'test_none.py'), 'X = 1\n')
+        other = os.path.join(self.tree, 'dcother')
+        os.mkdir(other)
+        write(os.path.join(other, '__init__.py'), '')
+        write(os.path.join(other, 'test_empty.py'), '')
+
+        def collect():
+            for mod in sys.modules.keys():
+                if mod.startswith('dc'):
+                    del sys.modules[mod]
+            config = Config(workingDir=self.tree,
+                            discoveryCache=self.cache_file)
+            importer = CountingImporter(config)
+            loader = TestLoader(config=config, importer=importer)
+            count = loader.loadTestsFromDir(self.tree)
+            count = sum([suite.countTestCases() for suite in count])
+            return count, importer.imported
+
+        count, imported = collect()
+        self.assertEqual(count, 1)
+        assert 'dcpkg.test_none' in imported
+        assert 'dcother' in imported
+        assert os.path.exists(self.cache_file)
+
+        count, imported = collect()
+        self.assertEqual(count, 1)
+        assert 'dcpkg.test_some' in imported
+        assert 'dcpkg.test_none' not in imported
+        assert 'dcother' not in imported
+
+        write(os.path.join(other, 'test_empty.py'),
+              'def test_b():\n    pass\n')
+        touch_later(os.path.join(other, 'test_empty.py'))
+        count, imported = collect()
+        self.assertEqual(count, 2)
+        assert 'dcother.test_empty' in imported
+
+
+if __name__ == '__main__':
+    unittest.main()
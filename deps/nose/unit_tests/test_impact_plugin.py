@@ -0,0 +1,138 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from nose.config import Config
+from nose.plugins.builtin import ChangeImpact
+from nose.plugins.skip import SkipTest
+from nose.util import test_address
+import mock
+
+
+def helper():
+    return 1
+
+
+def test_using_helper():
+    assert helper()
+test_using_helper.__test__ = False
+
+
+class FakeTest:
+    def __init__(self, func, passed=True):
+        self.func = func
+        self.passed = passed
+
+    def address(self):
+        return test_address(self.func)
+
+
+class TestChangeImpactPlugin(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_plugin(self, **kw):
+        plug = ChangeImpact()
+        plug.can_configure = True
+        opt = mock.Bucket(**kw)
+        opt.enable_plugin_impact = True
+        opt.impactFile = os.path.join(self.dir, '.noseimpact')
+        if not opt.impactPaths:
+            opt.impactPaths = [os.path.dirname(os.path.abspath(__file__))]
+        plug.configure(opt, Config())
+        plug.begin()
+        return plug
+
+    def trace_call(self, plug, func, passed=True):
+        test = FakeTest(func, passed)
+        plug.beforeTest(test)
+        try:
+            func()
+        finally:
+            plug.afterTest(test)
+
+    def test_default_impact_file_is_next_to_id_file(self):
+        plug = ChangeImpact()
+        plug.can_configure = True
+        c = Config()
+        opt = mock.Bucket()
+        opt.enable_plugin_impact = True
+        opt.testIdFile = os.path.join(self.dir, 'ids')
+        plug.configure(opt, c)
+        self.assertEqual(plug.impactFile,
+                         os.path.join(self.dir, '.noseimpact'))
+
+    def test_records_and_selects(self):
+        if sys.gettrace() is not None:
+            raise SkipTest("another tracer is active")
+        plug = self.make_plugin()
+        # never recorded: no opinion
+        self.assertEqual(plug.affected(test_using_helper), None)
+        self.trace_call(plug, test_using_helper)
+        plug.finalize(None)
+
+        deps = plug.tests.values()[0]
+        this_file = plug._filename(__file__)
+        assert this_file in deps, deps
+
+        plug = self.make_plugin()
+        self.assertEqual(plug.affected(test_using_helper), False)
+
+        plug = self.make_plugin(impactAll=True)
+        self.assertEqual(plug.affected(test_using_helper), None)
+
+        # a changed dependency selects the test again
+        plug = self.make_plugin()
+        addr = plug.tests.keys()[0]
+        plug.tests[addr][this_file] = (0, 0)
+        self.assertEqual(plug.affected(test_using_helper), None)
+
+    def test_failed_tests_are_selected(self):
+        if sys.gettrace() is not None:
+            raise SkipTest("another tracer is active")
+        plug = self.make_plugin()
+        self.trace_call(plug, test_using_helper, passed=False)
+        plug.finalize(None)
+
+        plug = self.make_plugin()
+        self.assertEqual(plug.affected(test_using_helper), None)
+        self.trace_call(plug, test_using_helper)
+        plug.finalize(None)
+
+        plug = self.make_plugin()
+        self.assertEqual(plug.affected(test_using_helper), False)
+
+    def test_import_records_only_called_code(self):
+        if sys.gettrace() is not None:
+            raise SkipTest("another tracer is active")
+        write = lambda name, text: open(
+            os.path.join(self.dir, name), 'w').write(text)
+        write('impact_a.py', 'def f():\n    return 1\n')
+        write('impact_b.py', 'class K(object):\n    x = 1\n'
+              '    def m(self):\n        pass\n')
+        write('impact_test.py', 'import impact_a, impact_b\n'
+              'X = impact_a.f()\nclass T(object):\n    y = 2\n')
+        plug = self.make_plugin(impactPaths=[self.dir])
+        filename = os.path.join(self.dir, 'impact_test.py')
+        sys.path.insert(0, self.dir)
+        try:
+            plug.beforeImport(filename, 'impact_test')
+            try:
+                __import__('impact_test')
+            finally:
+                plug.afterImport(filename, 'impact_test')
+        finally:
+            sys.path.remove(self.dir)
+            for mod in ('impact_a', 'impact_b', 'impact_test'):
+                sys.modules.pop(mod, None)
+        deps = plug.importDeps[plug._filename(filename)]
+        self.assertEqual([os.path.basename(f) for f in deps], ['impact_a.py'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
 import imp
+import os
 import sys
+import tempfile
 from nose.loader import TestLoader
 from nose.plugins import multiprocess
 from nose.suite import ContextSuite
@@ -114,6 +116,94 @@ class TestMultiProcessTestRunner(unittest.TestCase):
         tests = list(r.nextBatch(l.loadTestsFromModule(mod_with_fixt2)))
         print tests
         self.assertEqual(len(tests), 3)
+
+    def test_schedule_without_durations_keeps_order(self):
+        r = multiprocess.MultiProcessTestRunner()
+        self.assertEqual(r.schedule(['a', 'b', 'c'], {}), ['a', 'b', 'c'])
+
+    def test_schedule_longest_first(self):
+        r = multiprocess.MultiProcessTestRunner()
+        durations = {'a': 0.1, 'b': 2.0, 'c': 0.5}
+        self.assertEqual(r.schedule(['a', 'b', 'c', 'new1', 'new2'],
+                                    durations),
+                         ['new1', 'new2', 'b', 'c', 'a'])
+
+    def test_durations_round_trip(self):
+        r = multiprocess.MultiProcessTestRunner()
+        fd, durations_file = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.assertEqual(r.loadDurations(durations_file), {})
+            r.saveDurations(durations_file, {'a': 1.5})
+            self.assertEqual(r.loadDurations(durations_file), {'a': 1.5})
+        finally:
+            os.remove(durations_file)
+        self.assertEqual(r.loadDurations(None), {})
+
+    def collect_forked(self, mod):
+        r = multiprocess.MultiProcessTestRunner()
+        l = TestLoader()
+        cases = {}
+        for case in r.nextBatch(l.loadTestsFromModule(mod)):
+            r.collectCase(cases, r.address(case), case)
+        return dict([(addr.split(':')[-1], case is not None)
+                     for addr, case in cases.items()])
+
+    def test_fork_after_import_reuses_plain_tests(self):
+        mod_fork_plain = imp.new_module('mod_fork_plain')
+        sys.modules['mod_fork_plain'] = mod_fork_plain
+        mod_fork_plain._multiprocess_can_split_ = True
+
+        def test_func():
+            pass
+        test_func.__module__ = 'mod_fork_plain'
+
+        def test_gen():
+            for i in range(0, 3):
+                yield check, i
+        test_gen.__module__ = 'mod_fork_plain'
+
+        def check(val):
+            pass
+
+        class Test(T):
+            pass
+
+        class Test_fixt(T_fixt):
+            _multiprocess_can_split_ = True
+
+        mod_fork_plain.test_func = test_func
+        mod_fork_plain.test_gen = test_gen
+        mod_fork_plain.Test = Test
+        mod_fork_plain.Test_fixt = Test_fixt
+        Test.__module__ = 'mod_fork_plain'
+        Test_fixt.__module__ = 'mod_fork_plain'
+
+        self.assertEqual(self.collect_forked(mod_fork_plain),
+                         {'test_func': True,
+                          'test_gen': False,
+                          'Test.test_a': True,
+                          'Test.test_b': True,
+                          'Test_fixt.test_a': False,
+                          'Test_fixt.test_b': False})
+
+    def test_fork_after_import_loads_tests_with_module_fixtures(self):
+        mod_fork_fixt = imp.new_module('mod_fork_fixt')
+        sys.modules['mod_fork_fixt'] = mod_fork_fixt
+        mod_fork_fixt._multiprocess_can_split_ = True
+
+        def setup_module():
+            pass
+
+        class Test(T):
+            pass
+
+        mod_fork_fixt.setup_module = setup_module
+        mod_fork_fixt.Test = Test
+        Test.__module__ = 'mod_fork_fixt'
+
+        self.assertEqual(self.collect_forked(mod_fork_fixt),
+                         {'Test.test_a': False, 'Test.test_b': False})
         
             
 if __name__ == '__main__':
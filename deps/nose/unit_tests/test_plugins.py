@@ -12,6 +12,7 @@ from nose.config import Config
 from nose.plugins.attrib import AttributeSelector
 from nose.plugins.base import Plugin
 from nose.plugins.cover import Coverage
+from nose.plugins.cprof import CProfile
 from nose.plugins.doctests import Doctest
 from nose.plugins.prof import Profile
 
@@ -410,5 +411,93 @@ class TestProfPlugin(unittest.TestCase):
         assert not os.path.exists(pfile), \
                "finalize did not remove temp file %s" % pfile
 
+
+class TestCProfilePlugin(unittest.TestCase):
+
+    class FakeTest:
+        def __init__(self, name, module):
+            self.name = name
+            self.module = module
+        def id(self):
+            return '%s.%s' % (self.module, self.name)
+        def address(self):
+            return (None, self.module, self.name)
+
+    class Stream:
+        def __init__(self):
+            self.lines = []
+        def writeln(self, line=''):
+            self.lines.append(line)
+
+    def make_plugin(self, args=()):
+        if not CProfile.available():
+            raise SkipTest("cProfile not available")
+        parser = OptionParser()
+        plug = CProfile()
+        plug.add_options(parser, {})
+        options, _ = parser.parse_args(['--with-cprofile'] + list(args))
+        plug.configure(options, Config())
+        plug.begin()
+        return plug
+
+    def profile_calls(self, plug, tests):
+        for name, module, func in tests:
+            test = self.FakeTest(name, module)
+            plug.beforeTest(test)
+            try:
+                func()
+            finally:
+                plug.afterTest(test)
+
+    def test_options(self):
+        parser = OptionParser()
+        plug = CProfile()
+        plug.add_options(parser, {})
+        opts = [ o._long_opts[0] for o in parser.option_list ]
+        assert '--with-cprofile' in opts
+        assert '--cprofile-by' in opts
+        assert '--cprofile-top' in opts
+        assert '--cprofile-stats-file' in opts
+
+    def test_reports_slowest_tests(self):
+        def slow():
+            sorted(range(100000))
+        def fast():
+            pass
+        plug = self.make_plugin(['--cprofile-top=1'])
+        self.profile_calls(plug, [('test_fast', 'mod', fast),
+                              ('test_slow', 'mod', slow),
+                              ('test_fast2', 'mod', fast)])
+        self.assertEqual(plug.stats.keys(), ['mod.test_slow'])
+        stream = self.Stream()
+        plug.report(stream)
+        assert stream.lines[0].startswith('Slowest tests')
+        assert stream.lines[2].endswith('mod.test_slow')
+        assert [l for l in stream.lines if l.endswith('<sorted>')]
+
+    def test_by_module_merges_workers(self):
+        def work():
+            sorted(range(1000))
+        plug = self.make_plugin(['--cprofile-by=module'])
+        plug.statsDir = tempfile.mkdtemp()
+        try:
+            plug.conf.cprofile_stats_dir = plug.statsDir
+            worker = self.make_plugin(['--cprofile-by=module'])
+            worker.conf.worker = True
+            worker.conf.cprofile_stats_dir = plug.statsDir
+            worker.begin()
+            self.profile_calls(worker, [('test_a', 'moda', work),
+                                    ('test_b', 'modb', work)])
+            worker._workerFile.close()
+            self.profile_calls(plug, [('test_c', 'moda', work)])
+            stream = self.Stream()
+            plug.report(stream)
+        finally:
+            plug.finalize(None)
+        self.assertEqual(sorted(plug.durations.keys()), ['moda', 'modb'])
+        self.assertEqual(plug.stats['moda'].total_calls,
+                         2 * plug.stats['modb'].total_calls)
+        assert plug.statsDir is None
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,71 @@
+import os
+import unittest
+import webtest
+from webtest.debugapp import debug_app
+from webtest.load import LoadTest, LoadResult, URLStats
+
+
+class TestLoad(unittest.TestCase):
+
+    def test_total_time(self):
+        app = webtest.TestApp(debug_app, use_lint=False, capture_stdout=False)
+        res = app.get('/')
+        assert res.status_int == 200
+        assert res.total_time >= 0
+
+    def test_threads(self):
+        load = LoadTest(debug_app, [
+            ('get', '/?a=1'),
+            ('get', '/?a=2'),
+            ('post', '/form', {'params': {'name': 'value'}}),
+            ('get', '/', {'params': {'status': '404 Not Found'}}),
+            ], workers=3)
+        result = load.run(repeat=5)
+        self.assertEqual(result.requests, 60)
+        self.assertEqual(result.errors, 15)
+        self.assertEqual(sorted(result.stats), ['GET /', 'POST /form'])
+        stats = result.stats['GET /']
+        self.assertEqual(stats.count, 45)
+        self.assertEqual(stats.errors, 15)
+        assert stats.p50 <= stats.p95 <= stats.p99 <= stats.max
+        report = result.report()
+        assert '60 requests' in report, report
+        assert 'POST /form' in report, report
+
+    def test_processes(self):
+        if not hasattr(os, 'fork'):
+            return
+        load = LoadTest(webtest.TestApp(debug_app), [('get', '/')],
+                        workers=2, processes=True)
+        result = load.run(repeat=3)
+        self.assertEqual(result.requests, 6)
+        self.assertEqual(result.errors, 0)
+        self.assertEqual(result.kind, 'processes')
+
+    def test_dead_processes(self):
+        if not hasattr(os, 'fork'):
+            return
+
+        def exiting_app(environ, start_response):
+            raise SystemExit(3)
+
+        def crashing_app(environ, start_response):
+            os._exit(1)
+
+        for app in exiting_app, crashing_app:
+            load = LoadTest(app, [('get', '/')], workers=2, processes=True)
+            self.assertRaises(RuntimeError, load.run)
+
+    def test_bad_method(self):
+        self.assertRaises(ValueError, LoadTest, debug_app, [('fetch', '/')])
+
+    def test_percentiles(self):
+        stats = URLStats('GET /', [i / 100.0 for i in range(100, 0, -1)], 0)
+        self.assertEqual(stats.count, 100)
+        self.assertEqual(stats.p50, 0.5)
+        self.assertEqual(stats.p95, 0.95)
+        self.assertEqual(stats.p99, 0.99)
+        self.assertEqual(stats.max, 1.0)
+        self.assertEqual(URLStats('GET /', [0.3], 0).p99, 0.3)
+        result = LoadResult([], 0, 1)
+        self.assertEqual(result.throughput, 0)
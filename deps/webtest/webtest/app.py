@@ -663,6 +663,16 @@ class TestApp(object):
     ``relative_to`` is a directory, and filenames used for file
     uploads are calculated relative to this.  Also ``config:``
     URIs that aren't absolute.
+
+    ``use_lint`` wraps the application in ``lint.middleware`` for
+    each request, checking that both sides follow the WSGI spec, and
+    ``capture_stdout`` swaps ``sys.stdout`` for a ``CaptureStdout``
+    while the application runs.  Both are on by default; turn them off
+    to time the application alone (see ``webtest.load``).
+    ``sys.stdout`` is shared by all threads, so ``capture_stdout``
+    should be off when requests are made from several threads at once.
+    The time the application took is set as ``total_time`` on each
+    response.
     """
 
     # for py.test
@@ -670,7 +680,7 @@ class TestApp(object):
     RequestClass = TestRequest
 
     def __init__(self, app, extra_environ=None, relative_to=None,
-                       use_unicode=True):
+                 use_unicode=True, use_lint=True, capture_stdout=True):
         if isinstance(app, string_types):
             from paste.deploy import loadapp
             # @@: Should pick up relative_to from calling module's
@@ -682,6 +692,8 @@ class TestApp(object):
             extra_environ = {}
         self.extra_environ = extra_environ
         self.use_unicode = use_unicode
+        self.use_lint = use_lint
+        self.capture_stdout = capture_stdout
         self.reset()
 
     def reset(self):
@@ -991,18 +1003,22 @@ class TestApp(object):
             req.environ['HTTP_COOKIE'] = cookie_header
         req.environ['paste.testing'] = True
         req.environ['paste.testing_variables'] = {}
-        app = lint.middleware(self.app)
-        old_stdout = sys.stdout
-        out = CaptureStdout(old_stdout)
+        if self.use_lint:
+            app = lint.middleware(self.app)
+        else:
+            app = self.app
+        if self.capture_stdout:
+            old_stdout = sys.stdout
+            sys.stdout = CaptureStdout(old_stdout)
         try:
-            sys.stdout = out
             start_time = time.time()
             ## FIXME: should it be an option to not catch exc_info?
             res = req.get_response(app, catch_exc_info=True)
             res._use_unicode = self.use_unicode
             end_time = time.time()
         finally:
-            sys.stdout = old_stdout
+            if self.capture_stdout:
+                sys.stdout = old_stdout
         res.request = req
         res.app = app
         res.test_app = self
@@ -1012,7 +1028,7 @@ class TestApp(object):
         except TypeError:
             pass
         res.errors = errors.getvalue()
-        total_time = end_time - start_time
+        res.total_time = end_time - start_time
         for name, value in req.environ['paste.testing_variables'].items():
             if hasattr(res, name):
                 raise ValueError(
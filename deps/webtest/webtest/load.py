@@ -0,0 +1,323 @@
+"""
+Load generation on top of ``TestApp``.
+
+``LoadTest`` replays a script of ``get``/``post``/... calls against a
+WSGI application from several workers at once, each with its own
+``TestApp`` (and so its own cookies), and reports the throughput and
+the latency percentiles of each URL::
+
+    >>> from webtest.debugapp import debug_app
+    >>> load = LoadTest(debug_app, [
+    ...     ('get', '/'),
+    ...     ('post', '/form', {'params': {'name': 'value'}}),
+    ...     ], workers=4)
+    >>> result = load.run(repeat=100)
+    >>> result.requests
+    800
+    >>> print(result)                        # doctest: +SKIP
+    800 requests in 0.412s (1941.7 requests/s), 0 errors, 4 threads
+    URL                       count errors   mean    p50    p95    p99    max
+    GET /                       400      0   0.17   0.15   0.31   0.52   1.20
+    POST /form                  400      0   0.24   0.21   0.40   0.61   1.35
+    (latencies in milliseconds)
+
+Workers are threads by default, which suits applications that wait on
+I/O; pass ``processes=True`` to run CPU-bound applications in forked
+processes instead (POSIX only, since the application is not pickled).
+
+By default the requests skip ``lint.middleware`` and the capture of
+``sys.stdout`` that ``TestApp`` normally does, so that the numbers
+measure the application.  The latency of a request is the time the
+application took to respond (``TestResponse.total_time``), or, for a
+request that failed, the time the whole call took.
+"""
+import sys
+import threading
+import time
+from webtest.compat import urlparse
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+__all__ = ['LoadTest', 'LoadResult', 'URLStats']
+
+# the LoadTest being run by forked worker processes
+_forked_load = None
+# seconds between checks that the worker processes are still alive
+_poll_interval = 0.5
+
+
+def default_key(method, url):
+    """
+    Groups requests by method and path, without the query string or
+    fragment.
+    """
+    path = urlparse.urlsplit(url)[2] or '/'
+    return '%s %s' % (method.upper(), path)
+
+
+class LoadTest(object):
+    """
+    Replays a script of requests against an application from a pool
+    of workers.
+
+    ``app`` is a ``TestApp``, or a WSGI application to wrap in one.
+
+    ``script`` is a list of steps, each a ``(method, url)`` or
+    ``(method, url, kwargs)`` tuple, where ``method`` names a
+    ``TestApp`` method (``'get'``, ``'post'``, ``'put'``,
+    ``'delete'``, ``'head'``...) and ``kwargs`` are the keyword
+    arguments to pass to it, e.g. ``{'params': ..., 'status': 404}``.
+
+    Each of the ``workers`` replays the whole script in order, so a
+    script that logs in first keeps the session for the requests after
+    it.  They are threads, or forked processes if ``processes`` is
+    true.
+
+    ``use_lint`` and ``capture_stdout`` are passed to each worker's
+    ``TestApp``.  ``key`` is a function of ``(method, url)`` returning
+    the name under which to report a request; by default requests are
+    grouped by method and path.
+    """
+
+    def __init__(self, app, script, workers=4, processes=False,
+                 use_lint=False, capture_stdout=False, key=default_key):
+        if not hasattr(app, 'do_request'):
+            from webtest import TestApp
+            app = TestApp(app)
+        self.app = app
+        self.script = []
+        for step in script:
+            if len(step) == 2:
+                method, url = step
+                kw = {}
+            else:
+                method, url, kw = step
+            if not callable(getattr(app, method, None)):
+                raise ValueError(
+                    "%r is not a method of %s" % (method, app.__class__.__name__))
+            self.script.append((method, url, kw, key(method, url)))
+        self.workers = workers
+        self.processes = processes
+        if processes and multiprocessing is None:
+            raise ValueError("processes=True requires multiprocessing")
+        self.use_lint = use_lint
+        self.capture_stdout = capture_stdout
+
+    def make_app(self):
+        """
+        Returns a fresh ``TestApp`` for a worker, sharing the wrapped
+        application and its settings.
+        """
+        app = self.app
+        return app.__class__(
+            app.app, extra_environ=app.extra_environ.copy(),
+            relative_to=app.relative_to, use_unicode=app.use_unicode,
+            use_lint=self.use_lint, capture_stdout=self.capture_stdout)
+
+    def replay(self, repeat):
+        """
+        Replays the script ``repeat`` times with a fresh ``TestApp``,
+        returning a list of ``(key, seconds, ok)`` records.
+        """
+        app = self.make_app()
+        records = []
+        append = records.append
+        clock = time.time
+        for _ in range(repeat):
+            for method, url, kw, key in self.script:
+                start = clock()
+                try:
+                    res = getattr(app, method)(url, **kw)
+                except Exception:
+                    append((key, clock() - start, False))
+                else:
+                    append((key, getattr(res, 'total_time', None)
+                            or clock() - start, True))
+        return records
+
+    def run(self, repeat=1):
+        """
+        Runs all workers, each replaying the script ``repeat`` times,
+        and returns a ``LoadResult``.
+        """
+        if self.processes:
+            run_workers = self._run_processes
+        else:
+            run_workers = self._run_threads
+        start = time.time()
+        records = run_workers(repeat)
+        elapsed = time.time() - start
+        return LoadResult(records, elapsed, self.workers,
+                          self.processes and 'processes' or 'threads')
+
+    def _run_threads(self, repeat):
+        results = [None] * self.workers
+
+        def work(i):
+            try:
+                results[i] = (self.replay(repeat), None)
+            except:
+                results[i] = (None, sys.exc_info())
+
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        records = []
+        for worker_records, exc_info in results:
+            if exc_info is not None:
+                raise exc_info[1]
+            records.extend(worker_records)
+        return records
+
+    def _run_processes(self, repeat):
+        global _forked_load
+        if hasattr(multiprocessing, 'get_context'):
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing
+        queue = context.Queue()
+        _forked_load = self
+        try:
+            procs = [context.Process(target=_replay_forked,
+                                     args=(queue, repeat))
+                     for i in range(self.workers)]
+            for proc in procs:
+                proc.start()
+        finally:
+            _forked_load = None
+        records = []
+        errors = []
+        try:
+            for proc in procs:
+                worker_records, error = self._get_result(queue, procs)
+                if error is not None:
+                    errors.append(error)
+                else:
+                    records.extend(worker_records)
+        finally:
+            for proc in procs:
+                if proc.is_alive():
+                    proc.terminate()
+                proc.join()
+        if errors:
+            raise RuntimeError("Load worker failed: %s" % errors[0])
+        return records
+
+    def _get_result(self, queue, procs):
+        # a worker that dies without reporting (os._exit, a signal) would
+        # leave a plain queue.get() waiting forever
+        while True:
+            exited = [proc for proc in procs if not proc.is_alive()]
+            try:
+                return queue.get(timeout=_poll_interval)
+            except Empty:
+                # anything the exited workers sent is in the pipe already
+                crashed = [proc.exitcode for proc in exited if proc.exitcode]
+                if crashed or len(exited) == len(procs):
+                    raise RuntimeError(
+                        "Load worker exited without reporting (exit code %s)"
+                        % (crashed and crashed[0] or 0))
+
+
+def _replay_forked(queue, repeat):
+    try:
+        records = _forked_load.replay(repeat)
+    except BaseException:
+        # SystemExit and KeyboardInterrupt too: the parent waits for a
+        # result from every worker
+        exc = sys.exc_info()[1]
+        queue.put((None, '%s: %s' % (exc.__class__.__name__, exc)))
+    else:
+        queue.put((records, None))
+
+
+class URLStats(object):
+    """
+    Request count, error count and latencies (in seconds) of the
+    requests reported under one key.
+    """
+
+    def __init__(self, key, latencies, errors):
+        self.key = key
+        latencies = sorted(latencies)
+        self.count = len(latencies)
+        self.errors = errors
+        self.latencies = latencies
+        if latencies:
+            self.mean = sum(latencies) / len(latencies)
+            self.max = latencies[-1]
+        else:
+            self.mean = self.max = 0.0
+        self.p50 = self.percentile(50)
+        self.p95 = self.percentile(95)
+        self.p99 = self.percentile(99)
+
+    def percentile(self, percent):
+        """
+        Returns the latency below which ``percent`` percent of the
+        requests fall (nearest rank), or 0 if there were none.
+        """
+        if not self.latencies:
+            return 0.0
+        rank = int(-(-percent * self.count // 100))
+        return self.latencies[max(rank, 1) - 1]
+
+
+class LoadResult(object):
+    """
+    The outcome of ``LoadTest.run()``: ``requests``, ``errors``,
+    ``elapsed`` seconds and ``throughput`` (requests per second)
+    overall, and ``stats``, a dictionary of ``URLStats`` by key.
+    """
+
+    def __init__(self, records, elapsed, workers, kind='threads'):
+        self.requests = len(records)
+        self.elapsed = elapsed
+        self.workers = workers
+        self.kind = kind
+        if elapsed > 0:
+            self.throughput = self.requests / elapsed
+        else:
+            self.throughput = 0.0
+        latencies = {}
+        errors = {}
+        for key, seconds, ok in records:
+            latencies.setdefault(key, []).append(seconds)
+            if not ok:
+                errors[key] = errors.get(key, 0) + 1
+        self.errors = sum(errors.values())
+        self.stats = {}
+        for key in latencies:
+            self.stats[key] = URLStats(key, latencies[key],
+                                       errors.get(key, 0))
+
+    def report(self):
+        """
+        Returns a text table of the throughput and per-URL latencies.
+        """
+        lines = ['%d requests in %.3fs (%.1f requests/s), %d errors, '
+                 '%d %s' % (self.requests, self.elapsed, self.throughput,
+                            self.errors, self.workers, self.kind)]
+        width = max([len(key) for key in self.stats] + [3]) + 2
+        lines.append('%-*s %6s %6s %6s %6s %6s %6s %6s' % (
+            width, 'URL', 'count', 'errors', 'mean', 'p50', 'p95', 'p99',
+            'max'))
+        for key in sorted(self.stats):
+            s = self.stats[key]
+            lines.append('%-*s %6d %6d %6.2f %6.2f %6.2f %6.2f %6.2f' % (
+                width, key, s.count, s.errors, s.mean * 1000, s.p50 * 1000,
+                s.p95 * 1000, s.p99 * 1000, s.max * 1000))
+        lines.append('(latencies in milliseconds)')
+        return '\n'.join(lines)
+
+    __str__ = report
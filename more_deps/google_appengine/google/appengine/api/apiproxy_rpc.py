@@ -18,8 +18,14 @@
 
 
 
-"""Base class for implementing RPC of API proxy stubs."""
+"""Base class for implementing RPC of API proxy stubs.
 
+By default an RPC runs its stub inline, in the thread that waits on it. After
+SetAsyncExecution(n) the stub call starts on a pool of n worker threads as
+soon as the RPC is made, so that several outstanding RPCs overlap the way they
+do in production. Stubs whose THREADSAFE attribute is not true are serialized
+per stub instance.
+"""
 
 
 
@@ -28,7 +34,144 @@
 
 
 
+
+import atexit
+import Queue
 import sys
+import threading
+import weakref
+
+
+_DEFAULT_MAX_WORKERS = 8
+
+
+class _ThreadPool(object):
+  """A fixed pool of daemon threads running callables from a queue."""
+
+  def __init__(self, max_workers):
+    """Constructor.
+
+    Args:
+      max_workers: the number of worker threads to start.
+    """
+    self.__queue = Queue.Queue()
+    self.__threads = []
+    for i in xrange(max_workers):
+      thread = threading.Thread(target=self.__Work,
+                                name='apiproxy-rpc-%d' % i)
+      thread.setDaemon(True)
+      thread.start()
+      self.__threads.append(thread)
+
+  def __Work(self):
+    while True:
+      function = self.__queue.get()
+      if function is None:
+        return
+      try:
+        function()
+      except:
+        pass
+
+  def Submit(self, function):
+    """Queues an argument-less callable to run on a worker thread."""
+    self.__queue.put(function)
+
+  def Shutdown(self):
+    """Stops the worker threads once the queued callables have run."""
+    for _ in self.__threads:
+      self.__queue.put(None)
+    for thread in self.__threads:
+      if thread is not threading.currentThread():
+        thread.join()
+    self.__threads = []
+
+
+_executor = None
+
+_executor_lock = threading.Lock()
+
+
+_completion = threading.Condition()
+
+
+_stub_locks = {}
+
+_stub_locks_lock = threading.Lock()
+
+
+_local = threading.local()
+
+
+def SetAsyncExecution(max_workers=_DEFAULT_MAX_WORKERS):
+  """Enables or disables running stub calls on a thread pool.
+
+  Args:
+    max_workers: the number of worker threads, or 0 or None to go back to
+      running stub calls inline when they are waited on.
+  """
+  global _executor
+  _executor_lock.acquire()
+  try:
+    if _executor is not None:
+      _executor.Shutdown()
+      _executor = None
+    if max_workers:
+      _executor = _ThreadPool(max_workers)
+  finally:
+    _executor_lock.release()
+
+
+atexit.register(SetAsyncExecution, 0)
+
+
+def IsAsyncExecutionEnabled():
+  """Returns True if stub calls start on a thread pool when made."""
+  return _executor is not None
+
+
+def WaitAny(rpcs):
+  """Blocks until one of the given running RPCs has finished executing.
+
+  The returned RPC still has to be waited on to move it to the FINISHING
+  state and to run its callback in the calling thread.
+
+  Args:
+    rpcs: a list of RPC instances in the RUNNING state.
+
+  Returns:
+    The first RPC whose stub call has completed, or the first RPC if none of
+    them is executing in the background. None if rpcs is empty.
+  """
+  _completion.acquire()
+  try:
+    while True:
+      pending = False
+      for rpc in rpcs:
+        if (not getattr(rpc, '_RPC__submitted', False) or
+            rpc._RPC__executed):
+          return rpc
+        pending = True
+      if not pending:
+        return None
+      _completion.wait()
+  finally:
+    _completion.release()
+
+
+def _GetStubLock(stub):
+  """Returns the lock serializing calls to a stub that is not thread-safe."""
+  _stub_locks_lock.acquire()
+  try:
+    entry = _stub_locks.get(id(stub))
+    if entry is None or entry[0]() is not stub:
+      entry = (weakref.ref(stub, lambda _, key=id(stub): _stub_locks.pop(key,
+                                                                       None)),
+               threading.RLock())
+      _stub_locks[id(stub)] = entry
+    return entry[1]
+  finally:
+    _stub_locks_lock.release()
 
 
 class RPC(object):
@@ -63,6 +206,9 @@ class RPC(object):
     self.__exception = None
     self.__state = RPC.IDLE
     self.__traceback = None
+    self.__submitted = False
+    self.__started = False
+    self.__executed = False
 
     self.package = package
     self.call = call
@@ -141,8 +287,18 @@ class RPC(object):
     return self.__state
 
   def _MakeCallImpl(self):
-    """Override this method to implement a real asynchronous call rpc."""
+    """Override this method to implement a real asynchronous call rpc.
+
+    When async execution is enabled the stub call is queued on the thread
+    pool here, unless this RPC is made from inside another stub call; nested
+    calls run inline so that a worker never waits on its own pool.
+    """
     self.__state = RPC.RUNNING
+    executor = _executor
+    if (executor is not None and self.stub is not None and
+        not getattr(_local, 'depth', 0)):
+      self.__submitted = True
+      executor.Submit(self.__Execute)
 
   def _WaitImpl(self):
     """Override this method to implement a real asynchronous call rpc.
@@ -150,6 +306,43 @@ class RPC(object):
     Returns:
       True if the async call was completed successfully.
     """
+    try:
+      if self.__submitted:
+        self.__Execute()
+        _completion.acquire()
+        try:
+          while not self.__executed:
+            _completion.wait()
+        finally:
+          _completion.release()
+      else:
+        self.__Execute()
+    finally:
+      self.__state = RPC.FINISHING
+      self.__Callback()
+
+    return True
+
+  def __Execute(self):
+    """Runs the stub call unless another thread has already claimed it.
+
+    Called by a pool worker and by the waiting thread, whichever comes first;
+    a waiter that finds the call still queued runs it itself.
+    """
+    _completion.acquire()
+    try:
+      if self.__started:
+        return
+      self.__started = True
+    finally:
+      _completion.release()
+
+    lock = None
+    if ((self.__submitted or _executor is not None) and
+        not getattr(self.stub, 'THREADSAFE', False)):
+      lock = _GetStubLock(self.stub)
+      lock.acquire()
+    _local.depth = getattr(_local, 'depth', 0) + 1
     try:
       try:
         self.stub.MakeSyncCall(self.package, self.call,
@@ -157,10 +350,15 @@ class RPC(object):
       except Exception:
         _, self.__exception, self.__traceback = sys.exc_info()
     finally:
-      self.__state = RPC.FINISHING
-      self.__Callback()
-
-    return True
+      _local.depth -= 1
+      if lock is not None:
+        lock.release()
+      _completion.acquire()
+      try:
+        self.__executed = True
+        _completion.notifyAll()
+      finally:
+        _completion.release()
 
   def __Callback(self):
     if self.callback:
@@ -42,8 +42,12 @@ class APIProxyStub(object):
     - Extend this class.
     - Override __init__ to pass in appropriate default service name.
     - Implement service methods as _Dynamic_<method>(request, response).
+    - Set THREADSAFE to True if the stub can serve calls from several threads
+      at once; otherwise asynchronously executed RPCs are serialized per stub.
   """
 
+  THREADSAFE = False
+
   def __init__(self, service_name, max_request_size=MAX_REQUEST_SIZE):
     """Constructor.
 
@@ -649,6 +649,11 @@ class UserRPC(object):
       return finished
     if running is None:
       return None
+    if apiproxy_rpc.IsAsyncExecutionEnabled():
+      by_rpc = dict((id(rpc.__rpc), rpc) for rpc in rpcs)
+      executed = apiproxy_rpc.WaitAny([rpc.__rpc for rpc in rpcs])
+      if executed is not None:
+        running = by_rpc[id(executed)]
     try:
       cls.__local.may_interrupt_wait = True
       try:
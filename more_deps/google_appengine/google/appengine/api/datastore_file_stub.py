@@ -21,12 +21,22 @@
 
 """
 In-memory persistent stub for the Python datastore API. Gets, queries,
-and searches are implemented as in-memory scans over all entities.
-
-Stores entities across sessions as pickled proto bufs in a single file. On
-startup, all entities are read from the file and loaded into memory. On
-every Put(), the file is wiped and all entities are written from scratch.
-Clients can also manually Read() and Write() the file themselves.
+and searches are implemented as in-memory scans over all entities, except
+that kind queries on a single property are answered from sorted per-property
+indexes that are built the first time a kind is queried.
+
+Stores entities across sessions as encoded proto bufs in a single file,
+followed by an index of their keys and offsets. On startup, only the index is
+read; the file is memory-mapped and each entity is decoded the first time it
+is used. On every Put(), the file is wiped and all entities are written from
+scratch. Clients can also manually Read() and Write() the file themselves.
+Files in the older format of a single pickled list of proto bufs are still
+read.
+
+Optionally, changes can instead be appended to a journal file next to the
+datastore file. The journal is periodically merged into the datastore file by
+a background compaction, and on startup the journal is replayed on top of the
+entities read from the datastore file.
 """
 
 
@@ -40,14 +50,17 @@ Clients can also manually Read() and Write() the file themselves.
 
 
 
+import bisect
 import collections
 import logging
+import mmap
 import os
 import struct
 import sys
 import tempfile
 import threading
 import weakref
+import zlib
 
 
 
@@ -67,6 +80,85 @@ from google.appengine.datastore import entity_pb
 datastore_pb.Query.__hash__ = lambda self: hash(self.Encode())
 
 
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_COMPACTING_SUFFIX = '.compacting'
+
+
+_JOURNAL_PUT = 'P'
+_JOURNAL_DELETE = 'D'
+
+
+_JOURNAL_RECORD_HEADER = struct.Struct('>cII')
+
+
+_DEFAULT_JOURNAL_COMPACTION_BYTES = 16 * 1024 * 1024
+
+
+
+
+_INDEXED_MAGIC = 'DSFSIDX1'
+_INDEXED_TRAILER = struct.Struct('>Q%ds' % len(_INDEXED_MAGIC))
+
+
+def _EncodeJournalRecord(op, data):
+  """Encodes a single journal record.
+
+  Args:
+    op: _JOURNAL_PUT or _JOURNAL_DELETE.
+    data: the encoded entity_pb.EntityProto for a put or the encoded
+      entity_pb.Reference for a delete.
+
+  Returns:
+    The record as a string, ready to be appended to the journal.
+  """
+  return _JOURNAL_RECORD_HEADER.pack(
+      op, len(data), zlib.crc32(data) & 0xffffffff) + data
+
+
+def _DecodeJournalRecords(data):
+  """Decodes the records in the contents of a journal.
+
+  Decoding stops at the first incomplete or corrupt record, which is what a
+  write interrupted by a crash leaves at the end of the journal.
+
+  Args:
+    data: the contents of a journal file.
+
+  Returns:
+    (records, end) where records is a list of (op, data) tuples and end is the
+    offset just past the last valid record.
+  """
+  records = []
+  pos = 0
+  header_size = _JOURNAL_RECORD_HEADER.size
+  while pos + header_size <= len(data):
+    op, length, crc = _JOURNAL_RECORD_HEADER.unpack(
+        data[pos:pos + header_size])
+    start = pos + header_size
+    payload = data[start:start + length]
+    if (op not in (_JOURNAL_PUT, _JOURNAL_DELETE) or len(payload) != length or
+        zlib.crc32(payload) & 0xffffffff != crc):
+      break
+    records.append((op, payload))
+    pos = start + length
+  return records, pos
+
+
+def _MapFile(datafile):
+  """Returns the contents of an open file, memory-mapped where possible.
+
+  Windows does not allow replacing a file that is mapped, so there the
+  contents are read into memory instead.
+  """
+  if os.name != 'nt':
+    try:
+      return mmap.mmap(datafile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+      pass
+  datafile.seek(0)
+  return datafile.read()
+
+
 class _StoredEntity(object):
   """Simple wrapper around an entity stored by the stub.
 
@@ -91,6 +183,210 @@ class _StoredEntity(object):
     self.encoded_protobuf = entity.Encode()
 
 
+class _LazyStoredEntity(_StoredEntity):
+  """A _StoredEntity that was read from an indexed datastore file.
+
+  The entity stays in the (usually memory-mapped) file until it is used:
+  encoded_protobuf is sliced out of the file on every access, and protobuf is
+  decoded the first time it is accessed.
+  """
+
+  def __init__(self, buf, offset, length):
+    """Constructor.
+
+    Args:
+      buf: the mmap or string holding the contents of the datastore file.
+      offset: the offset of the encoded entity in buf.
+      length: the length of the encoded entity.
+    """
+    self.__buf = buf
+    self.__offset = offset
+    self.__length = length
+    self.__protobuf = None
+
+  @property
+  def encoded_protobuf(self):
+    return self.__buf[self.__offset:self.__offset + self.__length]
+
+  @property
+  def protobuf(self):
+    if self.__protobuf is None:
+      self.__protobuf = entity_pb.EntityProto(self.encoded_protobuf)
+    return self.__protobuf
+
+
+class _KindIndex(object):
+  """Sorted indexes over the property values of the entities of one kind.
+
+  For every indexed property, the (value, key) pairs of the entities that have
+  it are kept sorted by value and then by key, in the parallel lists
+  values[name] and keys[name].  Values are datastore_types key values, so they
+  sort in the datastore's native order, and keys are the
+  datastore_types.ReferenceToKeyValue() of the entities' keys.  An entity
+  appears once for each distinct value it has.
+
+  Public properties:
+    values: dict mapping property names to sorted lists of key values.
+    keys: dict mapping property names to the lists of entity keys that
+      correspond to values.
+    multiple_valued: dict mapping property names to the number of entities
+      with more than one distinct value for it.
+  """
+
+  _LOWER_BOUNDS = {
+      datastore_pb.Query_Filter.GREATER_THAN: bisect.bisect_right,
+      datastore_pb.Query_Filter.GREATER_THAN_OR_EQUAL: bisect.bisect_left,
+      datastore_pb.Query_Filter.EQUAL: bisect.bisect_left,
+      }
+  _UPPER_BOUNDS = {
+      datastore_pb.Query_Filter.LESS_THAN: bisect.bisect_left,
+      datastore_pb.Query_Filter.LESS_THAN_OR_EQUAL: bisect.bisect_right,
+      datastore_pb.Query_Filter.EQUAL: bisect.bisect_right,
+      }
+  OPERATORS = frozenset(_LOWER_BOUNDS) | frozenset(_UPPER_BOUNDS)
+
+  def __init__(self, entities):
+    """Builds the indexes.
+
+    Args:
+      entities: dict mapping entity keys to the _StoredEntity of every entity
+        of the kind.
+    """
+    pairs = collections.defaultdict(list)
+    self.multiple_valued = collections.defaultdict(int)
+    for k, stored in entities.iteritems():
+      for name, values in self.__EntityValues(stored.protobuf).iteritems():
+        if len(values) > 1:
+          self.multiple_valued[name] += 1
+        pairs[name].extend((value, k) for value in values)
+
+    self.values = {}
+    self.keys = {}
+    for name, name_pairs in pairs.iteritems():
+      name_pairs.sort()
+      self.values[name] = [value for value, _ in name_pairs]
+      self.keys[name] = [k for _, k in name_pairs]
+
+  @staticmethod
+  def __EntityValues(entity):
+    """Returns a dict mapping property names to sets of key values."""
+    values = collections.defaultdict(set)
+    for prop in entity.property_list():
+      values[prop.name()].add(
+          datastore_types.PropertyValueToKeyValue(prop.value()))
+    return values
+
+  def __Position(self, name, value, k):
+    """Returns where the pair (value, k) is or belongs in the index of name."""
+    values = self.values[name]
+    lo = bisect.bisect_left(values, value)
+    hi = bisect.bisect_right(values, value, lo)
+    return bisect.bisect_left(self.keys[name], k, lo, hi)
+
+  def Add(self, k, entity):
+    """Adds an entity, which must not already be in the indexes.
+
+    Args:
+      k: the entity's key value.
+      entity: the entity_pb.EntityProto.
+    """
+    for name, values in self.__EntityValues(entity).iteritems():
+      if len(values) > 1:
+        self.multiple_valued[name] += 1
+      self.values.setdefault(name, [])
+      self.keys.setdefault(name, [])
+      for value in values:
+        i = self.__Position(name, value, k)
+        self.values[name].insert(i, value)
+        self.keys[name].insert(i, k)
+
+  def Remove(self, k, entity):
+    """Removes an entity added with the same key and contents.
+
+    Args:
+      k: the entity's key value.
+      entity: the entity_pb.EntityProto.
+    """
+    for name, values in self.__EntityValues(entity).iteritems():
+      if name not in self.values:
+        continue
+      if len(values) > 1:
+        self.multiple_valued[name] -= 1
+      for value in values:
+        i = self.__Position(name, value, k)
+        if i < len(self.keys[name]) and self.keys[name][i] == k:
+          del self.values[name][i]
+          del self.keys[name][i]
+      if not self.values[name]:
+        del self.values[name]
+        del self.keys[name]
+
+  def Range(self, name, filters):
+    """Finds the entries of an index that match filters on its property.
+
+    An entity is in the range if one of its values satisfies every filter,
+    which is how the datastore applies several inequality filters on the same
+    property.
+
+    Args:
+      name: the property name.
+      filters: a list of datastore_pb.Query_Filter on name, whose operators are
+        in OPERATORS.
+
+    Returns:
+      A (lo, hi) tuple such that values[name][lo:hi] and keys[name][lo:hi] are
+      the matching entries.
+    """
+    values = self.values.get(name, ())
+    lo, hi = 0, len(values)
+    for filter_pb in filters:
+      value = datastore_types.PropertyValueToKeyValue(
+          filter_pb.property(0).value())
+      op = filter_pb.op()
+      if op in self._LOWER_BOUNDS:
+        lo = max(lo, self._LOWER_BOUNDS[op](values, value))
+      if op in self._UPPER_BOUNDS:
+        hi = min(hi, self._UPPER_BOUNDS[op](values, value))
+    return lo, max(lo, hi)
+
+  def Keys(self, name, lo, hi, descending=False):
+    """Returns the entity keys of a range of an index in query order.
+
+    Entities are ordered by their smallest value in the range, or their
+    largest one if descending, and then by key.  Each entity is returned once.
+
+    Args:
+      name: the property name.
+      lo: the start of the range, as returned by Range().
+      hi: the end of the range, as returned by Range().
+      descending: whether the query orders name descending.
+
+    Returns:
+      A list of entity keys.
+    """
+    keys = self.keys.get(name, [])
+    if not descending:
+      ordered = keys[lo:hi]
+    else:
+      values = self.values[name]
+      ordered = []
+      end = hi
+      while end > lo:
+        start = bisect.bisect_left(values, values[end - 1], lo, end)
+        ordered.extend(keys[start:end])
+        end = start
+
+    if not self.multiple_valued.get(name):
+      return ordered
+    seen = set()
+    unique = []
+    for k in ordered:
+      if k not in seen:
+        seen.add(k)
+        unique.append(k)
+    return unique
+
+
 class KindPseudoKind(object):
   """Pseudo-kind for schema queries.
 
@@ -299,8 +595,15 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
   Stores all entities in memory, and persists them to a file as pickled
   protocol buffers. A DatastoreFileStub instance handles a single app's data
   and is backed by files on disk.
+
+  When use_journal is set, puts and deletes are appended to a journal file
+  instead, which a background compaction merges into the datastore file once
+  it grows past journal_compaction_bytes. The in-memory entities remain the
+  source of truth; the journal only records which of them changed.
   """
 
+  THREADSAFE = True
+
   def __init__(self,
                app_id,
                datastore_file,
@@ -309,7 +612,9 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
                service_name='datastore_v3',
                trusted=False,
                consistency_policy=None,
-               save_changes=True):
+               save_changes=True,
+               use_journal=False,
+               journal_compaction_bytes=_DEFAULT_JOURNAL_COMPACTION_BYTES):
     """Constructor.
 
     Initializes and loads the datastore from the backing files, if they exist.
@@ -329,6 +634,11 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
         datastore_stub_util.*ConsistencyPolicy
       save_changes: bool, default True. If this stub should modify
         datastore_file when entities are changed.
+      use_journal: bool, default False. If True, changes are appended to a
+        journal next to datastore_file instead of rewriting datastore_file
+        after every write.
+      journal_compaction_bytes: int, the size in bytes the journal may reach
+        before it is merged into datastore_file in the background.
     """
     datastore_stub_util.BaseDatastore.__init__(self, require_indexes,
                                                consistency_policy)
@@ -360,6 +670,10 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
     self.__schema_cache = {}
 
 
+
+    self.__kind_indexes = {}
+
+
     self.__query_history = {}
 
     self.__next_id = 1L
@@ -368,6 +682,17 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
     self.__file_lock = threading.Lock()
 
 
+    self.__use_journal = use_journal
+    self.__journal_compaction_bytes = journal_compaction_bytes
+    self.__journal = None
+    self.__journal_size = 0
+    self.__journal_dirty = {}
+    self.__journal_reset = False
+    self.__journal_stale = False
+    self.__compaction_pending = False
+    self.__compaction_lock = threading.Lock()
+
+
     self._RegisterPseudoKind(KindPseudoKind())
     self._RegisterPseudoKind(PropertyPseudoKind(weakref.proxy(self)))
     self._RegisterPseudoKind(NamespacePseudoKind())
@@ -386,6 +711,11 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
       self.__entities_by_group = collections.defaultdict(dict)
       self.__query_history = {}
       self.__schema_cache = {}
+      self.__kind_indexes = {}
+
+
+      self.__journal_dirty = {}
+      self.__journal_reset = True
     finally:
       self.__entities_lock.release()
 
@@ -424,13 +754,48 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
     assert not insert or k not in self.__entities_by_kind[app_kind]
 
-    self.__entities_by_kind[app_kind][k] = _StoredEntity(entity)
-    self.__entities_by_group[eg_k][k] = entity
+    kind_index = self.__kind_indexes.get(app_kind)
+    if kind_index is not None:
+      old_stored = self.__entities_by_kind[app_kind].get(k)
+      if old_stored is not None:
+        kind_index.Remove(k, old_stored.protobuf)
+      kind_index.Add(k, entity)
+
+    stored = _StoredEntity(entity)
+    self.__entities_by_kind[app_kind][k] = stored
+    self.__entities_by_group[eg_k][k] = stored
 
 
     if app_kind in self.__schema_cache:
       del self.__schema_cache[app_kind]
 
+  def _RemoveEntity(self, key):
+    """ Remove the entity with the given key, if it is stored.
+
+    Any needed locking should be managed by the caller.
+
+    Args:
+      key: The entity_pb.Reference of the entity to remove.
+    """
+    app_kind, eg_k, k = self._GetEntityLocation(key)
+
+    try:
+      stored = self.__entities_by_kind[app_kind].pop(k)
+      del self.__entities_by_group[eg_k][k]
+      if app_kind in self.__kind_indexes:
+        self.__kind_indexes[app_kind].Remove(k, stored.protobuf)
+      if not self.__entities_by_kind[app_kind]:
+
+        del self.__entities_by_kind[app_kind]
+        self.__kind_indexes.pop(app_kind, None)
+      if not self.__entities_by_group[eg_k]:
+        del self.__entities_by_group[eg_k]
+
+      del self.__schema_cache[app_kind]
+    except KeyError:
+
+      pass
+
   READ_PB_EXCEPTIONS = (ProtocolBuffer.ProtocolBufferDecodeError, LookupError,
                         TypeError, ValueError)
   READ_ERROR_MSG = ('Data in %s is corrupt or a different version. '
@@ -453,51 +818,339 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
     key as an entity already in the datastore, the entity from the file
     overwrites the entity in the datastore.
 
+    Any journal left next to the datastore file is replayed on top of the
+    entities read from it.
+
     Also sets __next_id to one greater than the highest id allocated so far.
     """
     if self.__datastore_file and self.__datastore_file != '/dev/null':
-      for encoded_entity in self.__ReadPickled(self.__datastore_file):
-        try:
-          entity = entity_pb.EntityProto(encoded_entity)
-        except self.READ_PB_EXCEPTIONS, e:
-          raise apiproxy_errors.ApplicationError(
-              datastore_pb.Error.INTERNAL_ERROR,
-              self.READ_ERROR_MSG % (self.__datastore_file, e))
-        except struct.error, e:
-          if (sys.version_info[0:3] == (2, 5, 0)
-              and e.message.startswith('unpack requires a string argument')):
+      index = self.__ReadIndexed(self.__datastore_file)
+      if index is None:
+        for encoded_entity in self.__ReadPickled(self.__datastore_file):
+          self.__LoadEntity(self.__DecodePb(entity_pb.EntityProto,
+                                            encoded_entity))
+      else:
+        for k, stored in index:
+          self.__LoadStoredEntity(k, stored)
+
+      journal_file = self.__datastore_file + JOURNAL_SUFFIX
+      for filename in (journal_file + JOURNAL_COMPACTING_SUFFIX,
+                       journal_file):
+        records = self.__ReadJournal(filename)
+        if records and not self.__use_journal:
 
 
-            raise apiproxy_errors.ApplicationError(
-                datastore_pb.Error.INTERNAL_ERROR,
-                self.READ_PY250_MSG + self.READ_ERROR_MSG %
-                (self.__datastore_file, e))
+          self.__journal_stale = True
+        for op, data in records:
+          if op == _JOURNAL_PUT:
+            self.__LoadEntity(self.__DecodePb(entity_pb.EntityProto, data))
           else:
-            raise
+            self._RemoveEntity(self.__DecodePb(entity_pb.Reference, data))
 
-        self._StoreEntity(entity)
+  def __DecodePb(self, pb_class, encoded):
+    """Decodes a protocol buffer read from the datastore or journal file."""
+    try:
+      return pb_class(encoded)
+    except self.READ_PB_EXCEPTIONS, e:
+      raise apiproxy_errors.ApplicationError(
+          datastore_pb.Error.INTERNAL_ERROR,
+          self.READ_ERROR_MSG % (self.__datastore_file, e))
+    except struct.error, e:
+      if (sys.version_info[0:3] == (2, 5, 0)
+          and e.message.startswith('unpack requires a string argument')):
+
+
+        raise apiproxy_errors.ApplicationError(
+            datastore_pb.Error.INTERNAL_ERROR,
+            self.READ_PY250_MSG + self.READ_ERROR_MSG %
+            (self.__datastore_file, e))
+      else:
+        raise
+
+  def __LoadEntity(self, entity):
+    """Stores an entity read from disk and updates __next_id."""
+    self._StoreEntity(entity)
 
-        last_path = entity.key().path().element_list()[-1]
-        if last_path.has_id() and last_path.id() >= self.__next_id:
-          self.__next_id = last_path.id() + 1
+    last_path = entity.key().path().element_list()[-1]
+    if last_path.has_id() and last_path.id() >= self.__next_id:
+      self.__next_id = last_path.id() + 1
+
+  def __LoadStoredEntity(self, k, stored):
+    """Stores an entity read from the index of a datastore file.
+
+    The locations of the entity are derived from its key value, so that the
+    entity itself does not need to be decoded.
+
+    Args:
+      k: the datastore_types.ReferenceToKeyValue() of the entity's key.
+      stored: the _LazyStoredEntity holding the entity.
+    """
+    app_kind = (datastore_types.EncodeAppIdNamespace(k[1], k[2]), k[-2])
+    eg_k = k[:5]
+
+    self.__entities_by_kind[app_kind][k] = stored
+    self.__entities_by_group[eg_k][k] = stored
+
+    if app_kind in self.__schema_cache:
+      del self.__schema_cache[app_kind]
+    self.__kind_indexes.pop(app_kind, None)
+
+    if isinstance(k[-1], (int, long)) and k[-1] >= self.__next_id:
+      self.__next_id = k[-1] + 1
 
   def Write(self):
     """ Writes out the datastore and history files. Be careful! If the files
     already exist, this method overwrites them!
+
+    When journaling, this merges the journal into the datastore file.
     """
-    self.__WriteDatastore()
+    if self.__use_journal:
+      if self.__IsPersistent():
+        self.__Compact()
+    else:
+      self.__WriteDatastore()
+
+  def __IsPersistent(self):
+    """Returns True if changes should be saved to the datastore file."""
+    return bool(self.__datastore_file and
+                self.__datastore_file != '/dev/null' and
+                self.__save_changes)
 
   def __WriteDatastore(self):
     """ Writes out the datastore file. Be careful! If the file already exists,
     this method overwrites it!
     """
-    if (self.__datastore_file and self.__datastore_file != '/dev/null' and
-        self.__save_changes):
-      encoded = []
-      for kind_dict in self.__entities_by_kind.values():
-        encoded.extend(entity.encoded_protobuf for entity in kind_dict.values())
+    if self.__IsPersistent():
+      entities = self.__StoredEntities()
+
+      if self.__journal_stale:
+
+
+        self.__WriteIndexed(entities, self.__datastore_file, allow_empty=True)
+        self.__RemoveJournals()
+        self.__journal_stale = False
+      else:
+        self.__WriteIndexed(entities, self.__datastore_file)
+
+  def __StoredEntities(self):
+    """Returns (key value, _StoredEntity) tuples for all stored entities."""
+    entities = []
+    for kind_dict in self.__entities_by_kind.values():
+      entities.extend(kind_dict.iteritems())
+    return entities
+
+  def __MarkDirty(self, key):
+    """Records that the entity with the given key must be journaled.
+
+    Any needed locking should be managed by the caller.
+
+    Args:
+      key: The entity_pb.Reference of the changed entity.
+    """
+    if self.__use_journal:
+      app_kind, _, k = self._GetEntityLocation(key)
+      self.__journal_dirty[k] = (app_kind, key)
+
+  def __WriteJournal(self):
+    """Appends the entities changed since the last call to the journal.
+
+    Each changed entity is journaled with its current in-memory state, so
+    several changes to the same entity between two calls only produce one
+    record. Starts a background compaction once the journal is large enough.
+    """
+    if not self.__IsPersistent():
+      return
+
+    if self.__journal_reset:
+
+
+      self.__Compact()
+      return
+
+    self.__file_lock.acquire()
+    try:
+      self.__entities_lock.acquire()
+      try:
+        dirty = self.__journal_dirty
+        self.__journal_dirty = {}
+        records = []
+        for k, (app_kind, key) in dirty.iteritems():
+          stored = self.__entities_by_kind.get(app_kind, {}).get(k)
+          if stored:
+            records.append(_EncodeJournalRecord(_JOURNAL_PUT,
+                                                stored.encoded_protobuf))
+          else:
+            records.append(_EncodeJournalRecord(_JOURNAL_DELETE,
+                                                key.Encode()))
+      finally:
+        self.__entities_lock.release()
+
+      if records:
+        if self.__journal is None:
+          self.__journal = open(self.__datastore_file + JOURNAL_SUFFIX, 'ab')
+          self.__journal.seek(0, 2)
+          self.__journal_size = self.__journal.tell()
+        data = ''.join(records)
+        self.__journal.write(data)
+        self.__journal.flush()
+        self.__journal_size += len(data)
+
+      compact = (self.__journal_size >= self.__journal_compaction_bytes and
+                 not self.__compaction_pending)
+      if compact:
+        self.__compaction_pending = True
+    finally:
+      self.__file_lock.release()
+
+    if compact:
+      thread = threading.Thread(target=self.__CompactInBackground,
+                                name='DatastoreFileStub journal compaction')
+      thread.setDaemon(True)
+      thread.start()
+
+  def __CompactInBackground(self):
+    """Runs __Compact, logging any error instead of raising it."""
+    try:
+      self.__Compact()
+    except Exception:
+      logging.exception('Could not compact the datastore journal of %s',
+                        self.__datastore_file)
+
+  def __Compact(self):
+    """Merges the journal into the datastore file.
+
+    The journal is first moved aside and the in-memory entities captured under
+    the same locks, so writes keep appending to a fresh journal while the
+    snapshot is written. Replaying the moved journal on top of the new
+    snapshot is harmless, so a crash at any point leaves a readable state.
+    """
+    self.__compaction_lock.acquire()
+    try:
+      journal_file = self.__datastore_file + JOURNAL_SUFFIX
+      compacting_file = journal_file + JOURNAL_COMPACTING_SUFFIX
 
-      self.__WritePickled(encoded, self.__datastore_file)
+      self.__file_lock.acquire()
+      try:
+        self.__compaction_pending = False
+        self.__journal_reset = False
+        if self.__journal is not None:
+          self.__journal.close()
+          self.__journal = None
+        self.__journal_size = 0
+
+        if os.path.exists(journal_file):
+          if os.path.exists(compacting_file):
+
+
+            compacting = open(compacting_file, 'ab')
+            try:
+              compacting.write(open(journal_file, 'rb').read())
+            finally:
+              compacting.close()
+            os.remove(journal_file)
+          else:
+            os.rename(journal_file, compacting_file)
+
+        self.__entities_lock.acquire()
+        try:
+          entities = self.__StoredEntities()
+        finally:
+          self.__entities_lock.release()
+      finally:
+        self.__file_lock.release()
+
+      self.__WriteIndexed(entities, self.__datastore_file, allow_empty=True)
+
+      self.__file_lock.acquire()
+      try:
+        if os.path.exists(compacting_file):
+          os.remove(compacting_file)
+      finally:
+        self.__file_lock.release()
+    finally:
+      self.__compaction_lock.release()
+
+  def __ReadJournal(self, filename):
+    """Reads the records of a journal file.
+
+    An incomplete record left at the end of the journal by an interrupted
+    write is truncated away, so that later records can be appended after the
+    last valid one.
+
+    Returns:
+      A list of (op, data) tuples, in the order they were written.
+    """
+    self.__file_lock.acquire()
+    try:
+      if not os.path.isfile(filename):
+        return []
+      journal = open(filename, 'r+b')
+      try:
+        data = journal.read()
+        records, end = _DecodeJournalRecords(data)
+        if end < len(data):
+          logging.warning('Discarding %d bytes of incomplete journal data at '
+                          'the end of %s', len(data) - end, filename)
+          journal.truncate(end)
+      finally:
+        journal.close()
+    finally:
+      self.__file_lock.release()
+
+    return records
+
+  def __RemoveJournals(self):
+    """Removes the journal files next to the datastore file."""
+    journal_file = self.__datastore_file + JOURNAL_SUFFIX
+    self.__file_lock.acquire()
+    try:
+      for filename in (journal_file + JOURNAL_COMPACTING_SUFFIX,
+                       journal_file):
+        if os.path.exists(filename):
+          os.remove(filename)
+    finally:
+      self.__file_lock.release()
+
+  def __ReadIndexed(self, filename):
+    """Reads the index of a datastore file written by __WriteIndexed.
+
+    Only the index is decoded; the entities are left in the memory-mapped
+    file until they are first used.
+
+    Returns:
+      A list of (key value, _LazyStoredEntity) tuples, or None if the file does
+      not exist or is in the older pickled format.
+    """
+    self.__file_lock.acquire()
+
+    try:
+      if not (filename and filename != '/dev/null' and
+              os.path.isfile(filename)):
+        return None
+      datafile = open(filename, 'rb')
+      try:
+        if datafile.read(len(_INDEXED_MAGIC)) != _INDEXED_MAGIC:
+          return None
+        try:
+          buf = _MapFile(datafile)
+          index_end = len(buf) - _INDEXED_TRAILER.size
+          index_offset, magic = _INDEXED_TRAILER.unpack(buf[index_end:])
+          if magic != _INDEXED_MAGIC or not 0 < index_offset <= index_end:
+            raise ValueError('the index of the file is missing')
+          index = pickle.loads(buf[index_offset:index_end])
+          return [(k, _LazyStoredEntity(buf, offset, length))
+                  for k, offset, length in index]
+        except (AttributeError, LookupError, ImportError, NameError,
+                TypeError, ValueError, EOFError, struct.error,
+                pickle.PickleError), e:
+          raise apiproxy_errors.ApplicationError(
+              datastore_pb.Error.INTERNAL_ERROR,
+              'Could not read data from %s. Try running with the '
+              '--clear_datastore flag. Cause:\n%r' % (filename, e))
+      finally:
+        datafile.close()
+    finally:
+      self.__file_lock.release()
 
   def __ReadPickled(self, filename):
     """Reads a pickled object from the given file and returns it.
@@ -523,23 +1176,39 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
     return []
 
-  def __WritePickled(self, obj, filename):
-    """Pickles the object and writes it to the given file.
+  def __WriteIndexed(self, entities, filename, allow_empty=False):
+    """Writes the given entities and an index of them to the given file.
+
+    The encoded entities are written back to back, followed by a pickled list
+    of (key value, offset, length) tuples and a trailer holding the offset of
+    that list.
+
+    Args:
+      entities: a list of (key value, _StoredEntity) tuples.
+      filename: the file to write.
+      allow_empty: if the file should be written even if there are no
+        entities.
     """
-    if not filename or filename == '/dev/null' or not obj:
+    if not filename or filename == '/dev/null' or not (entities or allow_empty):
       return
 
 
     descriptor, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename))
     tmpfile = os.fdopen(descriptor, 'wb')
 
+    tmpfile.write(_INDEXED_MAGIC)
+    offset = len(_INDEXED_MAGIC)
+    index = []
+    for k, stored in entities:
+      encoded = stored.encoded_protobuf
+      tmpfile.write(encoded)
+      index.append((k, offset, len(encoded)))
+      offset += len(encoded)
 
-
-
-
-    pickler = pickle.Pickler(tmpfile, protocol=1)
+    pickler = pickle.Pickler(tmpfile, protocol=2)
     pickler.fast = True
-    pickler.dump(obj)
+    pickler.dump(index)
+    tmpfile.write(_INDEXED_TRAILER.pack(offset, _INDEXED_MAGIC))
 
     tmpfile.close()
 
@@ -601,6 +1270,7 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
     self.__entities_lock.acquire()
     try:
       self._StoreEntity(entity, insert)
+      self.__MarkDirty(entity.key())
     finally:
       self.__entities_lock.release()
 
@@ -615,28 +1285,17 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
       pass
 
   def _Delete(self, key):
-    app_kind, eg_k, k = self._GetEntityLocation(key)
-
     self.__entities_lock.acquire()
     try:
-      del self.__entities_by_kind[app_kind][k]
-      del self.__entities_by_group[eg_k][k]
-      if not self.__entities_by_kind[app_kind]:
-
-        del self.__entities_by_kind[app_kind]
-      if not self.__entities_by_group[eg_k]:
-        del self.__entities_by_group[eg_k]
-
-      del self.__schema_cache[app_kind]
-    except KeyError:
-
-      pass
+      self._RemoveEntity(key)
+      self.__MarkDirty(key)
     finally:
       self.__entities_lock.release()
 
   def _GetEntitiesInEntityGroup(self, entity_group):
     eg_k = datastore_types.ReferenceToKeyValue(entity_group)
-    return self.__entities_by_group[eg_k].copy()
+    return dict((k, stored.protobuf) for k, stored
+                in self.__entities_by_group[eg_k].items())
 
   def _GetQueryCursor(self, query, filters, orders):
     app_id = query.app()
@@ -649,6 +1308,7 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
 
 
+    indexed = None
     self.__entities_lock.acquire()
     try:
       app_ns = datastore_types.EncodeAppIdNamespace(app_id, namespace)
@@ -656,6 +1316,13 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
         (results, filters, orders) = pseudo_kind.Query(self.__entities_by_kind,
                                                        query, filters, orders)
+      elif query.has_kind() and not query.has_ancestor():
+        indexed = self.__QueryKindIndex((app_ns, query.kind()), filters,
+                                        datastore_stub_util._GuessOrders(
+                                            filters, orders))
+        if indexed is None:
+          results = [entity.protobuf for entity in
+                     self.__entities_by_kind[app_ns, query.kind()].values()]
       elif query.has_kind():
         results = [entity.protobuf for entity in
                    self.__entities_by_kind[app_ns, query.kind()].values()]
@@ -669,8 +1336,67 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
     finally:
       self.__entities_lock.release()
 
+    if indexed is not None:
+      orders = datastore_stub_util._GuessOrders(filters, orders)
+      dsquery = datastore_stub_util._MakeQuery(query, filters, orders)
+      return datastore_stub_util.ListCursor(query, dsquery, orders, indexed)
     return datastore_stub_util._ExecuteQuery(results, query, filters, orders)
 
+  def __QueryKindIndex(self, app_kind, filters, orders):
+    """Runs a kind query against the property indexes of its kind.
+
+    Only queries on at most one property besides __key__ are answered: a
+    single equality filter or any inequality filters on the property, and
+    optionally an order on it.  Everything else is left to _ExecuteQuery.
+
+    Any needed locking should be managed by the caller.
+
+    Args:
+      app_kind: the (app_ns, kind) the query is over.
+      filters: the normalized filters of the query.
+      orders: the orders of the query as returned by _GuessOrders.
+
+    Returns:
+      The list of matching entity_pb.EntityProto in query order, or None if
+      the query has to be executed over every entity of the kind.
+
+    Raises:
+      KeyError: if there are no entities of the kind.
+    """
+    entities = self.__entities_by_kind[app_kind]
+
+    key_order = orders[-1]
+    if (key_order.property() != datastore_types.KEY_SPECIAL_PROPERTY or
+        key_order.direction() != datastore_pb.Query_Order.ASCENDING or
+        len(orders) > 2):
+      return None
+    orders = orders[:-1]
+
+    names = set(filter_pb.property(0).name() for filter_pb in filters)
+    names.update(order.property() for order in orders)
+    if len(names) > 1 or datastore_types.KEY_SPECIAL_PROPERTY in names:
+      return None
+    ops = [filter_pb.op() for filter_pb in filters]
+    if not _KindIndex.OPERATORS.issuperset(ops):
+      return None
+    if datastore_pb.Query_Filter.EQUAL in ops and len(ops) > 1:
+      return None
+
+    if not names:
+      return [entities[k].protobuf for k in sorted(entities)]
+
+    kind_index = self.__kind_indexes.get(app_kind)
+    if kind_index is None:
+      kind_index = _KindIndex(entities)
+      self.__kind_indexes[app_kind] = kind_index
+
+    name = names.pop()
+    lo, hi = kind_index.Range(name, filters)
+    descending = bool(orders) and (
+        orders[0].direction() == datastore_pb.Query_Order.DESCENDING)
+    return [entities[k].protobuf
+            for k in kind_index.Keys(name, lo, hi, descending)]
+
   def _AllocateIds(self, reference, size=1, max_id=None):
     datastore_stub_util.Check(not (size and max_id),
                               'Both size and max cannot be set.')
@@ -694,7 +1420,10 @@ class DatastoreFileStub(datastore_stub_util.BaseDatastore,
 
 
   def _OnApply(self):
-    self.__WriteDatastore()
+    if self.__use_journal:
+      self.__WriteJournal()
+    else:
+      self.__WriteDatastore()
 
   def _Dynamic_RunQuery(self, query, query_result):
     super(DatastoreFileStub, self)._Dynamic_RunQuery(query, query_result)
@@ -25,12 +25,23 @@ See http://en.wikipedia.org/wiki/Cyclic_redundancy_check for details on CRC-32C.
 This code is a manual python translation of c code generated by
 pycrc 0.7.1 (http://www.tty1.net/pycrc/). Command line used:
 './pycrc.py --model=crc-32c --generate c --algorithm=table-driven'
+
+Buffers are processed eight bytes at a time using the slicing-by-8 technique:
+eight tables derived from CRC_TABLE let one step fold in a whole 64-bit word.
+When the crcmod package with its C extension is importable it is used
+instead; both paths produce the same checksums as the byte-wise algorithm.
 """
 
 
 
 
 import array
+import struct
+
+try:
+  import crcmod
+except ImportError:
+  crcmod = None
 
 CRC_TABLE = (
     0x00000000L, 0xf26b8303L, 0xe13b70f7L, 0x1350f3f4L,
@@ -106,6 +117,85 @@ CRC_INIT = 0
 _MASK = 0xFFFFFFFFL
 
 
+_POLY = 0x11EDC6F41L
+
+
+_SLICE_BYTES = 8
+
+
+def _make_slice_tables():
+  """Builds the slicing-by-8 tables.
+
+  Table k maps a byte to its contribution to the CRC when it is followed by
+  k more bytes, so table 0 is CRC_TABLE itself.
+
+  Returns:
+    A tuple of eight 256-entry tuples of ints.
+  """
+  tables = [tuple(int(v) for v in CRC_TABLE)]
+  for _ in xrange(1, _SLICE_BYTES):
+    previous = tables[-1]
+    tables.append(tuple((v >> 8) ^ tables[0][v & 0xff] for v in previous))
+  return tuple(tables)
+
+
+_SLICE_TABLES = _make_slice_tables()
+
+
+def _make_native_crc_update():
+  """Returns crcmod's native CRC-32C update function, or None."""
+  if crcmod is None:
+    return None
+  try:
+    if not crcmod.crcmod._usingExtension:
+      return None
+    return crcmod.mkCrcFun(_POLY, initCrc=0, rev=True, xorOut=_MASK)
+  except (AttributeError, ValueError, TypeError):
+    return None
+
+
+_native_crc_update = _make_native_crc_update()
+
+
+def _to_string(data):
+  """Converts data accepted by crc_update to a byte string."""
+  if isinstance(data, str):
+    return data
+  if type(data) != array.array or data.itemsize != 1:
+    data = array.array("B", data)
+  return data.tostring()
+
+
+def _sliced_crc_update(crc, data):
+  """Updates a CRC-32C with a byte string eight bytes at a time.
+
+  Args:
+    crc: 32-bit checksum to update.
+    data: the bytes to add to the checksum, as a string.
+
+  Returns:
+    32-bit updated CRC-32C as long.
+  """
+  t0, t1, t2, t3, t4, t5, t6, t7 = _SLICE_TABLES
+  crc = int(crc ^ _MASK)
+
+  length = len(data)
+  words = length // _SLICE_BYTES
+  if words:
+    values = struct.unpack("<%dI" % (2 * words), data[:words * _SLICE_BYTES])
+    for i in xrange(0, 2 * words, 2):
+      low = crc ^ values[i]
+      high = values[i + 1]
+      crc = (t7[low & 0xff] ^ t6[(low >> 8) & 0xff] ^
+             t5[(low >> 16) & 0xff] ^ t4[low >> 24] ^
+             t3[high & 0xff] ^ t2[(high >> 8) & 0xff] ^
+             t1[(high >> 16) & 0xff] ^ t0[high >> 24])
+
+  for b in array.array("B", data[words * _SLICE_BYTES:]):
+    crc = t0[(crc ^ b) & 0xff] ^ (crc >> 8)
+  return long(crc ^ _MASK)
+
+
 def crc_update(crc, data):
   """Update CRC-32C checksum with data.
 
@@ -116,17 +206,11 @@ def crc_update(crc, data):
   Returns:
     32-bit updated CRC-32C as long.
   """
-
-  if type(data) != array.array or data.itemsize != 1:
-    buf = array.array("B", data)
-  else:
-    buf = data
-
-  crc = crc ^ _MASK
-  for b in buf:
-    table_index = (crc ^ b) & 0xff
-    crc = (CRC_TABLE[table_index] ^ (crc >> 8)) & _MASK
-  return crc ^ _MASK
+  data = _to_string(data)
+  crc &= _MASK
+  if _native_crc_update is not None:
+    return long(_native_crc_update(data, crc))
+  return _sliced_crc_update(crc, data)
 
 
 def crc_finalize(crc):
@@ -45,6 +45,12 @@ MemcacheDeleteResponse = memcache_service_pb.MemcacheDeleteResponse
 MAX_REQUEST_SIZE = 32 << 20
 
 
+DEFAULT_MAX_CACHE_BYTES = 64 << 20
+
+
+DEFAULT_SWEEP_INTERVAL_SECONDS = 60
+
+
 class CacheEntry(object):
   """An entry in the cache."""
 
@@ -68,6 +74,7 @@ class CacheEntry(object):
     self.flags = flags
     self.cas_id = cas_id
     self.created_time = self._gettime()
+    self.last_accessed = self.created_time
     self.will_expire = expiration != 0
     self.locked = False
     self._SetExpiration(expiration)
@@ -107,28 +114,98 @@ class CacheEntry(object):
     return self.locked and not self.CheckExpired()
 
 
+class _LruList(object):
+  """A set of cache keys ordered from most to least recently used.
+
+  Implemented as a circular doubly-linked list of [prev, next, key] nodes plus
+  a dict from key to node, so all operations are O(1).
+  """
+
+  def __init__(self):
+    self.Clear()
+
+  def Clear(self):
+    """Removes all keys."""
+    self._root = []
+    self._root[:] = [self._root, self._root, None]
+    self._nodes = {}
+
+  def __len__(self):
+    return len(self._nodes)
+
+  def Touch(self, key):
+    """Adds a key as, or moves an existing key to, the most recently used."""
+    node = self._nodes.get(key)
+    if node is not None:
+      node[0][1] = node[1]
+      node[1][0] = node[0]
+    else:
+      node = [None, None, key]
+      self._nodes[key] = node
+    root = self._root
+    node[0] = root
+    node[1] = root[1]
+    root[1][0] = node
+    root[1] = node
+
+  def Remove(self, key):
+    """Removes a key, if present."""
+    node = self._nodes.pop(key, None)
+    if node is not None:
+      node[0][1] = node[1]
+      node[1][0] = node[0]
+
+  def Oldest(self):
+    """Returns the least recently used key, or None if there are no keys."""
+    return self._root[0][2]
+
+
 class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
   """Python only memcache service stub.
 
   This stub keeps all data in the local process' memory, not in any
   external servers.
+
+  Like the real service, it evicts the least recently used entries across all
+  namespaces once the keys and values it stores exceed a byte budget, and it
+  periodically removes expired entries.
   """
 
-  def __init__(self, gettime=time.time, service_name='memcache'):
+  def __init__(self, gettime=time.time, service_name='memcache',
+               max_cache_bytes=DEFAULT_MAX_CACHE_BYTES,
+               sweep_interval_seconds=DEFAULT_SWEEP_INTERVAL_SECONDS):
     """Initializer.
 
     Args:
       gettime: time.time()-like function used for testing.
       service_name: Service name expected for all calls.
+      max_cache_bytes: The number of bytes of keys and values to keep before
+        evicting the least recently used entries, or None not to evict.
+      sweep_interval_seconds: The minimum number of seconds between two scans
+        for expired entries.
     """
     super(MemcacheServiceStub, self).__init__(service_name,
                                               max_request_size=MAX_REQUEST_SIZE)
     self._next_cas_id = 1
     self._gettime = lambda: int(gettime())
+    self._max_cache_bytes = max_cache_bytes
+    self._sweep_interval_seconds = sweep_interval_seconds
     self._ResetStats()
 
 
     self._the_cache = {}
+    self._lru = _LruList()
+    self._cache_bytes = 0
+    self._last_sweep_time = self._gettime()
+
+  def MakeSyncCall(self, service, call, request, response):
+    """The main RPC entry point. Sweeps expired entries when one is due."""
+    now = self._gettime()
+    if now - self._last_sweep_time >= self._sweep_interval_seconds:
+      self._last_sweep_time = now
+      self._RemoveExpired()
+    super(MemcacheServiceStub, self).MakeSyncCall(service, call, request,
+                                                  response)
 
   def _ResetStats(self):
     """Resets statistics information."""
@@ -137,7 +214,67 @@ class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
     self._misses = 0
     self._byte_hits = 0
 
-    self._cache_creation_time = self._gettime()
+  def _StoreEntry(self, namespace, key, entry):
+    """Stores a CacheEntry, evicting old entries if over the byte budget.
+
+    An entry larger than the whole byte budget is rejected before anything is
+    evicted, so that it cannot flush the cache, and the cache is left as it
+    was.
+
+    Args:
+      namespace: The namespace that keys are stored under.
+      key: The key to store the entry under.
+      entry: The CacheEntry to store.
+
+    Returns:
+      True if the entry was stored, False if it was too large.
+    """
+    size = len(key) + len(entry.value)
+    if self._max_cache_bytes is not None and size > self._max_cache_bytes:
+      return False
+    self._RemoveEntry(namespace, key)
+    self._the_cache.setdefault(namespace, {})[key] = entry
+    self._lru.Touch((namespace, key))
+    self._cache_bytes += size
+
+    if self._max_cache_bytes is not None:
+      while self._cache_bytes > self._max_cache_bytes:
+        self._RemoveEntry(*self._lru.Oldest())
+    return True
+
+  def _RemoveEntry(self, namespace, key):
+    """Removes the CacheEntry stored under a key, if any.
+
+    Args:
+      namespace: The namespace that keys are stored under.
+      key: The key to remove.
+    """
+    namespace_dict = self._the_cache.get(namespace)
+    if namespace_dict is None or key not in namespace_dict:
+      return
+    entry = namespace_dict.pop(key)
+    if not namespace_dict:
+      del self._the_cache[namespace]
+    self._lru.Remove((namespace, key))
+    self._cache_bytes -= len(key) + len(entry.value)
+
+  def _TouchEntry(self, namespace, key, entry):
+    """Marks a CacheEntry as the most recently used one.
+
+    Args:
+      namespace: The namespace that keys are stored under.
+      key: The key the entry is stored under.
+      entry: The CacheEntry.
+    """
+    entry.last_accessed = self._gettime()
+    self._lru.Touch((namespace, key))
+
+  def _RemoveExpired(self):
+    """Removes all entries that have expired."""
+    for namespace, namespace_dict in self._the_cache.items():
+      for key, entry in namespace_dict.items():
+        if entry.CheckExpired():
+          self._RemoveEntry(namespace, key)
 
   def _GetKey(self, namespace, key):
     """Retrieves a CacheEntry from the cache if it hasn't expired.
@@ -159,7 +296,7 @@ class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
     if entry is None:
       return None
     elif entry.CheckExpired():
-      del namespace_dict[key]
+      self._RemoveEntry(namespace, key)
       return None
     else:
       return entry
@@ -180,6 +317,7 @@ class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
         continue
       self._hits += 1
       self._byte_hits += len(entry.value)
+      self._TouchEntry(namespace, key, entry)
       item = response.add_item()
       item.set_key(key)
       item.set_value(entry.value)
@@ -221,14 +359,14 @@ class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
           set_status = MemcacheSetResponse.STORED
 
       if set_status == MemcacheSetResponse.STORED:
-        if namespace not in self._the_cache:
-          self._the_cache[namespace] = {}
-        self._the_cache[namespace][key] = CacheEntry(item.value(),
-                                                     item.expiration_time(),
-                                                     item.flags(),
-                                                     self._next_cas_id,
-                                                     gettime=self._gettime)
-        self._next_cas_id += 1
+        if self._StoreEntry(namespace, key, CacheEntry(item.value(),
+                                                       item.expiration_time(),
+                                                       item.flags(),
+                                                       self._next_cas_id,
+                                                       gettime=self._gettime)):
+          self._next_cas_id += 1
+        else:
+          set_status = MemcacheSetResponse.ERROR
 
       response.add_set_status(set_status)
 
@@ -248,7 +386,7 @@ class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
       if entry is None:
         delete_status = MemcacheDeleteResponse.NOT_FOUND
       elif item.delete_time() == 0:
-        del self._the_cache[namespace][key]
+        self._RemoveEntry(namespace, key)
       else:
 
         entry.ExpireAndLock(item.delete_time())
@@ -271,16 +409,16 @@ class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
     if entry is None:
       if not request.has_initial_value():
         return None
-      if namespace not in self._the_cache:
-        self._the_cache[namespace] = {}
       flags = 0
       if request.has_initial_flags():
         flags = request.initial_flags()
-      self._the_cache[namespace][key] = CacheEntry(str(request.initial_value()),
-                                                   expiration=0,
-                                                   flags=flags,
-                                                   cas_id=self._next_cas_id,
-                                                   gettime=self._gettime)
+      if not self._StoreEntry(namespace, key,
+                              CacheEntry(str(request.initial_value()),
+                                         expiration=0,
+                                         flags=flags,
+                                         cas_id=self._next_cas_id,
+                                         gettime=self._gettime)):
+        return None
       self._next_cas_id += 1
       entry = self._GetKey(namespace, key)
       assert entry is not None
@@ -305,7 +443,10 @@ class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
 
     new_value = max(old_value + delta, 0) % (2**64)
 
+    self._cache_bytes -= len(entry.value)
     entry.value = str(new_value)
+    self._cache_bytes += len(entry.value)
+    self._TouchEntry(namespace, key, entry)
     return new_value
 
   def _Dynamic_Increment(self, request, response):
@@ -347,6 +488,8 @@ class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
       response: A MemcacheFlushResponse.
     """
     self._the_cache.clear()
+    self._lru.Clear()
+    self._cache_bytes = 0
     self._ResetStats()
 
   def _Dynamic_Stats(self, request, response):
@@ -360,14 +503,14 @@ class MemcacheServiceStub(apiproxy_stub.APIProxyStub):
     stats.set_hits(self._hits)
     stats.set_misses(self._misses)
     stats.set_byte_hits(self._byte_hits)
-    items = 0
-    total_bytes = 0
-    for namespace in self._the_cache.itervalues():
-      items += len(namespace)
-      for entry in namespace.itervalues():
-        total_bytes += len(entry.value)
-    stats.set_items(items)
-    stats.set_bytes(total_bytes)
+    stats.set_items(len(self._lru))
+    stats.set_bytes(self._cache_bytes)
 
 
-    stats.set_oldest_item_age(self._gettime() - self._cache_creation_time)
+    oldest = self._lru.Oldest()
+    if oldest is None:
+      stats.set_oldest_item_age(0)
+    else:
+      namespace, key = oldest
+      entry = self._the_cache[namespace][key]
+      stats.set_oldest_item_age(self._gettime() - entry.last_accessed)
@@ -18,8 +18,15 @@
 
 
 
-"""Simple RAM backed Search API stub."""
+"""Simple RAM backed Search API stub.
 
+Indexes can optionally be persisted to a directory. Every call that changes
+an index appends a segment file holding the added documents, their postings
+and the removed doc numbers, and a manifest lists each index's segments in
+order. On startup only the manifest is read; an index's segments are read
+when it is first used, and documents and postings are decoded on demand.
+Once an index has too many segments they are replaced by a single one.
+"""
 
 
 
@@ -29,10 +36,17 @@
 
 
 
+
+import array
 import bisect
+import cPickle as pickle
 import copy
+import logging
+import os
 import random
 import string
+import struct
+import tempfile
 import urllib
 import uuid
 
@@ -44,7 +58,8 @@ from google.appengine.api.search import search
 from google.appengine.api.search import search_service_pb
 from google.appengine.runtime import apiproxy_errors
 
-__all__ = ['IndexConsistencyError',
+__all__ = ['CompactPostingList',
+           'IndexConsistencyError',
            'Number',
            'Posting',
            'PostingList',
@@ -57,6 +72,17 @@ __all__ = ['IndexConsistencyError',
           ]
 
 
+MANIFEST_FILENAME = 'manifest'
+
+_MANIFEST_VERSION = 3
+
+SEGMENT_SUFFIX = '.segment'
+
+_SEGMENT_MERGE_FACTOR = 2
+
+_FIELD_POSITION_GAP = search.SearchRequest._MAXIMUM_QUERY_LENGTH
+
+
 class IndexConsistencyError(Exception):
   """Indicates attempt to create index with same name different consistency."""
 
@@ -281,71 +307,607 @@ class PostingList(object):
     return _Repr(self, [('postings', self.postings)])
 
 
+_POSTING_BLOCK_SIZE = 128
+
+_POSTING_HEADER = struct.Struct('<4I')
+
+
+def _GallopIntersect(small, large):
+  """Intersects two sorted lists of ints by galloping through the larger one.
+
+  Args:
+    small: the shorter sorted list.
+    large: the longer sorted list.
+
+  Returns:
+    A sorted list of the ints in both lists.
+  """
+  result = []
+  lo = 0
+  n = len(large)
+  for value in small:
+    step = 1
+    hi = lo
+    while hi < n and large[hi] < value:
+      lo = hi + 1
+      hi += step
+      step *= 2
+    lo = bisect.bisect_left(large, value, lo, min(hi + 1, n))
+    if lo == n:
+      break
+    if large[lo] == value:
+      result.append(value)
+  return result
+
+
+class _PostingArraysBuilder(object):
+  """Builds the arrays of a CompactPostingList one document at a time."""
+
+  def __init__(self, posting_list=None):
+    """Constructor.
+
+    Args:
+      posting_list: a CompactPostingList whose arrays to append to, or None
+        to start from empty arrays.
+    """
+    if posting_list is None:
+      self._skips = array.array('i')
+      self._deltas = array.array('i')
+      self._position_starts = array.array('i', [0])
+      self._positions = array.array('i')
+      self._last_doc_number = 0
+    else:
+      self._skips = posting_list._skips
+      self._deltas = posting_list._deltas
+      self._position_starts = posting_list._position_starts
+      self._positions = posting_list._positions
+      self._last_doc_number = posting_list._LastDocNumber()
+
+  def Append(self, doc_number, positions):
+    """Appends a document with a sorted list of positions."""
+    last = 0
+    encoded = array.array('i')
+    for position in positions:
+      encoded.append(position - last)
+      last = position
+    self.AppendEncoded(doc_number, encoded)
+
+  def AppendEncoded(self, doc_number, encoded_positions):
+    """Appends a document with an array of gap-encoded positions."""
+    if len(self._deltas) % _POSTING_BLOCK_SIZE:
+      self._deltas.append(doc_number - self._last_doc_number)
+    else:
+      self._skips.append(doc_number)
+      self._deltas.append(0)
+    self._last_doc_number = doc_number
+    self._positions.extend(encoded_positions)
+    self._position_starts.append(len(self._positions))
+
+  def Build(self, posting_list):
+    """Stores the arrays in posting_list and returns it."""
+    posting_list._skips = self._skips
+    posting_list._deltas = self._deltas
+    posting_list._position_starts = self._position_starts
+    posting_list._positions = self._positions
+    posting_list._decoded_block = (None, None)
+    return posting_list
+
+
+class CompactPostingList(object):
+  """Represents the postings of a token as delta-encoded integer arrays.
+
+  Documents are identified by integer doc numbers and kept sorted. They are
+  stored in blocks of _POSTING_BLOCK_SIZE: the skip array holds the first doc
+  number of every block and the delta array the gap from the previous doc
+  number in the block, so a single block can be found by galloping over the
+  skips and decoded on its own. The positions of each document are stored as
+  gaps from the previous position in one shared array.
+
+  Changes are buffered per document and merged into the arrays the next time
+  the list is read.
+  """
+
+  def __init__(self):
+    self._skips = array.array('i')
+    self._deltas = array.array('i')
+    self._position_starts = array.array('i', [0])
+    self._positions = array.array('i')
+    self._pending = {}
+    self._decoded_block = (None, None)
+
+  def AddPosition(self, doc_number, position):
+    """Adds the position in token sequence to occurrences for a document."""
+    positions = self._pending.get(doc_number)
+    if positions is None:
+      positions = self._pending[doc_number] = self._FrozenPositions(doc_number)
+    pos = bisect.bisect_left(positions, position)
+    if pos == len(positions) or positions[pos] != position:
+      positions.insert(pos, position)
+
+  def RemoveDocument(self, doc_number):
+    """Removes all occurrences for a document."""
+    self._pending[doc_number] = []
+
+  def DocNumbers(self):
+    """Returns the sorted list of doc numbers in the posting list."""
+    self._Freeze()
+    result = []
+    append = result.append
+    skips = self._skips
+    doc_number = 0
+    for i, delta in enumerate(self._deltas):
+      if i % _POSTING_BLOCK_SIZE:
+        doc_number += delta
+      else:
+        doc_number = skips[i // _POSTING_BLOCK_SIZE]
+      append(doc_number)
+    return result
+
+  def Positions(self, doc_number):
+    """Returns the sorted positions for a document, or None if absent."""
+    self._Freeze()
+    index = self._Find(doc_number)
+    if index < 0:
+      return None
+    return self._DecodePositions(index)
+
+  def Intersect(self, doc_numbers):
+    """Returns the doc numbers from a sorted list which are in this list.
+
+    Args:
+      doc_numbers: sorted list of doc numbers.
+
+    Returns:
+      The sorted list of doc numbers present in both lists.
+    """
+    self._Freeze()
+    result = []
+    block = 0
+    for doc_number in doc_numbers:
+      block = self._GallopBlock(doc_number, block)
+      if block < 0:
+        block = 0
+        continue
+      decoded = self._DecodeBlock(block)
+      i = bisect.bisect_left(decoded, doc_number)
+      if i < len(decoded) and decoded[i] == doc_number:
+        result.append(doc_number)
+    return result
+
+  def _GallopBlock(self, doc_number, lo):
+    """Finds the last block starting at or before doc_number, from block lo."""
+    skips = self._skips
+    n = len(skips)
+    step = 1
+    hi = lo + 1
+    while hi < n and skips[hi] <= doc_number:
+      lo = hi
+      hi += step
+      step *= 2
+    return bisect.bisect_right(skips, doc_number, lo, min(hi, n)) - 1
+
+  def _DecodeBlock(self, block):
+    """Returns the doc numbers of a block as a list."""
+    if self._decoded_block[0] == block:
+      return self._decoded_block[1]
+    start = block * _POSTING_BLOCK_SIZE
+    doc_number = self._skips[block]
+    decoded = [doc_number]
+    for delta in self._deltas[start + 1:start + _POSTING_BLOCK_SIZE]:
+      doc_number += delta
+      decoded.append(doc_number)
+    self._decoded_block = (block, decoded)
+    return decoded
+
+  def _Find(self, doc_number):
+    """Returns the index of a document in the frozen arrays, or -1."""
+    block = self._GallopBlock(doc_number, 0)
+    if block < 0:
+      return -1
+    decoded = self._DecodeBlock(block)
+    i = bisect.bisect_left(decoded, doc_number)
+    if i < len(decoded) and decoded[i] == doc_number:
+      return block * _POSTING_BLOCK_SIZE + i
+    return -1
+
+  def _DecodePositions(self, index):
+    """Returns the positions of the document at index as a list."""
+    positions = []
+    position = 0
+    for delta in self._positions[self._position_starts[index]:
+                                 self._position_starts[index + 1]]:
+      position += delta
+      positions.append(position)
+    return positions
+
+  def _FrozenPositions(self, doc_number):
+    """Returns a copy of the frozen positions for a document."""
+    index = self._Find(doc_number)
+    if index < 0:
+      return []
+    return self._DecodePositions(index)
+
+  def _LastDocNumber(self):
+    """Returns the greatest frozen doc number, or -1 if there is none."""
+    if not self._deltas:
+      return -1
+    block_start = (len(self._deltas) - 1) // _POSTING_BLOCK_SIZE
+    return self._skips[-1] + sum(
+        self._deltas[block_start * _POSTING_BLOCK_SIZE + 1:])
+
+  def _Freeze(self):
+    """Merges buffered changes into the encoded arrays.
+
+    Changes which only add documents after the frozen ones are appended in
+    place, so building a list in doc number order stays linear.
+    """
+    if not self._pending:
+      return
+    updates = sorted(self._pending.iteritems())
+    self._pending = {}
+    if updates[0][0] > self._LastDocNumber():
+      builder = _PostingArraysBuilder(self)
+      for doc_number, new_positions in updates:
+        if new_positions:
+          builder.Append(doc_number, new_positions)
+      builder.Build(self)
+      return
+    old_doc_numbers = self.DocNumbers()
+    builder = _PostingArraysBuilder()
+
+    i = 0
+    n = len(old_doc_numbers)
+    for doc_number, new_positions in updates:
+      while i < n and old_doc_numbers[i] < doc_number:
+        builder.AppendEncoded(old_doc_numbers[i], self._EncodedPositions(i))
+        i += 1
+      if i < n and old_doc_numbers[i] == doc_number:
+        i += 1
+      if new_positions:
+        builder.Append(doc_number, new_positions)
+    while i < n:
+      builder.AppendEncoded(old_doc_numbers[i], self._EncodedPositions(i))
+      i += 1
+    builder.Build(self)
+
+  def _EncodedPositions(self, index):
+    """Returns the gap-encoded positions of the document at index."""
+    return self._positions[self._position_starts[index]:
+                           self._position_starts[index + 1]]
+
+  def Select(self, doc_numbers):
+    """Returns a new CompactPostingList restricted to the given documents.
+
+    Args:
+      doc_numbers: sorted list of doc numbers.
+
+    Returns:
+      A CompactPostingList holding the postings of those doc numbers.
+    """
+    builder = _PostingArraysBuilder()
+    for doc_number in self.Intersect(doc_numbers):
+      builder.AppendEncoded(doc_number,
+                            self._EncodedPositions(self._Find(doc_number)))
+    return builder.Build(CompactPostingList())
+
+  @classmethod
+  def Concatenate(cls, posting_lists, removed_doc_numbers):
+    """Joins posting lists whose doc numbers increase from list to list.
+
+    Args:
+      posting_lists: CompactPostingLists, each holding only doc numbers
+        greater than those in the lists before it.
+      removed_doc_numbers: a set of doc numbers to leave out.
+
+    Returns:
+      A new CompactPostingList.
+    """
+    builder = _PostingArraysBuilder()
+    for posting_list in posting_lists:
+      for i, doc_number in enumerate(posting_list.DocNumbers()):
+        if doc_number not in removed_doc_numbers:
+          builder.AppendEncoded(doc_number,
+                                posting_list._EncodedPositions(i))
+    return builder.Build(cls())
+
+  def Encode(self):
+    """Returns the posting list serialized as a string."""
+    self._Freeze()
+    arrays = (self._skips, self._deltas, self._position_starts,
+              self._positions)
+    return (_POSTING_HEADER.pack(*[len(a) for a in arrays]) +
+            ''.join(a.tostring() for a in arrays))
+
+  @classmethod
+  def Decode(cls, encoded):
+    """Creates a CompactPostingList from the result of Encode()."""
+    posting_list = cls()
+    arrays = (posting_list._skips, posting_list._deltas,
+              array.array('i'), posting_list._positions)
+    offset = _POSTING_HEADER.size
+    for a, length in zip(arrays, _POSTING_HEADER.unpack_from(encoded)):
+      end = offset + length * a.itemsize
+      a.fromstring(encoded[offset:end])
+      offset = end
+    posting_list._position_starts = arrays[2]
+    return posting_list
+
+  def __len__(self):
+    self._Freeze()
+    return len(self._deltas)
+
+  def __repr__(self):
+    return _Repr(self, [('doc_numbers', self.DocNumbers())])
+
+
 class RamInvertedIndex(object):
-  """A simple RAM-resident inverted file over documents."""
+  """A simple RAM-resident inverted file over documents.
+
+  Documents are given increasing integer doc numbers as they are added, and
+  each token maps to a CompactPostingList of those numbers.
+  """
+
+  def __init__(self, tokenizer, track_changes=False):
+    """Constructor.
 
-  def __init__(self, tokenizer):
+    Args:
+      tokenizer: the SimpleTokenizer to split field values with.
+      track_changes: whether to record the changes for TakeSegment(). An
+        index which is never persisted leaves this off, so that the records
+        do not grow for as long as it lives.
+    """
     self._tokenizer = tokenizer
+    self._track_changes = track_changes
     self._inverted_index = {}
+    self._doc_numbers = {}
+    self._doc_ids = {}
+    self._next_doc_number = 0
+    self._persisted_postings = {}
+    self._persisted_removed = set()
+    self._added_doc_numbers = set()
+    self._removed_doc_numbers = set()
+    self._changed_tokens = set()
 
   def AddDocument(self, doc_id, document):
-    """Adds a document into the index."""
+    """Adds a document into the index.
+
+    The token positions of consecutive fields are _FIELD_POSITION_GAP apart,
+    more than a query can have tokens, so that no phrase matches across the
+    end of one field and the start of the next.
+    """
+    doc_number = self._doc_numbers.get(doc_id)
+    if doc_number is None:
+      doc_number = self._next_doc_number
+      self._next_doc_number += 1
+      self._doc_numbers[doc_id] = doc_number
+      self._doc_ids[doc_number] = doc_id
+      if self._track_changes:
+        self._added_doc_numbers.add(doc_number)
     token_position = 0
     for field in document.field_list():
-      self._AddTokens(doc_id, field.name(), field.value(),
-                      token_position)
+      token_position = self._AddTokens(doc_number, field.name(),
+                                       field.value(), token_position)
+      token_position += _FIELD_POSITION_GAP
 
   def RemoveDocument(self, document):
     """Removes a document from the index."""
     doc_id = document.id()
+    doc_number = self._doc_numbers.pop(doc_id, None)
+    if doc_number is None:
+      return
+    del self._doc_ids[doc_number]
+    if self._track_changes:
+      self._added_doc_numbers.discard(doc_number)
+      self._removed_doc_numbers.add(doc_number)
     for field in document.field_list():
-      self._RemoveTokens(doc_id, field.name(), field.value())
+      self._RemoveTokens(doc_number, field.name(), field.value())
 
-  def _AddTokens(self, doc_id, field_name, field_value, token_position):
-    """Adds token occurrences for a given doc's field value."""
+  def _AddTokens(self, doc_number, field_name, field_value, token_position):
+    """Adds token occurrences for a given doc's field value.
+
+    Returns:
+      The position after the last token of the field.
+    """
     for token in self._tokenizer.TokenizeValue(field_value, token_position):
-      self._AddToken(doc_id, token)
-      self._AddToken(doc_id, token.RestrictField(field_name))
+      self._AddToken(doc_number, token)
+      self._AddToken(doc_number, token.RestrictField(field_name))
+      token_position = token.position + 1
+    return token_position
 
-  def _RemoveTokens(self, doc_id, field_name, field_value):
+  def _RemoveTokens(self, doc_number, field_name, field_value):
     """Removes tokens occurrences for a given doc's field value."""
     for token in self._tokenizer.TokenizeValue(field_value=field_value):
-      self._RemoveToken(doc_id, token)
-      self._RemoveToken(doc_id, token.RestrictField(field_name))
+      self._RemoveToken(doc_number, token)
+      self._RemoveToken(doc_number, token.RestrictField(field_name))
 
-  def _AddToken(self, doc_id, token):
+  def _GetPostings(self, chars):
+    """Returns the CompactPostingList for chars, loading it if persisted."""
+    postings = self._inverted_index.get(chars)
+    if postings is None:
+      encoded = self._persisted_postings.pop(chars, None)
+      if encoded is not None:
+        postings = CompactPostingList.Concatenate(
+            [CompactPostingList.Decode(e) for e in encoded],
+            self._persisted_removed)
+        self._inverted_index[chars] = postings
+    return postings
+
+  def _AddToken(self, doc_number, token):
     """Adds a token occurrence for a document."""
-    postings = self._inverted_index.get(token)
+    chars = token.chars
+    postings = self._GetPostings(chars)
     if postings is None:
-      self._inverted_index[token] = postings = PostingList()
-    postings.Add(doc_id, token.position)
+      self._inverted_index[chars] = postings = CompactPostingList()
+    postings.AddPosition(doc_number, token.position)
+    if self._track_changes:
+      self._changed_tokens.add(chars)
+
+  def _RemoveToken(self, doc_number, token):
+    """Removes a token's occurrences for a document."""
+    postings = self._GetPostings(token.chars)
+    if postings is not None:
+      postings.RemoveDocument(doc_number)
 
-  def _RemoveToken(self, doc_id, token):
-    """Removes a token occurrence for a document."""
-    if token in self._inverted_index:
-      postings = self._inverted_index[token]
-      postings.Remove(doc_id, token.position)
-      if not postings.postings:
-        del self._inverted_index[token]
+  def LoadSegment(self, segment):
+    """Adds the documents and postings of a persisted segment.
+
+    Segments must be loaded in the order they were written, before the index
+    is otherwise used. Postings are only decoded when their token is first
+    looked up. A segment may re-add a document whose removal was in a
+    segment which could not be read; its old doc number is dropped then.
+
+    Args:
+      segment: a dict as returned by TakeSegment() or _MergeSegments().
+
+    Returns:
+      The ids of the documents the segment removed.
+    """
+    removed_doc_ids = []
+    for doc_number in segment['removed']:
+      doc_id = self._doc_ids.pop(doc_number, None)
+      if doc_id is not None and self._doc_numbers.get(doc_id) == doc_number:
+        del self._doc_numbers[doc_id]
+        removed_doc_ids.append(doc_id)
+      self._persisted_removed.add(doc_number)
+    for doc_id, doc_number in segment['doc_numbers']:
+      old_doc_number = self._doc_numbers.get(doc_id)
+      if old_doc_number is not None:
+        del self._doc_ids[old_doc_number]
+        self._persisted_removed.add(old_doc_number)
+      self._doc_numbers[doc_id] = doc_number
+      self._doc_ids[doc_number] = doc_id
+    for chars, encoded in segment['postings'].iteritems():
+      self._persisted_postings.setdefault(chars, []).append(encoded)
+    self._next_doc_number = max(self._next_doc_number,
+                                segment['next_doc_number'])
+    return removed_doc_ids
+
+  def TakeSegment(self):
+    """Returns the changes since the last segment as a segment dict.
+
+    Returns:
+      A dict with the (doc id, doc number) pairs of added documents, the
+      removed doc numbers, the encoded postings of the added documents by
+      token and the next doc number.
+    """
+    added = sorted(self._added_doc_numbers)
+    postings = {}
+    for chars in self._changed_tokens:
+      posting_list = self._inverted_index.get(chars)
+      if posting_list is not None:
+        selected = posting_list.Select(added)
+        if selected:
+          postings[chars] = selected.Encode()
+    segment = {
+        'doc_numbers': [(self._doc_ids[n], n) for n in added],
+        'removed': sorted(self._removed_doc_numbers),
+        'postings': postings,
+        'next_doc_number': self._next_doc_number,
+        }
+    self._added_doc_numbers = set()
+    self._removed_doc_numbers = set()
+    self._changed_tokens = set()
+    return segment
+
+  def GetCompactPostingsForToken(self, token):
+    """Returns the CompactPostingList for the token, or None."""
+    chars = token.chars
+    postings = self._GetPostings(chars)
+    if postings is not None and not postings:
+      del self._inverted_index[chars]
+      return None
+    return postings
+
+  def GetDocId(self, doc_number):
+    """Returns the id of the document with the given doc number."""
+    return self._doc_ids[doc_number]
 
   def GetPostingsForToken(self, token):
     """Returns all document postings which for the token."""
-    if token in self._inverted_index:
-      return self._inverted_index[token].postings
-    return []
+    postings = self.GetCompactPostingsForToken(token)
+    if postings is None:
+      return []
+    result = []
+    for doc_number in postings.DocNumbers():
+      posting = Posting(doc_id=self._doc_ids[doc_number])
+      for position in postings.Positions(doc_number):
+        posting.AddPosition(position)
+      result.append(posting)
+    return result
 
   def __repr__(self):
     return _Repr(self, [('_inverted_index', self._inverted_index)])
 
 
+class _DocumentMap(object):
+  """Maps doc ids to documents, decoding persisted documents on first use."""
+
+  def __init__(self):
+    self._documents = {}
+    self._encoded = {}
+
+  def SetEncoded(self, doc_id, encoded):
+    """Stores a serialized document_pb.Document for doc_id."""
+    self._documents.pop(doc_id, None)
+    self._encoded[doc_id] = encoded
+
+  def Encoded(self, doc_id):
+    """Returns the serialized document for doc_id."""
+    encoded = self._encoded.get(doc_id)
+    if encoded is None:
+      encoded = self._documents[doc_id].Encode()
+    return encoded
+
+  def keys(self):
+    return self._documents.keys() + self._encoded.keys()
+
+  def values(self):
+    return [self[doc_id] for doc_id in self.keys()]
+
+  def __contains__(self, doc_id):
+    return doc_id in self._documents or doc_id in self._encoded
+
+  def __getitem__(self, doc_id):
+    document = self._documents.get(doc_id)
+    if document is None:
+      document = document_pb.Document(self._encoded.pop(doc_id))
+      self._documents[doc_id] = document
+    return document
+
+  def __setitem__(self, doc_id, document):
+    self._encoded.pop(doc_id, None)
+    self._documents[doc_id] = document
+
+  def __delitem__(self, doc_id):
+    if self._documents.pop(doc_id, None) is None:
+      del self._encoded[doc_id]
+
+  def __len__(self):
+    return len(self._documents) + len(self._encoded)
+
+  def __repr__(self):
+    return repr(dict((doc_id, self[doc_id]) for doc_id in self.keys()))
+
+
 class SimpleIndex(object):
-  """A simple search service which uses a RAM-resident inverted file."""
+  """A simple search service which uses a RAM-resident inverted file.
 
-  def __init__(self, index_spec):
+  Queries are evaluated to sorted lists of doc numbers. Conjunctions start
+  from the shortest operand and gallop through the others, and phrases are
+  matched by intersecting the positions of consecutive tokens.
+  """
+
+  def __init__(self, index_spec, track_changes=False):
+    """Constructor.
+
+    Args:
+      index_spec: the search_service_pb.IndexSpec of the index.
+      track_changes: whether to record the changes for TakeSegment().
+    """
     self._index_spec = index_spec
-    self._documents = {}
+    self._documents = _DocumentMap()
     self._parser = SimpleTokenizer(split_restricts=False)
-    self._inverted_index = RamInvertedIndex(SimpleTokenizer())
+    self._inverted_index = RamInvertedIndex(SimpleTokenizer(), track_changes)
 
   @property
   def IndexSpec(self):
@@ -382,42 +944,82 @@ class SimpleIndex(object):
     """Returns the documents in the index."""
     return self._documents.values()
 
-  def _DocumentsForPostings(self, postings):
-    """Returns the documents for the given postings."""
-    docs = []
-    for posting in postings:
-      if posting.doc_id in self._documents:
-        docs.append(self._documents[posting.doc_id])
-    return docs
+  def LoadSegment(self, segment):
+    """Adds the documents and postings of a persisted segment.
+
+    Documents are only decoded when they are first used.
+
+    Args:
+      segment: a dict as returned by TakeSegment() or _MergeSegments().
+    """
+    for doc_id in self._inverted_index.LoadSegment(segment):
+      if doc_id in self._documents:
+        del self._documents[doc_id]
+    for doc_id, encoded in segment['documents']:
+      self._documents.SetEncoded(doc_id, encoded)
+
+  def _AddDocuments(self, segment):
+    """Adds the serialized documents of a segment's doc ids to it."""
+    segment['documents'] = [(doc_id, self._documents.Encoded(doc_id))
+                            for doc_id, _ in segment['doc_numbers']]
+    return segment
+
+  def TakeSegment(self):
+    """Returns the changes since the last segment as a segment dict."""
+    return self._AddDocuments(self._inverted_index.TakeSegment())
+
+  def _DocumentsForDocNumbers(self, doc_numbers):
+    """Returns the documents for the given doc numbers, ordered by doc id."""
+    doc_ids = sorted(self._inverted_index.GetDocId(doc_number)
+                     for doc_number in doc_numbers)
+    return [self._documents[doc_id] for doc_id in doc_ids
+            if doc_id in self._documents]
 
   def _FilterSpecialTokens(self, tokens):
     """Returns a filted set of tokens not including special characters."""
     return [token for token in tokens if not isinstance(token, Quote)]
 
-  def _PhraseOccurs(self, doc_id, phrase, position_posting, next_position=None):
-    """Checks phrase occurs for doc_id looking at next_position in phrase."""
-    if not phrase:
-      return True
-    token = phrase[0]
-    for posting in position_posting[token.position]:
-      if posting.doc_id == doc_id:
-        for position in posting.positions:
-          if next_position == None or position == next_position:
-            if self._PhraseOccurs(doc_id, phrase[1:], position_posting,
-                                  position + 1):
-              return True
-          if position > next_position:
-            return False
-    return False
-
-  def _RestrictPhrase(self, phrase, postings, position_posting):
-    """Restricts postings to those where phrase occurs."""
-    return [posting for posting in postings if
-            self._PhraseOccurs(posting.doc_id, phrase, position_posting)]
+  def _DocNumbers(self, result):
+    """Returns an evaluation result as a sorted list of doc numbers."""
+    if isinstance(result, CompactPostingList):
+      return result.DocNumbers()
+    return result
+
+  def _Intersect(self, doc_numbers, result):
+    """Intersects a sorted list of doc numbers with an evaluation result."""
+    if isinstance(result, CompactPostingList):
+      return result.Intersect(doc_numbers)
+    if len(doc_numbers) > len(result):
+      return _GallopIntersect(result, doc_numbers)
+    return _GallopIntersect(doc_numbers, result)
+
+  def _IntersectAll(self, results):
+    """Intersects evaluation results, starting from the shortest one."""
+    results = sorted(results, key=len)
+    doc_numbers = self._DocNumbers(results[0])
+    for result in results[1:]:
+      if not doc_numbers:
+        break
+      doc_numbers = self._Intersect(doc_numbers, result)
+    return doc_numbers
+
+  def _PhraseOccurs(self, doc_number, phrase_postings):
+    """Checks whether the phrase tokens occur consecutively in a document."""
+    starts = set(phrase_postings[0].Positions(doc_number))
+    for offset, postings in enumerate(phrase_postings[1:]):
+      starts.intersection_update(
+          position - offset - 1
+          for position in postings.Positions(doc_number))
+      if not starts:
+        return False
+    return True
 
   def _PostingsForToken(self, token):
     """Returns the postings for the token."""
-    return self._inverted_index.GetPostingsForToken(token)
+    postings = self._inverted_index.GetCompactPostingsForToken(token)
+    if postings is None:
+      return []
+    return postings
 
   def _SplitPhrase(self, phrase):
     """Returns the list of tokens for the phrase."""
@@ -439,22 +1041,17 @@ class SimpleIndex(object):
     return node.getText().encode('utf-8')
 
   def _EvaluatePhrase(self, node, field=None):
-    """Evaluates the phrase node returning matching postings."""
+    """Evaluates the phrase node returning matching doc numbers."""
     tokens = self._SplitPhrase(self._GetQueryNodeText(node))
     tokens = self._AddFieldToTokens(field, tokens)
-    position_posting = {}
-    token = tokens[0]
-    postings = self._PostingsForToken(token)
-    position_posting[token.position] = postings
-    if len(tokens) > 1:
-      for token in tokens[1:]:
-        next_postings = self._PostingsForToken(token)
-        position_posting[token.position] = next_postings
-        postings = [posting for posting in postings if posting in
-                    next_postings]
-        if not postings:
-          break
-    return self._RestrictPhrase(tokens, postings, position_posting)
+    phrase_postings = [self._PostingsForToken(token) for token in tokens]
+    if not all(phrase_postings):
+      return []
+    doc_numbers = self._IntersectAll(phrase_postings)
+    if len(phrase_postings) == 1:
+      return doc_numbers
+    return [doc_number for doc_number in doc_numbers
+            if self._PhraseOccurs(doc_number, phrase_postings)]
 
   def _PostingsForFieldToken(self, field, value):
     """Returns postings for the value occurring in the given field."""
@@ -463,20 +1060,19 @@ class SimpleIndex(object):
     return self._PostingsForToken(token)
 
   def _Evaluate(self, node):
-    """Translates the node in a parse tree into a query string fragment."""
+    """Evaluates the node in a parse tree.
+
+    Returns:
+      Either a CompactPostingList or a sorted list of doc numbers.
+    """
     if node.getType() is QueryParser.CONJUNCTION:
-      postings = self._Evaluate(node.children[0])
-      for child in node.children[1:]:
-        next_postings = self._Evaluate(child)
-        postings = [posting for posting in postings if posting in next_postings]
-        if not postings:
-          break
-      return postings
+      return self._IntersectAll([self._Evaluate(child)
+                                 for child in node.children])
     if node.getType() is QueryParser.DISJUNCTION:
-      postings = []
+      doc_numbers = set()
       for child in node.children:
-        postings.extend(self._Evaluate(child))
-      return postings
+        doc_numbers.update(self._DocNumbers(self._Evaluate(child)))
+      return sorted(doc_numbers)
     if node.getType() is QueryParser.RESTRICTION:
 
       field_name = node.children[0].getText()
@@ -507,8 +1103,8 @@ class SimpleIndex(object):
     if not isinstance(query, unicode):
       query = unicode(query, 'utf-8')
     query_tree = query_parser.Simplify(query_parser.Parse(query))
-    postings = self._Evaluate(query_tree)
-    return self._DocumentsForPostings(postings)
+    doc_numbers = self._DocNumbers(self._Evaluate(query_tree))
+    return self._DocumentsForDocNumbers(doc_numbers)
 
   def __repr__(self):
     return _Repr(self, [('_index_spec', self._index_spec),
@@ -516,6 +1112,58 @@ class SimpleIndex(object):
                         ('_inverted_index', self._inverted_index)])
 
 
+def _SegmentSize(segment):
+  """Returns the number of documents a segment adds or removes, at least 1."""
+  return max(1, len(segment['doc_numbers']) + len(segment['removed']))
+
+
+def _MergeSegments(segments):
+  """Merges consecutive segments of an index into one.
+
+  Documents added and removed within the merged segments are dropped
+  altogether, so merging every segment of an index leaves no removals.
+
+  Args:
+    segments: the segment dicts, in the order they were written.
+
+  Returns:
+    A segment dict equivalent to loading the segments in order.
+  """
+  removed = set()
+  for segment in segments:
+    removed.update(segment['removed'])
+  added = set()
+  doc_numbers = []
+  documents = []
+  postings = {}
+  for segment in segments:
+    for item, document in zip(segment['doc_numbers'], segment['documents']):
+      added.add(item[1])
+      if item[1] not in removed:
+        doc_numbers.append(item)
+        documents.append(document)
+    for chars, encoded in segment['postings'].iteritems():
+      postings.setdefault(chars, []).append(encoded)
+  for chars, encoded in postings.items():
+    if len(encoded) == 1 and not removed:
+      postings[chars] = encoded[0]
+      continue
+    posting_list = CompactPostingList.Concatenate(
+        [CompactPostingList.Decode(e) for e in encoded], removed)
+    if posting_list:
+      postings[chars] = posting_list.Encode()
+    else:
+      del postings[chars]
+  return {
+      'doc_numbers': doc_numbers,
+      'removed': sorted(removed - added),
+      'postings': postings,
+      'documents': documents,
+      'next_doc_number': max(segment['next_doc_number']
+                             for segment in segments),
+      }
+
+
 class SearchServiceStub(apiproxy_stub.APIProxyStub):
   """Simple RAM backed Search service stub.
 
@@ -524,14 +1172,165 @@ class SearchServiceStub(apiproxy_stub.APIProxyStub):
   the methods prefixed by "_Dynamic_".
   """
 
-  def __init__(self, service_name='search'):
+  def __init__(self, service_name='search', index_path=None):
     """Constructor.
 
     Args:
       service_name: Service name expected for all calls.
+      index_path: Directory to persist the indexes in, or None to keep them
+        only in memory.
     """
     self.__indexes = {}
+    self.__index_path = index_path
+    self.__segments = {}
+    self.__unloaded_index_specs = {}
     super(SearchServiceStub, self).__init__(service_name)
+    self.Read()
+
+  def Read(self):
+    """Reads the manifest of persisted indexes, if there is one.
+
+    The indexes themselves are loaded when they are first used.
+    """
+    if not self.__index_path:
+      return
+    manifest_path = os.path.join(self.__index_path, MANIFEST_FILENAME)
+    try:
+      manifest_file = open(manifest_path, 'rb')
+    except IOError:
+      return
+    try:
+      try:
+        manifest = pickle.load(manifest_file)
+      except (pickle.UnpicklingError, EOFError, AttributeError, ValueError,
+              ImportError, IndexError, TypeError), e:
+        logging.warning('Could not read search index manifest %s: %s',
+                        manifest_path, e)
+        return
+    finally:
+      manifest_file.close()
+    if manifest.get('version') != _MANIFEST_VERSION:
+      logging.warning('Ignoring search index manifest %s with version %r',
+                      manifest_path, manifest.get('version'))
+      return
+    for name, (encoded_spec, segments) in manifest['indexes'].iteritems():
+      self.__unloaded_index_specs[name] = search_service_pb.IndexSpec(
+          encoded_spec)
+      self.__segments[name] = list(segments)
+
+  def __ReadSegment(self, filename):
+    """Reads a segment file, returning None if it cannot be read."""
+    path = os.path.join(self.__index_path, filename)
+    try:
+      segment_file = open(path, 'rb')
+      try:
+        return pickle.load(segment_file)
+      finally:
+        segment_file.close()
+    except (IOError, pickle.UnpicklingError, EOFError, AttributeError,
+            ValueError, ImportError, IndexError, TypeError), e:
+      logging.warning('Could not read search index segment %s: %s', path, e)
+      return None
+
+  def __LoadIndex(self, name):
+    """Loads a persisted index from its segment files."""
+    index = SimpleIndex(self.__unloaded_index_specs.pop(name),
+                        track_changes=True)
+    for filename, _ in self.__segments[name]:
+      segment = self.__ReadSegment(filename)
+      if segment is not None:
+        index.LoadSegment(segment)
+    self.__indexes[name] = index
+    return index
+
+  def __LoadAllIndexes(self):
+    """Loads every persisted index which has not been loaded yet."""
+    for name in self.__unloaded_index_specs.keys():
+      self.__LoadIndex(name)
+
+  def __WriteFile(self, filename, contents):
+    """Atomically writes a pickled object to a file in the index directory."""
+    path = os.path.join(self.__index_path, filename)
+    descriptor, tmp_filename = tempfile.mkstemp(dir=self.__index_path)
+    tmpfile = os.fdopen(descriptor, 'wb')
+    try:
+      pickle.dump(contents, tmpfile, protocol=2)
+    finally:
+      tmpfile.close()
+    try:
+
+      os.rename(tmp_filename, path)
+    except OSError:
+
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      os.rename(tmp_filename, path)
+
+  def __WriteManifest(self):
+    """Writes the list of each persisted index's segments."""
+    indexes = {}
+    for name, segments in self.__segments.iteritems():
+      index = self.__indexes.get(name)
+      if index is not None:
+        index_spec = index.IndexSpec
+      else:
+        index_spec = self.__unloaded_index_specs[name]
+      indexes[name] = (index_spec.Encode(), segments)
+    self.__WriteFile(MANIFEST_FILENAME,
+                     {'version': _MANIFEST_VERSION, 'indexes': indexes})
+
+  def _WriteSegment(self, index):
+    """Persists the changes made to an index since its last segment.
+
+    The new segment is merged with the newest segments while they are less
+    than _SEGMENT_MERGE_FACTOR times its size, so segment sizes grow
+    geometrically: an index has a logarithmic number of segments and each
+    document is rewritten a logarithmic number of times.
+
+    Args:
+      index: the SimpleIndex which was changed.
+    """
+    if not self.__index_path:
+      return
+    if not os.path.isdir(self.__index_path):
+      os.makedirs(self.__index_path)
+
+    name = index.IndexSpec.name()
+    is_new_index = name not in self.__segments
+    segments = self.__segments.setdefault(name, [])
+    segment = index.TakeSegment()
+    if not (segment['doc_numbers'] or segment['removed']):
+      if is_new_index:
+        self.__WriteManifest()
+      return
+    merged = [segment]
+    size = _SegmentSize(segment)
+    start = len(segments)
+    while start and segments[start - 1][1] < _SEGMENT_MERGE_FACTOR * size:
+      older = self.__ReadSegment(segments[start - 1][0])
+      if older is None:
+        break
+      start -= 1
+      merged.insert(0, older)
+      size += segments[start][1]
+    if len(merged) > 1:
+      segment = _MergeSegments(merged)
+    descriptor, path = tempfile.mkstemp(suffix=SEGMENT_SUFFIX,
+                                        dir=self.__index_path)
+    os.close(descriptor)
+    filename = os.path.basename(path)
+    self.__WriteFile(filename, segment)
+    obsolete = [old_filename for old_filename, _ in segments[start:]]
+    segments[start:] = [(filename, _SegmentSize(segment))]
+    self.__WriteManifest()
+
+    for filename in obsolete:
+      try:
+        os.remove(os.path.join(self.__index_path, filename))
+      except OSError, e:
+        logging.warning('Removing search index segment failed: %s', e)
 
   def _InvalidRequest(self, status, exception):
     status.set_code(search_service_pb.SearchServiceError.INVALID_REQUEST)
@@ -543,9 +1342,12 @@ class SearchServiceStub(apiproxy_stub.APIProxyStub):
 
   def _GetIndex(self, index_spec, create=False):
     index = self.__indexes.get(index_spec.name())
+    if index is None and index_spec.name() in self.__unloaded_index_specs:
+      index = self.__LoadIndex(index_spec.name())
     if index is None:
       if create:
-        index = SimpleIndex(index_spec)
+        index = SimpleIndex(index_spec,
+                            track_changes=bool(self.__index_path))
         self.__indexes[index_spec.name()] = index
       else:
         return None
@@ -567,8 +1369,13 @@ class SearchServiceStub(apiproxy_stub.APIProxyStub):
     try:
       index = self._GetIndex(params.index_spec(), create=True)
       index.IndexDocuments(params.document_list(), response)
+      self._WriteSegment(index)
     except IndexConsistencyError, exception:
       self._InvalidRequest(response.add_status(), exception)
+    except (IOError, OSError), e:
+      raise apiproxy_errors.ApplicationError(
+          search_service_pb.SearchServiceError.INTERNAL_ERROR,
+          'Could not persist search index: %s' % e)
 
   def _Dynamic_DeleteDocument(self, request, response):
     """A local implementation of SearchService.DeleteDocument RPC.
@@ -585,8 +1392,13 @@ class SearchServiceStub(apiproxy_stub.APIProxyStub):
         self._UnknownIndex(response.add_status(), index_spec)
         return
       index.DeleteDocuments(params.doc_id_list(), response)
+      self._WriteSegment(index)
     except IndexConsistencyError, exception:
       self._InvalidRequest(response.add_status(), exception)
+    except (IOError, OSError), e:
+      raise apiproxy_errors.ApplicationError(
+          search_service_pb.SearchServiceError.INTERNAL_ERROR,
+          'Could not persist search index: %s' % e)
 
   def _Dynamic_ListIndexes(self, request, response):
     """A local implementation of SearchService.ListIndexes RPC.
@@ -620,6 +1432,7 @@ class SearchServiceStub(apiproxy_stub.APIProxyStub):
 
     response.mutable_status().set_code(
         search_service_pb.SearchServiceError.OK)
+    self.__LoadAllIndexes()
     if not len(self.__indexes):
       return
     keys, indexes = zip(*sorted(self.__indexes.iteritems(), key=lambda v: v[0]))
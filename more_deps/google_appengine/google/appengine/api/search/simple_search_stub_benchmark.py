@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+
+"""Benchmark of SearchServiceStub._Dynamic_Search over a synthetic corpus.
+
+Indexes documents whose words are drawn from a Zipf-like vocabulary, then
+times single-term, conjunctive, disjunctive, field-restricted and phrase
+queries through the stub's Search RPC.
+
+Usage:
+  python simple_search_stub_benchmark.py [--documents=N] [--queries=N]
+      [--vocabulary=N] [--words=N] [--seed=N]
+"""
+
+
+
+import getopt
+import random
+import sys
+import time
+
+from google.appengine.api.search import search_service_pb
+from google.appengine.api.search import simple_search_stub
+from google.appengine.datastore import document_pb
+
+
+_INDEX_NAME = 'benchmark'
+
+_BATCH_SIZE = 500
+
+
+def MakeVocabulary(size, rng):
+  """Returns a list of words with Zipf-like weights.
+
+  Args:
+    size: the number of distinct words.
+    rng: a random.Random.
+
+  Returns:
+    A list of words in which earlier words are more frequent.
+  """
+  words = ['w%d' % i for i in xrange(size)]
+  weighted = []
+  for rank, word in enumerate(words):
+    weighted.extend([word] * max(1, size // (rank + 1)))
+  rng.shuffle(weighted)
+  return words, weighted
+
+
+def MakeDocument(doc_id, weighted_words, num_words, rng):
+  """Builds a document with a title and a body field.
+
+  Args:
+    doc_id: the document id.
+    weighted_words: the list to draw words from.
+    num_words: the number of words in the body.
+    rng: a random.Random.
+
+  Returns:
+    A document_pb.Document.
+  """
+  document = document_pb.Document()
+  document.set_id(doc_id)
+  for name, length in (('title', 5), ('body', num_words)):
+    field = document.add_field()
+    field.set_name(name)
+    value = field.mutable_value()
+    value.set_type(document_pb.FieldValue.TEXT)
+    value.set_string_value(
+        ' '.join(rng.choice(weighted_words) for _ in xrange(length)))
+  return document
+
+
+def IndexDocuments(stub, documents):
+  """Indexes documents through the IndexDocument RPC in batches."""
+  for start in xrange(0, len(documents), _BATCH_SIZE):
+    request = search_service_pb.IndexDocumentRequest()
+    params = request.mutable_params()
+    params.mutable_index_spec().set_name(_INDEX_NAME)
+    for document in documents[start:start + _BATCH_SIZE]:
+      params.add_document().CopyFrom(document)
+    stub._Dynamic_IndexDocument(request,
+                                search_service_pb.IndexDocumentResponse())
+
+
+def TimeSearch(stub, query, limit=20):
+  """Runs one query through the Search RPC.
+
+  Returns:
+    A tuple (seconds, matched count).
+  """
+  request = search_service_pb.SearchRequest()
+  params = request.mutable_params()
+  params.mutable_index_spec().set_name(_INDEX_NAME)
+  params.set_query(query)
+  params.set_limit(limit)
+  response = search_service_pb.SearchResponse()
+  start = time.time()
+  stub._Dynamic_Search(request, response)
+  return time.time() - start, response.matched_count()
+
+
+def MakeQueries(words, rng):
+  """Returns (label, query factory) pairs for each kind of query."""
+  common = words[:max(1, len(words) // 100)]
+  return [
+      ('term', lambda: rng.choice(words)),
+      ('common term', lambda: rng.choice(common)),
+      ('and', lambda: '%s %s' % (rng.choice(common), rng.choice(words))),
+      ('or', lambda: '%s OR %s' % (rng.choice(words), rng.choice(words))),
+      ('field', lambda: 'title:%s' % rng.choice(words)),
+      ('phrase', lambda: '"%s %s"' % (rng.choice(common), rng.choice(common))),
+      ]
+
+
+def main(argv):
+  num_documents = 20000
+  num_queries = 50
+  vocabulary_size = 5000
+  num_words = 50
+  seed = 0
+  opts, _ = getopt.getopt(argv[1:], '', ['documents=', 'queries=',
+                                         'vocabulary=', 'words=', 'seed='])
+  for option, value in opts:
+    if option == '--documents':
+      num_documents = int(value)
+    elif option == '--queries':
+      num_queries = int(value)
+    elif option == '--vocabulary':
+      vocabulary_size = int(value)
+    elif option == '--words':
+      num_words = int(value)
+    elif option == '--seed':
+      seed = int(value)
+
+  rng = random.Random(seed)
+  words, weighted_words = MakeVocabulary(vocabulary_size, rng)
+  documents = [MakeDocument('doc%09d' % i, weighted_words, num_words, rng)
+               for i in xrange(num_documents)]
+
+  stub = simple_search_stub.SearchServiceStub()
+  start = time.time()
+  IndexDocuments(stub, documents)
+  print 'indexed %d documents in %.2f s' % (num_documents, time.time() - start)
+
+  for label, make_query in MakeQueries(words, rng):
+    total_seconds = 0.0
+    total_matched = 0
+    for _ in xrange(num_queries):
+      seconds, matched = TimeSearch(stub, make_query())
+      total_seconds += seconds
+      total_matched += matched
+    print '%-12s %9.2f ms/query  %9.1f matches/query' % (
+        label, total_seconds / num_queries * 1e3,
+        float(total_matched) / num_queries)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+
+"""Tests for google.appengine.api.search.simple_search_stub."""
+
+
+
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import unittest
+
+from google.appengine.api.search import search_service_pb
+from google.appengine.api.search import simple_search_stub
+from google.appengine.datastore import document_pb
+from google.appengine.runtime import apiproxy_errors
+
+
+_INDEX_NAME = 'test'
+
+
+def MakeDocument(doc_id, **fields):
+  """Builds a document with the given text fields, in name order."""
+  document = document_pb.Document()
+  document.set_id(doc_id)
+  for name in sorted(fields):
+    field = document.add_field()
+    field.set_name(name)
+    value = field.mutable_value()
+    value.set_type(document_pb.FieldValue.TEXT)
+    value.set_string_value(fields[name])
+  return document
+
+
+class SimpleSearchStubTest(unittest.TestCase):
+
+  def setUp(self):
+    self.stub = simple_search_stub.SearchServiceStub()
+
+  def DeleteDocuments(self, *doc_ids):
+    request = search_service_pb.DeleteDocumentRequest()
+    params = request.mutable_params()
+    params.mutable_index_spec().set_name(_INDEX_NAME)
+    for doc_id in doc_ids:
+      params.add_doc_id(doc_id)
+    self.stub._Dynamic_DeleteDocument(
+        request, search_service_pb.DeleteDocumentResponse())
+
+  def IndexDocuments(self, *documents):
+    request = search_service_pb.IndexDocumentRequest()
+    params = request.mutable_params()
+    params.mutable_index_spec().set_name(_INDEX_NAME)
+    for document in documents:
+      params.add_document().CopyFrom(document)
+    self.stub._Dynamic_IndexDocument(
+        request, search_service_pb.IndexDocumentResponse())
+
+  def Search(self, query):
+    request = search_service_pb.SearchRequest()
+    params = request.mutable_params()
+    params.mutable_index_spec().set_name(_INDEX_NAME)
+    params.set_query(query)
+    params.set_limit(20)
+    response = search_service_pb.SearchResponse()
+    self.stub._Dynamic_Search(request, response)
+    return sorted(result.document().id() for result in response.result_list())
+
+  def testPhrase(self):
+    self.IndexDocuments(MakeDocument('a', body='w1 w2 w3 w4'),
+                        MakeDocument('b', body='w2 w1 w4 w3'))
+    self.assertEqual(['a'], self.Search('"w2 w3"'))
+    self.assertEqual(['a', 'b'], self.Search('"w3"'))
+    self.assertEqual(['b'], self.Search('"w1 w4 w3"'))
+    self.assertEqual([], self.Search('"w1 w3"'))
+
+  def testPhraseDoesNotSpanFields(self):
+    self.IndexDocuments(MakeDocument('a', body='w8 w8 w1 w2', title='w4 w5'),
+                        MakeDocument('b', body='w4 w5 w1 w2', title='w9'),
+                        MakeDocument('c', body='w1 w2', title='w4 w5'))
+    self.assertEqual(['b'], self.Search('"w5 w1"'))
+    self.assertEqual(['b'], self.Search('"w4 w5 w1"'))
+    self.assertEqual([], self.Search('"w2 w4"'))
+    self.assertEqual(['a', 'b', 'c'], self.Search('"w4 w5"'))
+    self.assertEqual(['a', 'b', 'c'], self.Search('"w1 w2"'))
+
+  def testChangesAreNotKept(self):
+    self.IndexDocuments(MakeDocument('a', body='w1 w2'),
+                        MakeDocument('b', body='w3'))
+    self.DeleteDocuments('a')
+    index_spec = search_service_pb.IndexSpec()
+    index_spec.set_name(_INDEX_NAME)
+    inverted_index = self.stub._GetIndex(index_spec)._inverted_index
+    self.assertEqual(set(), inverted_index._added_doc_numbers)
+    self.assertEqual(set(), inverted_index._removed_doc_numbers)
+    self.assertEqual(set(), inverted_index._changed_tokens)
+
+
+class PersistentSimpleSearchStubTest(SimpleSearchStubTest):
+
+  def setUp(self):
+    self.index_path = tempfile.mkdtemp()
+    self.stub = simple_search_stub.SearchServiceStub(index_path=self.index_path)
+
+  def tearDown(self):
+    shutil.rmtree(self.index_path)
+
+  def Reload(self):
+    self.stub = simple_search_stub.SearchServiceStub(index_path=self.index_path)
+
+  def SegmentFiles(self):
+    return [filename for filename in os.listdir(self.index_path)
+            if filename.endswith(simple_search_stub.SEGMENT_SUFFIX)]
+
+  def testReload(self):
+    for i in range(15):
+      self.IndexDocuments(MakeDocument('d%d' % i, body='w%d' % (i % 3)))
+    self.DeleteDocuments('d0', 'd1', 'd14')
+    self.IndexDocuments(MakeDocument('d3', body='w1'))
+    self.Reload()
+    self.assertEqual(['d12', 'd6', 'd9'], self.Search('w0'))
+    self.assertEqual(['d10', 'd13', 'd3', 'd4', 'd7'], self.Search('w1'))
+    self.assertEqual(['d11', 'd2', 'd5', 'd8'], self.Search('w2'))
+
+  def testSegmentsAreMerged(self):
+    for i in range(100):
+      self.IndexDocuments(MakeDocument('d%d' % i, body='w%d' % i))
+      self.assertTrue(len(self.SegmentFiles()) <= 8)
+    for i in range(0, 100, 2):
+      self.DeleteDocuments('d%d' % i)
+    self.Reload()
+    self.assertEqual(['d1'], self.Search('w1'))
+    self.assertEqual([], self.Search('w2'))
+    self.assertEqual(['d99'], self.Search('w99'))
+
+  def testUnreadableSegment(self):
+    self.IndexDocuments(*[MakeDocument('d%d' % i, body='old')
+                          for i in range(20)])
+    self.IndexDocuments(MakeDocument('d0', body='lost'),
+                        *[MakeDocument('e%d' % i, body='lost')
+                          for i in range(5)])
+    self.IndexDocuments(MakeDocument('d0', body='new'))
+    manifest_file = open(os.path.join(
+        self.index_path, simple_search_stub.MANIFEST_FILENAME), 'rb')
+    try:
+      segments = pickle.load(manifest_file)['indexes'][_INDEX_NAME][1]
+    finally:
+      manifest_file.close()
+    self.assertEqual(3, len(segments))
+    open(os.path.join(self.index_path, segments[1][0]), 'wb').write('corrupt')
+    self.Reload()
+    self.assertEqual(sorted('d%d' % i for i in range(1, 20)),
+                     self.Search('old'))
+    self.assertEqual(['d0'], self.Search('new'))
+    self.assertEqual([], self.Search('lost'))
+    self.DeleteDocuments('d0')
+    self.Reload()
+    self.assertEqual([], self.Search('new'))
+
+  def testWriteError(self):
+    shutil.rmtree(self.index_path)
+    open(self.index_path, 'w').close()
+    try:
+      self.assertRaises(apiproxy_errors.ApplicationError, self.IndexDocuments,
+                        MakeDocument('a', body='w1'))
+    finally:
+      os.remove(self.index_path)
+      os.mkdir(self.index_path)
+
+
+if __name__ == '__main__':
+  unittest.main()
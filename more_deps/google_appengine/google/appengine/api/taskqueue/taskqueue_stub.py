@@ -43,10 +43,10 @@ from __future__ import with_statement
 __all__ = []
 
 import base64
-import bisect
 import calendar
 import cgi
 import datetime
+import heapq
 import httplib
 import logging
 import os
@@ -932,11 +932,127 @@ class Retry(object):
     return int(min(max_backoff_usec, backoff_usec))
 
 
+class _SkipList(object):
+  """A sorted set of keys with O(log n) insertion, removal and search.
+
+  Every key is on the bottom level of the list, and each level above holds
+  about a quarter of the keys of the level below it. A node is a list of its
+  key followed by its successor on each of its levels.
+  """
+
+  _MAX_LEVEL = 16
+
+  _LEVEL_PROBABILITY = 0.25
+
+  def __init__(self):
+    self._head = [None] * (self._MAX_LEVEL + 1)
+    self._level = 1
+    self._len = 0
+    self._random = random.Random()
+
+  def __len__(self):
+    return self._len
+
+  def _FindPredecessors(self, key):
+    """Returns the last node before key on each level, bottom level first."""
+    predecessors = [self._head] * self._MAX_LEVEL
+    node = self._head
+    for level in xrange(self._level, 0, -1):
+      next_node = node[level]
+      while next_node is not None and next_node[0] < key:
+        node = next_node
+        next_node = node[level]
+      predecessors[level - 1] = node
+    return predecessors
+
+  def Add(self, key):
+    """Adds a key, which must not already be in the list."""
+    level = 1
+    while (level < self._MAX_LEVEL and
+           self._random.random() < self._LEVEL_PROBABILITY):
+      level += 1
+    if level > self._level:
+      self._level = level
+    new_node = [key] + [None] * level
+    node = self._head
+    for i in xrange(self._level, 0, -1):
+      next_node = node[i]
+      while next_node is not None and next_node[0] < key:
+        node = next_node
+        next_node = node[i]
+      if i <= level:
+        new_node[i] = next_node
+        node[i] = new_node
+    self._len += 1
+
+  def Remove(self, key):
+    """Removes a key.
+
+    Returns:
+      True if the key was found, False otherwise.
+    """
+    predecessors = self._FindPredecessors(key)
+    node = predecessors[0][1]
+    if node is None or node[0] != key:
+      return False
+    for i in xrange(1, len(node)):
+      predecessors[i - 1][i] = node[i]
+    self._len -= 1
+    return True
+
+  def First(self):
+    """Returns the smallest key, or None if the list is empty."""
+    node = self._head[1]
+    if node is None:
+      return None
+    return node[0]
+
+  def PopFirst(self):
+    """Removes and returns the smallest key, which must exist."""
+    node = self._head[1]
+    for i in xrange(1, len(node)):
+      self._head[i] = node[i]
+    self._len -= 1
+    return node[0]
+
+  def Slice(self, start, maximum):
+    """Returns up to maximum keys in order, starting from start.
+
+    Args:
+      start: the smallest key to return, or None to start from the first.
+      maximum: the maximum number of keys to return.
+    """
+    if start is None:
+      node = self._head[1]
+    else:
+      node = self._FindPredecessors(start)[0][1]
+    keys = []
+    while node is not None and len(keys) < maximum:
+      keys.append(node[0])
+      node = node[1]
+    return keys
+
+  def __iter__(self):
+    node = self._head[1]
+    while node is not None:
+      yield node[0]
+      node = node[1]
+
+
 class _Queue(object):
   """A Taskqueue Queue.
 
-  This class contains all of the properties of a queue and a sorted list of
-  tasks.
+  This class contains all of the properties of a queue and its tasks. Tasks
+  are indexed by name in a dict, their names are kept in a skip list, and they
+  are ordered by (eta, name) in a heap, so adding, leasing, postponing and
+  deleting a task is O(log n), and so is finding where a page of tasks sorted
+  by name starts. Pages sorted by (eta, name) are selected from the whole
+  heap, which is linear in the number of tasks.
+
+  Entries of the heap are [eta, name, task] lists. When a task is deleted or
+  postponed its entry is not removed from the heap but marked stale by
+  setting its task to None; stale entries are dropped when they reach the top
+  of the heap, or all at once when they make up half of the heap.
   """
   def __init__(self, queue_name, bucket_refill_per_second=DEFAULT_RATE_FLOAT,
                bucket_capacity=DEFAULT_BUCKET_SIZE,
@@ -957,9 +1073,14 @@ class _Queue(object):
 
     self.task_name_archive = set()
 
-    self._sorted_by_name = []
+    self._tasks_by_name = {}
+
+    self._sorted_by_name = _SkipList()
 
-    self._sorted_by_eta = []
+    self._eta_heap = []
+
+    self._eta_heap_entries = {}
+    self._stale_heap_entries = 0
 
 
     self._lock = threading.Lock()
@@ -1069,15 +1190,14 @@ class _Queue(object):
       response: A taskqueue_service_pb.TaskQueueFetchTaskResponse.
     """
     task_name = request.task_name()
-    pos = self._LocateTaskByName(task_name)
-    if pos is None:
+    task = self._LocateTaskByName(task_name)
+    if task is None:
       if task_name in self.task_name_archive:
         error = taskqueue_service_pb.TaskQueueServiceError.TOMBSTONED_TASK
       else:
         error = taskqueue_service_pb.TaskQueueServiceError.UNKNOWN_TASK
       raise apiproxy_errors.ApplicationError(error)
 
-    _, task = self._sorted_by_name[pos]
     response.mutable_task().add_task().CopyFrom(task)
 
   @_WithLock
@@ -1122,13 +1242,16 @@ class _Queue(object):
 
 
     now_eta_usec = _SecToUsec(time.time())
-    pos = bisect.bisect_left(self._sorted_by_eta, (now_eta_usec,))
-    max_tasks = min(max_tasks, pos)
+    leased_tasks = []
+    while len(leased_tasks) < max_tasks:
+      entry = self._PeekEtaHeapNoLock()
+      if entry is None or entry[0] >= now_eta_usec:
+        break
+      leased_tasks.append(self._PopEtaHeapNoLock())
 
-    leased_tasks = self._sorted_by_eta[:max_tasks]
-    self._sorted_by_eta = self._sorted_by_eta[max_tasks:]
     tasks_to_delete = []
-    for _, name, task in leased_tasks:
+    for task in leased_tasks:
+      name = task.task_name()
       retry = Retry(task, self)
       if not retry.CanRetry(task.retry_count() + 1, 0):
         logging.warning(
@@ -1180,8 +1303,8 @@ class _Queue(object):
       raise apiproxy_errors.ApplicationError(
           taskqueue_service_pb.TaskQueueServiceError.INVALID_REQUEST)
 
-    pos = self._LocateTaskByName(request.task_name())
-    if pos is None:
+    task = self._LocateTaskByName(request.task_name())
+    if task is None:
       if request.task_name() in self.task_name_archive:
         raise apiproxy_errors.ApplicationError(
             taskqueue_service_pb.TaskQueueServiceError.TOMBSTONED_TASK)
@@ -1190,7 +1313,6 @@ class _Queue(object):
             taskqueue_service_pb.TaskQueueServiceError.UNKNOWN_TASK)
 
 
-    _, task = self._sorted_by_name[pos]
     if task.eta_usec() != request.eta_usec():
       raise apiproxy_errors.ApplicationError(
           taskqueue_service_pb.TaskQueueServiceError.TASK_LEASE_EXPIRED)
@@ -1213,11 +1335,10 @@ class _Queue(object):
     Args:
       task_name: The name of the task to update.
     """
-    pos = self._LocateTaskByName(task_name)
-    assert pos is not None, (
+    task = self._LocateTaskByName(task_name)
+    assert task is not None, (
         'Task does not exist when trying to increase retry count.')
 
-    task = self._sorted_by_name[pos][1]
     self._IncRetryCount(task)
 
   def _IncRetryCount(self, task):
@@ -1256,7 +1377,7 @@ class _Queue(object):
     tasks = []
     now = datetime.datetime.utcnow()
 
-    for _, _, task_response in self._sorted_by_eta:
+    for task_response in self._GetTasksNoLock():
       tasks.append(QueryTasksResponseToDict(
           self.queue_name, task_response, now))
     return tasks
@@ -1285,11 +1406,8 @@ class _Queue(object):
     Raises:
       ValueError: A task request contains an unknown HTTP method type.
     """
-    task_responses = self._LookupNoAcquireLock(maximum=1, name=task_name)
-    if not task_responses:
-      return
-    task_response, = task_responses
-    if task_response.task_name() != task_name:
+    task_response = self._LocateTaskByName(task_name)
+    if task_response is None:
       return
 
     now = datetime.datetime.utcnow()
@@ -1298,8 +1416,11 @@ class _Queue(object):
   @_WithLock
   def PurgeQueue(self):
     """Removes all content from the queue."""
-    self._sorted_by_name = []
-    self._sorted_by_eta = []
+    self._tasks_by_name = {}
+    self._sorted_by_name = _SkipList()
+    self._eta_heap = []
+    self._eta_heap_entries = {}
+    self._stale_heap_entries = 0
 
   @_WithLock
   def _GetTasks(self):
@@ -1319,24 +1440,73 @@ class _Queue(object):
         sorted by eta.
     """
     assert self._lock.locked()
-    tasks = []
-    for eta, task_name, task in self._sorted_by_eta:
-      tasks.append(task)
-    return tasks
+    return [task for _, _, task in sorted(self._eta_heap) if task is not None]
 
   def _InsertTask(self, task):
-    """Insert a task into the store, keeps lists sorted.
+    """Insert a task into the store, keeps the name index and eta heap.
 
     Args:
       task: the new task.
     """
     assert self._lock.locked()
-    eta = task.eta_usec()
     name = task.task_name()
-    bisect.insort_left(self._sorted_by_eta, (eta, name, task))
-    bisect.insort_left(self._sorted_by_name, (name, task))
+    self._tasks_by_name[name] = task
+    self._sorted_by_name.Add(name)
+    self._PushEtaHeapNoLock(task)
     self.task_name_archive.add(name)
 
+  def _PushEtaHeapNoLock(self, task):
+    """Adds a task to the eta heap at its current eta.
+
+    Args:
+      task: the task, which must not already be in the heap.
+    """
+    assert self._lock.locked()
+    entry = [task.eta_usec(), task.task_name(), task]
+    self._eta_heap_entries[task.task_name()] = entry
+    heapq.heappush(self._eta_heap, entry)
+
+  def _RemoveFromEtaHeapNoLock(self, name):
+    """Marks the heap entry of a task stale, compacting the heap if needed.
+
+    Args:
+      name: the name of the task to remove from the heap.
+
+    Returns:
+      The removed task.
+    """
+    assert self._lock.locked()
+    entry = self._eta_heap_entries.pop(name)
+    task = entry[2]
+    entry[2] = None
+    self._stale_heap_entries += 1
+    if self._stale_heap_entries * 2 > len(self._eta_heap):
+      self._eta_heap = [live for live in self._eta_heap
+                        if live[2] is not None]
+      heapq.heapify(self._eta_heap)
+      self._stale_heap_entries = 0
+    return task
+
+  def _PeekEtaHeapNoLock(self):
+    """Returns the heap entry of the task with the oldest eta, or None."""
+    assert self._lock.locked()
+    while self._eta_heap and self._eta_heap[0][2] is None:
+      heapq.heappop(self._eta_heap)
+      self._stale_heap_entries -= 1
+    if self._eta_heap:
+      return self._eta_heap[0]
+    return None
+
+  def _PopEtaHeapNoLock(self):
+    """Removes the task with the oldest eta from the heap and returns it.
+
+    The task stays in the name index; it must be pushed back onto the heap.
+    """
+    self._PeekEtaHeapNoLock()
+    _, name, task = heapq.heappop(self._eta_heap)
+    del self._eta_heap_entries[name]
+    return task
+
   @_WithLock
   def PostponeTask(self, task, new_eta_usec):
     """Postpone the task to a future time and increment the retry count.
@@ -1353,20 +1523,16 @@ class _Queue(object):
 
   def _PostponeTaskNoLock(self, task, new_eta_usec):
     assert self._lock.locked()
-    pos = bisect.bisect_left(
-        self._sorted_by_eta, (task.eta_usec(), task.task_name(), None))
-    assert self._sorted_by_eta[pos][2] is task, 'The task was not found'
+    entry = self._eta_heap_entries.get(task.task_name())
+    assert entry is not None and entry[2] is task, 'The task was not found'
 
-
-
-    self._sorted_by_eta.pop(pos)
+    self._RemoveFromEtaHeapNoLock(task.task_name())
     self._PostponeTaskInsertOnly(task, new_eta_usec)
 
   def _PostponeTaskInsertOnly(self, task, new_eta_usec):
     assert self._lock.locked()
     task.set_eta_usec(new_eta_usec)
-    name = task.task_name()
-    bisect.insort_left(self._sorted_by_eta, (new_eta_usec, name, task))
+    self._PushEtaHeapNoLock(task)
 
   @_WithLock
   def Lookup(self, maximum, name=None, eta=None):
@@ -1394,56 +1560,47 @@ class _Queue(object):
   def _LookupNoAcquireLock(self, maximum, name=None, eta=None):
     assert self._lock.locked()
     if eta is None:
-
-      pos = bisect.bisect_left(self._sorted_by_name, (name,))
-
-      tasks = (x[1] for x in self._sorted_by_name[pos:pos + maximum])
-      return list(tasks)
+      return [self._tasks_by_name[task_name]
+              for task_name in self._sorted_by_name.Slice(name, maximum)]
     if name is None:
       raise ValueError('must supply name or eta')
 
-    pos = bisect.bisect_left(self._sorted_by_eta, (eta, name))
-
-    tasks = (x[2] for x in self._sorted_by_eta[pos:pos + maximum])
-    return list(tasks)
+    entries = (entry for entry in self._eta_heap
+               if entry[2] is not None and entry[:2] >= [eta, name])
+    return [task for _, _, task in heapq.nsmallest(maximum, entries)]
 
   @_WithLock
   def Count(self):
     """Returns the number of tasks in the store."""
-    return len(self._sorted_by_name)
+    return len(self._tasks_by_name)
 
   @_WithLock
   def OldestTask(self):
     """Returns the task with the oldest eta in the store."""
-    if self._sorted_by_eta:
-      return self._sorted_by_eta[0][2]
+    entry = self._PeekEtaHeapNoLock()
+    if entry is not None:
+      return entry[2]
     return None
 
   @_WithLock
   def Oldest(self):
     """Returns the oldest eta in the store, or None if no tasks."""
-    if self._sorted_by_eta:
-      return self._sorted_by_eta[0][0]
+    entry = self._PeekEtaHeapNoLock()
+    if entry is not None:
+      return entry[0]
     return None
 
   def _LocateTaskByName(self, task_name):
-    """Locate the index of a task in _sorted_by_name list.
-
-    If the task does not exist in the list, return None.
+    """Locate a task by its name.
 
     Args:
       task_name: Name of task to be located.
 
     Returns:
-      Index of the task in _sorted_by_name list if task exists,
-      None otherwise.
+      The task if it exists, None otherwise.
     """
     assert self._lock.locked()
-    pos = bisect.bisect_left(self._sorted_by_name, (task_name,))
-    if (pos >= len(self._sorted_by_name) or
-        self._sorted_by_name[pos][0] != task_name):
-      return None
-    return pos
+    return self._tasks_by_name.get(task_name)
 
   @_WithLock
   def Add(self, request, now):
@@ -1509,21 +1666,18 @@ class _Queue(object):
 
   def _DeleteNoAcquireLock(self, name):
     assert self._lock.locked()
-    pos = self._LocateTaskByName(name)
-    if pos is None:
+    old_task = self._tasks_by_name.pop(name, None)
+    if old_task is None:
       if name in self.task_name_archive:
         return taskqueue_service_pb.TaskQueueServiceError.TOMBSTONED_TASK
       else:
         return taskqueue_service_pb.TaskQueueServiceError.UNKNOWN_TASK
 
-    old_task = self._sorted_by_name.pop(pos)[1]
-
-    eta = old_task.eta_usec()
-    pos = bisect.bisect_left(self._sorted_by_eta, (eta, name, None))
-    if self._sorted_by_eta[pos][2] is not old_task:
+    self._sorted_by_name.Remove(name)
+    if (name not in self._eta_heap_entries or
+        self._RemoveFromEtaHeapNoLock(name) is not old_task):
       logging.error('task store corrupted')
       return taskqueue_service_pb.TaskQueueServiceError.INTERNAL_ERRROR
-    self._sorted_by_eta.pop(pos)
     return taskqueue_service_pb.TaskQueueServiceError.OK
 
   @_WithLock
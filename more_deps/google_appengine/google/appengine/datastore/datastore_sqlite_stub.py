@@ -40,8 +40,10 @@ when it begins and releases it when it commits or rolls back.
 
 
 import array
+import collections
 import itertools
 import logging
+import math
 import threading
 import weakref
 
@@ -138,6 +140,106 @@ INSERT OR IGNORE INTO IdSeq VALUES ('%(prefix)s', 1);
 """
 
 
+
+
+
+_SYNCHRONOUS_LEVELS = frozenset(['OFF', 'NORMAL', 'FULL'])
+
+
+
+
+_MAX_QUERY_PARAMS = 500
+
+
+
+
+_EQUALITY_SELECTIVITY = 0.1
+_INEQUALITY_SELECTIVITY = 0.25
+_ANCESTOR_SELECTIVITY = 0.1
+
+
+class _CardinalityStatistics(object):
+  """Row counts for the tables of one namespace, used to cost query plans.
+
+  The counts are read from the database the first time the namespace is
+  planned for and are then kept up to date as entities are written and
+  deleted.
+
+  Public properties:
+    kinds: dict mapping kinds to their number of entities.
+    properties: dict mapping (kind, property name) tuples to their number of
+      rows in EntitiesByProperty.
+  """
+
+  def __init__(self, conn, prefix):
+    """Constructor.
+
+    Args:
+      conn: An SQLite connection.
+      prefix: The namespace prefix to read the counts of.
+    """
+    self.kinds = {}
+    self.properties = {}
+    self.Update(self.kinds, dict(conn.execute(
+        'SELECT kind, COUNT(*) FROM "%s!Entities" GROUP BY kind' % prefix)))
+    self.Update(self.properties, dict(
+        ((kind, name), count) for kind, name, count in conn.execute(
+            'SELECT kind, name, COUNT(*) FROM "%s!EntitiesByProperty" '
+            'GROUP BY kind, name' % prefix)))
+
+  def Update(self, counts, delta):
+    """Adds the amounts in delta to counts, dropping counts that reach zero.
+
+    Args:
+      counts: self.kinds or self.properties.
+      delta: a dict mapping keys of counts to the amount to add to them. Kinds
+        and property names may be unicode or utf-8 encoded.
+    """
+    for key, amount in delta.iteritems():
+      if isinstance(key, tuple):
+        key = tuple(ToUtf8(x) for x in key)
+      else:
+        key = ToUtf8(key)
+      count = counts.get(key, 0) + amount
+      if count > 0:
+        counts[key] = count
+      else:
+        counts.pop(key, None)
+
+
+class QueryPlan(object):
+  """The plan DatastoreSqliteStub chose for a query.
+
+  Public properties:
+    strategy: the name of the query strategy that was used.
+    cost: the estimated cost of the strategy, in index rows visited.
+    candidates: dict mapping the name of every strategy that could run the
+      query to its estimated cost.
+    statement: the SQL statement that was executed.
+    params: the parameters of statement.
+    explain: the rows SQLite's EXPLAIN QUERY PLAN returned for statement, or
+      None if they have not been requested.
+  """
+
+  def __init__(self, strategy, cost, candidates, statement, params):
+    self.strategy = strategy
+    self.cost = cost
+    self.candidates = candidates
+    self.statement = statement
+    self.params = params
+    self.explain = None
+
+  def __str__(self):
+    lines = ['%s (estimated cost %.1f)' % (self.strategy, self.cost)]
+    for name, cost in sorted(self.candidates.items(), key=lambda x: x[1]):
+      if name != self.strategy:
+        lines.append('  rejected %s (estimated cost %.1f)' % (name, cost))
+    lines.append('  %s' % self.statement)
+    for row in self.explain or ():
+      lines.append('    %s' % '|'.join(str(column) for column in row))
+    return '\n'.join(lines)
+
+
 def ReferencePropertyToReference(refprop):
   ref = entity_pb.Reference()
   ref.set_app(refprop.app())
@@ -458,7 +560,7 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
   handles a single app's data.
   """
 
-
+  THREADSAFE = True
 
 
 
@@ -474,7 +576,9 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
                verbose=False,
                service_name='datastore_v3',
                trusted=False,
-               consistency_policy=None):
+               consistency_policy=None,
+               write_optimized=False,
+               synchronous=None):
     """Constructor.
 
     Initializes the SQLite database if necessary.
@@ -492,6 +596,13 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
       consistency_policy: The consistency policy to use or None to use the
         default. Consistency policies can be found in
         datastore_stub_util.*ConsistencyPolicy
+      write_optimized: bool, default False. If True, the database uses WAL
+        journaling and puts and deletes are queued until the end of the API
+        call, or until something is read, and then written together with one
+        statement per table.
+      synchronous: The SQLite synchronous level, 'OFF', 'NORMAL' or 'FULL'.
+        Defaults to 'NORMAL' if write_optimized is set and to SQLite's own
+        default otherwise.
     """
     datastore_stub_util.BaseDatastore.__init__(self, require_indexes,
                                                consistency_policy)
@@ -503,6 +614,18 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
 
     self.__verbose = verbose
 
+    if write_optimized and synchronous is None:
+      synchronous = 'NORMAL'
+    if synchronous is not None and synchronous not in _SYNCHRONOUS_LEVELS:
+      raise ValueError('synchronous must be one of %s, not %r' %
+                       (', '.join(sorted(_SYNCHRONOUS_LEVELS)), synchronous))
+    self.__write_optimized = write_optimized
+
+
+    self.__pending = {}
+    self.__pending_groups = set()
+    self.__pending_lock = threading.Lock()
+
 
     self.__id_map = {}
     self.__id_lock = threading.Lock()
@@ -511,6 +634,10 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
         self.__datastore_file or ':memory:',
         timeout=_MAX_TIMEOUT,
         check_same_thread=False)
+    if write_optimized:
+      self.__connection.execute('PRAGMA journal_mode=WAL')
+    if synchronous is not None:
+      self.__connection.execute('PRAGMA synchronous=%s' % synchronous)
 
 
     self.__connection_lock = threading.RLock()
@@ -521,6 +648,12 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
 
     self.__query_history = {}
 
+
+    self.__query_plans = {}
+
+
+    self.__statistics = {}
+
     self._RegisterPseudoKind(KindPseudoKind(weakref.proxy(self)))
     self._RegisterPseudoKind(PropertyPseudoKind(weakref.proxy(self)))
     self._RegisterPseudoKind(NamespacePseudoKind(weakref.proxy(self)))
@@ -567,7 +700,11 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
 
     self.__namespaces = set()
     self.__query_history = {}
+    self.__query_plans = {}
+    self.__statistics = {}
     self.__id_map = {}
+    self.__pending = {}
+    self.__pending_groups = set()
     self.__Init()
 
   def Read(self):
@@ -580,9 +717,10 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
   def Write(self):
     """Writes the datastore to disk.
 
-    Noop for compatibility with file stub.
+    Writes the puts and deletes queued in write-optimized mode. Otherwise a
+    noop, since changes are written as they are made.
     """
-    pass
+    self.__WritePending()
 
   @staticmethod
   def __MakeParamList(size):
@@ -750,11 +888,30 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
     Returns:
       The number of rows deleted.
     """
-    keys = sorted((x.app(), x.name_space(), x) for x in keys)
+    deleted = 0
+    keys = sorted(((x.app(), x.name_space(), x) for x in keys),
+                  key=lambda x: x[:2])
     for (app_id, ns), group in itertools.groupby(keys, lambda x: x[:2]):
       path_strings = [self.__EncodeIndexPB(x[2].path()) for x in group]
       prefix = self._GetTablePrefix((app_id, ns))
-      return self.__DeleteRows(conn, path_strings, '%s!%s' % (prefix, table))
+      statistics = self.__statistics.get(prefix)
+      for start in xrange(0, len(path_strings), _MAX_QUERY_PARAMS):
+        paths = path_strings[start:start + _MAX_QUERY_PARAMS]
+        if statistics is not None:
+          if table == 'Entities':
+            columns, counts = 'kind', statistics.kinds
+          else:
+            columns, counts = 'kind, name', statistics.properties
+          c = conn.execute(
+              'SELECT %s, COUNT(*) FROM "%s!%s" WHERE __path__ IN (%s) '
+              'GROUP BY %s' % (columns, prefix, table,
+                               self.__MakeParamList(len(paths)), columns),
+              paths)
+          statistics.Update(counts, dict(
+              (row[0] if len(row) == 2 else row[:2], -row[-1])
+              for row in c.fetchall()))
+        deleted += self.__DeleteRows(conn, paths, '%s!%s' % (prefix, table))
+    return deleted
 
   def __DeleteIndexEntries(self, conn, keys):
     """Deletes entities from the index.
@@ -779,11 +936,27 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
                self.__GetEntityKind(e),
                buffer(e.Encode()))
 
-    entities = sorted((self._GetTablePrefix(x), x) for x in entities)
+    entities = sorted(((self._GetTablePrefix(x), x) for x in entities),
+                      key=lambda x: x[0])
     for prefix, group in itertools.groupby(entities, lambda x: x[0]):
+      rows = list(RowGenerator(group))
+      statistics = self.__statistics.get(prefix)
+      if statistics is not None:
+        existing = set()
+        for start in xrange(0, len(rows), _MAX_QUERY_PARAMS):
+          paths = [row[0] for row in rows[start:start + _MAX_QUERY_PARAMS]]
+          c = conn.execute(
+              'SELECT __path__ FROM "%s!Entities" WHERE __path__ IN (%s)'
+              % (prefix, self.__MakeParamList(len(paths))), paths)
+          existing.update(str(row[0]) for row in c.fetchall())
+        delta = collections.defaultdict(int)
+        for path, kind, _ in rows:
+          if str(path) not in existing:
+            delta[kind] += 1
+        statistics.Update(statistics.kinds, delta)
       conn.executemany(
           'INSERT OR REPLACE INTO "%s!Entities" VALUES (?, ?, ?)' % prefix,
-          RowGenerator(group))
+          rows)
 
   def __InsertIndexEntries(self, conn, entities):
     """Inserts index entries for the supplied entities.
@@ -800,18 +973,30 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
                  p.name(),
                  self.__EncodeIndexPB(p.value()),
                  self.__EncodeIndexPB(e.key().path()))
-    entities = sorted((self._GetTablePrefix(x), x) for x in entities)
+    entities = sorted(((self._GetTablePrefix(x), x) for x in entities),
+                      key=lambda x: x[0])
     for prefix, group in itertools.groupby(entities, lambda x: x[0]):
+      rows = list(RowGenerator(group))
+      statistics = self.__statistics.get(prefix)
+      if statistics is not None:
+        delta = collections.defaultdict(int)
+        for row in set((kind, name, str(value), str(path))
+                       for kind, name, value, path in rows):
+          delta[row[:2]] += 1
+        statistics.Update(statistics.properties, delta)
       conn.executemany(
           'INSERT INTO "%s!EntitiesByProperty" VALUES (?, ?, ?, ?)' % prefix,
-          RowGenerator(group))
+          rows)
 
   def MakeSyncCall(self, service, call, request, response):
     """The main RPC entry point. service must be 'datastore_v3'."""
     self.AssertPbIsInitialized(request)
     try:
-      apiproxy_stub.APIProxyStub.MakeSyncCall(self, service, call, request,
-                                              response)
+      try:
+        apiproxy_stub.APIProxyStub.MakeSyncCall(self, service, call, request,
+                                                response)
+      finally:
+        self.__WritePending()
     except sqlite3.OperationalError, e:
       datastore_stub_util.Check(e.args[0] == 'database is locked',
                                 'Database is locked.',
@@ -826,10 +1011,85 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
 
     pb.Encode()
 
-  def QueryHistory(self):
-    """Returns a dict that maps Query PBs to times they've been run."""
-    return dict((pb, times) for pb, times in self.__query_history.items() if
-                pb.app() == self._app_id)
+  def QueryHistory(self, explain=False):
+    """Returns a dict that maps Query PBs to times they've been run.
+
+    Args:
+      explain: bool, default False. If True, Query PBs are mapped to
+        (times, plan) tuples instead, where plan is the QueryPlan last used to
+        run the query with its explain rows filled in, or None if the query
+        was not planned, as for pseudo-kind and ancestor queries.
+    """
+    history = dict((pb, times) for pb, times in self.__query_history.items()
+                   if pb.app() == self._app_id)
+    if not explain:
+      return history
+
+    conn = self._GetConnection()
+    try:
+      for pb, times in history.items():
+        plan = self.__query_plans.get(pb)
+        if plan:
+          plan.explain = conn.execute('EXPLAIN QUERY PLAN ' + plan.statement,
+                                      plan.params).fetchall()
+        history[pb] = (times, plan)
+    finally:
+      self._ReleaseConnection(conn)
+    return history
+
+  @staticmethod
+  def __QueryHistoryKey(query):
+    """Returns the Query PB under which query is recorded in the history."""
+    clone = datastore_pb.Query()
+    clone.CopyFrom(query)
+    clone.clear_hint()
+    clone.clear_limit()
+    clone.clear_count()
+    clone.clear_offset()
+    return clone
+
+  def __GetStatistics(self, prefix):
+    """Returns the _CardinalityStatistics of a namespace.
+
+    Args:
+      prefix: The namespace prefix, as returned by _GetTablePrefix.
+    """
+    statistics = self.__statistics.get(prefix)
+    if statistics is None:
+      conn = self._GetConnection()
+      try:
+        statistics = _CardinalityStatistics(conn, prefix)
+      finally:
+        self._ReleaseConnection(conn)
+      self.__statistics[prefix] = statistics
+    return statistics
+
+  def __EstimateRows(self, query, name, filter_ops):
+    """Estimates how many index rows match filters on one property.
+
+    Args:
+      query: The datastore_pb.Query PB.
+      name: The property name.
+      filter_ops: A list of (op, value) tuples filtering on name.
+    Returns:
+      The estimated number of rows, at least 1.
+    """
+    statistics = self.__GetStatistics(self._GetTablePrefix(query))
+    if name == '__key__':
+      if query.has_kind():
+        rows = statistics.kinds.get(query.kind(), 0)
+      else:
+        rows = sum(statistics.kinds.itervalues())
+    else:
+      rows = statistics.properties.get((query.kind(), name), 0)
+    for op, _ in filter_ops:
+      if op == datastore_pb.Query_Filter.EQUAL:
+        rows *= _EQUALITY_SELECTIVITY
+      else:
+        rows *= _INEQUALITY_SELECTIVITY
+    if query.has_ancestor():
+      rows *= _ANCESTOR_SELECTIVITY
+    return max(rows, 1.0)
 
   def __GenerateFilterInfo(self, filters, query):
     """Transform a list of filters into a more usable form.
@@ -997,24 +1257,7 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
     Returns:
       (query, params): An SQL query string and list of parameters for it.
     """
-    filter_sets = []
-    for name, filter_ops in filter_info.items():
-
-      filter_sets.extend((name, [x]) for x in filter_ops
-                         if x[0] == datastore_pb.Query_Filter.EQUAL)
-
-      ineq_ops = [x for x in filter_ops
-                  if x[0] != datastore_pb.Query_Filter.EQUAL]
-      if ineq_ops:
-        filter_sets.append((name, ineq_ops))
-
-
-    for prop, _ in order_info:
-      if prop == '__key__':
-        continue
-      if prop not in filter_info:
-        filter_sets.append((prop, []))
-
+    filter_sets = self.__StarSchemaFilterSets(query, filter_info, order_info)
     prefix = self._GetTablePrefix(query)
 
     joins = []
@@ -1066,6 +1309,42 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
              'FROM "%s!Entities" AS Entities %s %s %s' % format_args)
     return query, params
 
+  def __StarSchemaFilterSets(self, query, filter_info, order_info):
+    """Returns the sets of filters a 'star schema' query joins on.
+
+    Each equality filter is a set of its own, while the inequality filters on
+    a property form a single set, as do orders on properties that are not
+    filtered on. The sets are sorted by their estimated number of rows, so
+    that the most selective one is joined first.
+
+    Args:
+      query: The datastore_pb.Query PB.
+      filter_info: A dict mapping properties filtered on to (op, value) tuples.
+      order_info: A list of (property, direction) tuples.
+    Returns:
+      A list of (property, [(op, value)]) tuples.
+    """
+    filter_sets = []
+    for name, filter_ops in filter_info.items():
+
+      filter_sets.extend((name, [x]) for x in filter_ops
+                         if x[0] == datastore_pb.Query_Filter.EQUAL)
+
+      ineq_ops = [x for x in filter_ops
+                  if x[0] != datastore_pb.Query_Filter.EQUAL]
+      if ineq_ops:
+        filter_sets.append((name, ineq_ops))
+
+
+    for prop, _ in order_info:
+      if prop == '__key__':
+        continue
+      if prop not in filter_info:
+        filter_sets.append((prop, []))
+
+    filter_sets.sort(key=lambda x: self.__EstimateRows(query, *x))
+    return filter_sets
+
   def __MergeJoinQuery(self, query, filter_info, order_info):
 
     if order_info:
@@ -1096,16 +1375,89 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
     """
     return self.__StarSchemaQueryPlan(query, filter_info, order_info)
 
+  def __KindQueryCost(self, query, filter_info, order_info):
+    """Estimates the cost of __KindQuery, which scans EntitiesByKind."""
+    return self.__EstimateRows(query, '__key__', filter_info.get('__key__', []))
+
+  def __SinglePropertyQueryCost(self, query, filter_info, order_info):
+    """Estimates the cost of __SinglePropertyQuery.
+
+    Every row read from EntitiesByProperty is joined to its entity.
+    """
+    name = (filter_info.keys() or [order_info[0][0]])[0]
+    return 2 * self.__EstimateRows(query, name, filter_info.get(name, []))
+
+  def __StarSchemaQueryCost(self, query, filter_info, order_info):
+    """Estimates the cost of __StarSchemaQueryPlan.
+
+    The most selective join drives the query and every other join, and the
+    entity, are probed for each of its rows. Unless the only order is on
+    __key__, the results are sorted afterwards.
+    """
+    filter_sets = [(name, ops) for name, ops
+                   in self.__StarSchemaFilterSets(query, filter_info,
+                                                  order_info)
+                   if name != '__key__']
+    key_ops = filter_info.get('__key__', [])
+    if not filter_sets:
+      return self.__EstimateRows(query, '__key__', key_ops)
+
+    rows = self.__EstimateRows(query, *filter_sets[0])
+    for op, _ in key_ops:
+      rows = max(rows * _INEQUALITY_SELECTIVITY, 1.0)
+    cost = rows * (len(filter_sets) + 1)
+    if [prop for prop, _ in order_info if prop != '__key__']:
+      cost += rows * math.log(rows + 1, 2)
+    return cost
+
   _QUERY_STRATEGIES = [
-      __KindQuery,
-      __SinglePropertyQuery,
-      __MergeJoinQuery,
-      __LastResortQuery,
+      ('KindQuery', __KindQuery, __KindQueryCost),
+      ('SinglePropertyQuery', __SinglePropertyQuery,
+       __SinglePropertyQueryCost),
+      ('MergeJoinQuery', __MergeJoinQuery, __StarSchemaQueryCost),
+      ('LastResortQuery', __LastResortQuery, __StarSchemaQueryCost),
   ]
 
+  def __PlanQuery(self, query, filter_info, order_info):
+    """Chooses the cheapest strategy that can run a query.
+
+    Args:
+      query: The datastore_pb.Query PB.
+      filter_info: A dict mapping properties filtered on to (op, value) tuples.
+      order_info: A list of (property, direction) tuples.
+    Returns:
+      A QueryPlan.
+    """
+    plan = None
+    candidates = {}
+    for name, strategy, estimate_cost in DatastoreSqliteStub._QUERY_STRATEGIES:
+      result = strategy(self, query, filter_info, order_info)
+      if not result:
+        continue
+      cost = estimate_cost(self, query, filter_info, order_info)
+      candidates[name] = cost
+      if plan is None or cost < plan.cost:
+        plan = QueryPlan(name, cost, candidates, *result)
+
+    if plan is None:
+      raise apiproxy_errors.ApplicationError(
+          datastore_pb.Error.BAD_REQUEST,
+          'No strategy found to satisfy query.')
+    return plan
+
 
 
   def _Put(self, entity, insert):
+    if self.__write_optimized:
+      self.__pending_lock.acquire()
+      try:
+        self.__pending[datastore_types.ReferenceToKeyValue(entity.key())] = (
+            entity.key(), datastore_stub_util.StoreEntity(entity))
+        self.__pending_groups.add(self.__EntityGroupKey(entity.key()))
+      finally:
+        self.__pending_lock.release()
+      return
+
     conn = self._GetConnection()
     try:
       self.__DeleteIndexEntries(conn, [entity.key()])
@@ -1116,6 +1468,7 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
       self._ReleaseConnection(conn)
 
   def _Get(self, key):
+    self.__WritePending(key)
     conn = self._GetConnection()
     try:
       prefix = self._GetTablePrefix(key)
@@ -1131,6 +1484,15 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
       self._ReleaseConnection(conn)
 
   def _Delete(self, key):
+    if self.__write_optimized:
+      self.__pending_lock.acquire()
+      try:
+        self.__pending[datastore_types.ReferenceToKeyValue(key)] = (key, None)
+        self.__pending_groups.add(self.__EntityGroupKey(key))
+      finally:
+        self.__pending_lock.release()
+      return
+
     conn = self._GetConnection()
     try:
       self.__DeleteIndexEntries(conn, [key])
@@ -1138,6 +1500,49 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
     finally:
       self._ReleaseConnection(conn)
 
+  @staticmethod
+  def __EntityGroupKey(key):
+    """Returns a hashable value identifying the entity group of key."""
+    return datastore_types.ReferenceToKeyValue(
+        datastore_stub_util._GetEntityGroup(key))
+
+  def __WritePending(self, key=None):
+    """Writes the puts and deletes queued in write-optimized mode.
+
+    This is called before the database is read and at the end of every API
+    call, so the queue is never visible to readers. The queue holds only the
+    last put or delete of each key, so the order of the writes in between
+    does not matter.
+
+    Args:
+      key: An entity_pb.Reference. If given, the queue is only written if it
+        has changes to the entity group of key.
+    """
+    self.__pending_lock.acquire()
+    try:
+      if (key is not None and
+          self.__EntityGroupKey(key) not in self.__pending_groups):
+        return
+      pending, self.__pending = self.__pending, {}
+      self.__pending_groups = set()
+    finally:
+      self.__pending_lock.release()
+    if not pending:
+      return
+    keys = [key for key, _ in pending.itervalues()]
+    puts = [entity for _, entity in pending.itervalues() if entity is not None]
+    deletes = [key for key, entity in pending.itervalues() if entity is None]
+
+    conn = self._GetConnection()
+    try:
+      self.__DeleteIndexEntries(conn, keys)
+      self.__InsertEntities(conn, puts)
+      self.__InsertIndexEntries(conn, puts)
+      if deletes:
+        self.__DeleteEntityRows(conn, deletes, 'Entities')
+    finally:
+      self._ReleaseConnection(conn)
+
   def _GetEntitiesInEntityGroup(self, entity_group):
     query = datastore_pb.Query()
     query.set_app(entity_group.app())
@@ -1154,6 +1559,7 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
 
 
 
+    self.__WritePending(entity_group)
     conn = self._GetConnection()
     try:
       db_cursor = conn.execute(sql_stmt, params)
@@ -1173,6 +1579,7 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
     Returns:
       A QueryCursor object.
     """
+    self.__WritePending()
     if query.has_kind() and query.kind() in self._pseudo_kinds:
       cursor = self._pseudo_kinds[query.kind()].Query(query, filters, orders)
       datastore_stub_util.Check(cursor,
@@ -1182,20 +1589,13 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
       filter_info = self.__GenerateFilterInfo(filters, query)
       order_info = self.__GenerateOrderInfo(orders)
 
-      for strategy in DatastoreSqliteStub._QUERY_STRATEGIES:
-        result = strategy(self, query, filter_info, order_info)
-        if result:
-          break
-      else:
-        raise apiproxy_errors.ApplicationError(
-            datastore_pb.Error.BAD_REQUEST,
-            'No strategy found to satisfy query.')
-
-      sql_stmt, params = result
+      plan = self.__PlanQuery(query, filter_info, order_info)
+      self.__query_plans[self.__QueryHistoryKey(query)] = plan
+      sql_stmt, params = plan.statement, plan.params
 
       if self.__verbose:
-        logging.info("Executing statement '%s' with arguments %r",
-                     sql_stmt, [str(x) for x in params])
+        logging.info("Executing statement '%s' with arguments %r, chosen by %s",
+                     sql_stmt, [str(x) for x in params], plan)
       conn = self._GetConnection()
       try:
         db_cursor = conn.execute(sql_stmt, params)
@@ -1210,12 +1610,7 @@ class DatastoreSqliteStub(datastore_stub_util.BaseDatastore,
     super(DatastoreSqliteStub, self)._Dynamic_RunQuery(query, query_result)
 
 
-    clone = datastore_pb.Query()
-    clone.CopyFrom(query)
-    clone.clear_hint()
-    clone.clear_limit()
-    clone.clear_count()
-    clone.clear_offset()
+    clone = self.__QueryHistoryKey(query)
     self.__query_history[clone] = self.__query_history.get(clone, 0) + 1
 
   def _AllocateIds(self, reference, size=1, max_id=None):
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+
+"""Benchmark of puts per second through DatastoreSqliteStub.
+
+Puts synthetic entities through the Put RPC into an on-disk database, once
+with the default settings and once in write-optimized mode, and reports the
+throughput of each.
+
+Usage:
+  python datastore_sqlite_stub_benchmark.py [--entities=N] [--batch=N]
+      [--properties=N] [--seed=N]
+"""
+
+
+
+import getopt
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_pb
+from google.appengine.datastore import datastore_sqlite_stub
+from google.appengine.datastore import entity_pb
+
+
+_APP_ID = 'benchmark'
+
+_KIND = 'Benchmark'
+
+
+def MakeEntity(entity_id, num_properties, rng):
+  """Builds an entity with integer and string properties.
+
+  Args:
+    entity_id: the numeric id of the entity.
+    num_properties: the number of properties to give the entity.
+    rng: a random.Random.
+
+  Returns:
+    An entity_pb.EntityProto.
+  """
+  entity = entity_pb.EntityProto()
+  key = entity.mutable_key()
+  key.set_app(_APP_ID)
+  element = key.mutable_path().add_element()
+  element.set_type(_KIND)
+  element.set_id(entity_id)
+  entity.mutable_entity_group().add_element().CopyFrom(element)
+  for i in xrange(num_properties):
+    prop = entity.add_property()
+    prop.set_name('p%d' % i)
+    prop.set_multiple(False)
+    if i % 2:
+      prop.mutable_value().set_stringvalue('s%d' % rng.randint(0, 1000))
+    else:
+      prop.mutable_value().set_int64value(rng.randint(0, 1000000))
+  return entity
+
+
+def TimePuts(stub, entities, batch_size):
+  """Puts entities through the Put RPC in batches.
+
+  Returns:
+    The number of seconds the puts took.
+  """
+  start = time.time()
+  for i in xrange(0, len(entities), batch_size):
+    request = datastore_pb.PutRequest()
+    for entity in entities[i:i + batch_size]:
+      request.add_entity().CopyFrom(entity)
+    stub.MakeSyncCall('datastore_v3', 'Put', request,
+                      datastore_pb.PutResponse())
+  return time.time() - start
+
+
+def RunCase(directory, entities, batch_size, write_optimized):
+  """Puts entities into a new database and returns the puts per second."""
+  datastore_file = os.path.join(directory, 'datastore-%d' % write_optimized)
+  stub = datastore_sqlite_stub.DatastoreSqliteStub(
+      _APP_ID, datastore_file, write_optimized=write_optimized)
+  apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+  apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', stub)
+
+  return len(entities) / TimePuts(stub, entities, batch_size)
+
+
+def main(argv):
+  num_entities = 5000
+  batch_size = 100
+  num_properties = 10
+  seed = 0
+  opts, _ = getopt.getopt(argv[1:], '', ['entities=', 'batch=',
+                                         'properties=', 'seed='])
+  for option, value in opts:
+    if option == '--entities':
+      num_entities = int(value)
+    elif option == '--batch':
+      batch_size = int(value)
+    elif option == '--properties':
+      num_properties = int(value)
+    elif option == '--seed':
+      seed = int(value)
+
+  os.environ['APPLICATION_ID'] = _APP_ID
+  rng = random.Random(seed)
+  entities = [MakeEntity(i + 1, num_properties, rng)
+              for i in xrange(num_entities)]
+
+  directory = tempfile.mkdtemp()
+  try:
+    for label, write_optimized in (('default', False),
+                                   ('write optimized', True)):
+      puts_per_second = RunCase(directory, entities, batch_size,
+                                write_optimized)
+      print '%-16s %9.1f puts/s' % (label, puts_per_second)
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
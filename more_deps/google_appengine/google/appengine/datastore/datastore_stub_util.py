@@ -33,6 +33,7 @@ except ImportError:
 
 import collections
 import datetime
+import heapq
 import itertools
 import logging
 import random
@@ -1031,6 +1032,94 @@ class ListCursor(BaseCursor):
     self._PopulateResultMetadata(result, compile, self.__last_result)
 
 
+class StreamingCursor(IteratorCursor):
+  """A query cursor that lazily filters and sorts a superset of its results.
+
+  Nothing is computed until the first result is needed.  Entities outside the
+  query's start and end compiled cursors are dropped while filtering, and when
+  the query has a limit only the first limit + offset matches are kept, using
+  a heap, instead of sorting every match.
+  """
+
+  def __init__(self, query, dsquery, orders, entities):
+    """Constructor.
+
+    Args:
+      query: the query request proto
+      dsquery: a datastore_query.Query over query.
+      orders: the orders of query as returned by _GuessOrders.
+      entities: superset of results for query (iterable of
+        datastore_pb.EntityProto)
+    """
+    self.__query = query
+    self.__dsquery = dsquery
+    self.__entities = entities
+    super(StreamingCursor, self).__init__(query, dsquery, orders,
+                                          self.__Results())
+
+  def __Results(self):
+    """Yields the results of the query in order."""
+    query = self.__query
+    dsquery = self.__dsquery
+    filter_predicate = dsquery._filter_predicate
+
+    names = dsquery._order._get_prop_names()
+    names.add(datastore_types.KEY_SPECIAL_PROPERTY)
+    if filter_predicate:
+      names |= filter_predicate._get_prop_names()
+    exists_filter = datastore_query._PropertyExistsFilter(names)
+
+    def SortKey(value_map):
+      return (dsquery._order._key(value_map),
+              value_map[datastore_types.KEY_SPECIAL_PROPERTY])
+
+    def CursorKey(compiled_cursor):
+      cursor_entity, inclusive = self._DecodeCompiledCursor(compiled_cursor)
+      value_map = datastore_query._make_key_value_map(cursor_entity, names)
+      if filter_predicate:
+        filter_predicate._prune(value_map)
+      return SortKey(value_map), inclusive
+
+    def IsBefore(key, cursor):
+      x = cmp(key, cursor[0])
+      if cursor[1]:
+        return x < 0
+      else:
+        return x <= 0
+
+    start = end = None
+    if query.has_compiled_cursor() and query.compiled_cursor().position_list():
+      start = CursorKey(query.compiled_cursor())
+    if (query.has_end_compiled_cursor() and
+        query.end_compiled_cursor().position_list()):
+      end = CursorKey(query.end_compiled_cursor())
+
+    matches = []
+    for entity in itertools.ifilter(dsquery._key_filter, self.__entities):
+      value_map = datastore_query._make_key_value_map(entity, names)
+      if not exists_filter._apply(value_map) or (
+          filter_predicate and not filter_predicate._prune(value_map)):
+        continue
+      key = SortKey(value_map)
+      if start and IsBefore(key, start):
+        continue
+      if end and not IsBefore(key, end):
+        continue
+      matches.append((key, entity))
+    self.__entities = None
+
+    limit = None
+    if query.has_limit():
+      limit = query.limit() + query.offset()
+    if limit is not None and 0 <= limit < len(matches):
+      matches = heapq.nsmallest(limit, matches)
+    else:
+      matches.sort()
+
+    for _, entity in matches:
+      yield entity
+
+
 def _SynchronizeTxn(function):
   """A decorator that locks a transaction during the function call."""
 
@@ -2547,9 +2636,8 @@ def _ExecuteQuery(results, query, filters, orders):
     orders: the orders from query.
 
   Returns:
-    A ListCursor over the results of applying query to results.
+    A StreamingCursor over the results of applying query to results.
   """
   orders = _GuessOrders(filters, orders)
   dsquery = _MakeQuery(query, filters, orders)
-  return ListCursor(query, dsquery, orders,
-                    datastore_query.apply_query(dsquery, results))
+  return StreamingCursor(query, dsquery, orders, results)
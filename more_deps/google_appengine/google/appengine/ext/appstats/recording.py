@@ -41,6 +41,7 @@ from google.appengine.api import users
 
 from google.appengine.ext.appstats import datamodel_pb
 from google.appengine.ext.appstats import formatting
+from google.appengine.ext.appstats import rollup
 
 
 class ConfigDefaults(object):
@@ -98,6 +99,24 @@ class ConfigDefaults(object):
 
 
 
+  SLOW_RPC_MILLISECONDS = None
+
+
+
+
+
+
+  ROLLUP_ENABLED = False
+  ROLLUP_KIND = '_AE_Appstats_Rollup'
+  ROLLUP_BUCKET_SECONDS = 300
+  ROLLUP_NUM_BUCKETS = 288
+  ROLLUP_SHARDS = 4
+  ROLLUP_MAX_KEYS = 100
+  ROLLUP_FLUSH_SECONDS = 60
+
+
+
+
 
 
 
@@ -181,6 +200,35 @@ class ConfigDefaults(object):
 config = lib_config.register('appstats', ConfigDefaults.__dict__)
 
 
+FRAME_KEEP = 0
+FRAME_SKIP = 1
+FRAME_BOTTOM = 2
+
+
+MAX_CODE_SUMMARIES = 10000
+
+
+_rollup_store = None
+_rollup_store_lock = threading.Lock()
+
+
+def get_rollup_store():
+  """Return the process-wide RollupStore, creating it if necessary."""
+  global _rollup_store
+  if _rollup_store is None:
+    with _rollup_store_lock:
+      if _rollup_store is None:
+        _rollup_store = rollup.RollupStore(
+            config.ROLLUP_KIND,
+            namespace=config.KEY_NAMESPACE,
+            bucket_seconds=config.ROLLUP_BUCKET_SECONDS,
+            num_buckets=config.ROLLUP_NUM_BUCKETS,
+            num_shards=config.ROLLUP_SHARDS,
+            max_keys=config.ROLLUP_MAX_KEYS,
+            flush_seconds=config.ROLLUP_FLUSH_SECONDS)
+  return _rollup_store
+
+
 class Recorder(object):
   """In-memory state for the current request.
 
@@ -205,6 +253,7 @@ class Recorder(object):
     self.end_timestamp = self.start_timestamp
     self.traces = []
     self.pending = {}
+    self.deferred = {}
     self.overhead = (time.time() - self.start_timestamp)
     self._lock = threading.Lock()
 
@@ -261,20 +310,27 @@ class Recorder(object):
       rpc: The RPC object; may be None.
     """
     pre_now = time.time()
-    sreq = format_value(request)
+    deferred = None
+    if config.SLOW_RPC_MILLISECONDS is None:
+      sreq = format_value(request)
+    else:
+      deferred = (self.get_raw_call_stack(), request)
     now = time.time()
     delta = int(1000 * (now - self.start_timestamp))
     trace = datamodel_pb.IndividualRpcStatsProto()
-    self.get_call_stack(trace)
+    if deferred is None:
+      self.get_call_stack(trace)
+      trace.set_request_data_summary(sreq)
     trace.set_service_call_name('%s.%s' % (service, call))
-    trace.set_request_data_summary(sreq)
     trace.set_start_offset_milliseconds(delta)
     with self._lock:
       if rpc is not None:
 
         self.pending[rpc] = len(self.traces)
+      if deferred is not None:
+        self.deferred[len(self.traces)] = deferred
       self.traces.append(trace)
-      self.overhead += (now - pre_now)
+      self.overhead += (time.time() - pre_now)
 
   def record_rpc_response(self, service, call, request, response, rpc):
     """Record the response of an RPC call.
@@ -292,7 +348,9 @@ class Recorder(object):
     now = time.time()
     key = '%s.%s' % (service, call)
     delta = int(1000 * (now - self.start_timestamp))
-    sresp = format_value(response)
+    sresp = None
+    if config.SLOW_RPC_MILLISECONDS is None:
+      sresp = format_value(response)
     api_mcycles = 0
     if rpc is not None:
       api_mcycles = rpc.cpu_usage_mcycles
@@ -304,23 +362,28 @@ class Recorder(object):
           del self.pending[rpc]
           if 0 <= index < len(self.traces):
             trace = self.traces[index]
-            trace.set_response_data_summary(sresp)
+            if sresp is not None:
+              trace.set_response_data_summary(sresp)
             trace.set_api_mcycles(api_mcycles)
             duration = delta - trace.start_offset_milliseconds()
             trace.set_duration_milliseconds(duration)
+            self.complete_deferred_trace(index, trace, response)
             self.overhead += (time.time() - now)
             return
     else:
 
       with self._lock:
-        for trace in reversed(self.traces):
+        for index in xrange(len(self.traces) - 1, -1, -1):
+          trace = self.traces[index]
           if (trace.service_call_name() == key and
-              not trace.response_data_summary()):
+              not trace.has_duration_milliseconds()):
             if config.DEBUG:
               logging.debug('Matched RPC response without rpc object')
-            trace.set_response_data_summary(sresp)
+            if sresp is not None:
+              trace.set_response_data_summary(sresp)
             duration = delta - trace.start_offset_milliseconds()
             trace.set_duration_milliseconds(duration)
+            self.complete_deferred_trace(index, trace, response)
             self.overhead += (time.time() - now)
             return
 
@@ -329,7 +392,7 @@ class Recorder(object):
     trace = datamodel_pb.IndividualRpcStatsProto()
     self.get_call_stack(trace)
     trace.set_service_call_name(key)
-    trace.set_request_data_summary(sresp)
+    trace.set_request_data_summary(format_value(response))
     trace.set_start_offset_milliseconds(delta)
     with self._lock:
       self.traces.append(trace)
@@ -352,6 +415,11 @@ class Recorder(object):
     t0 = time.time()
     with self._lock:
       num_pending = len(self.pending)
+
+
+      for index in self.deferred.keys():
+        self.complete_deferred_trace(index, self.traces[index], None,
+                                     force=True)
     if num_pending:
       logging.warn('Found %d RPC request(s) without matching response '
                    '(presumably due to timeouts or other errors)',
@@ -362,6 +430,11 @@ class Recorder(object):
     except Exception:
       logging.exception('Recorder.save() failed')
       return
+    if config.ROLLUP_ENABLED:
+      try:
+        self.save_rollup()
+      except Exception:
+        logging.exception('Recorder.save_rollup() failed')
     t1 = time.time()
     link = 'http://%s%s/details?time=%s' % (
       self.env.get('HTTP_HOST', ''),
@@ -387,6 +460,23 @@ class Recorder(object):
       logging.warn('Memcache set_multi() error: %s', errors)
     return key, len(part), len(full)
 
+  def save_rollup(self):
+    """Add this request's latencies to the long-horizon rollups.
+
+    The rollups are kept in memory and merged into the datastore at most
+    once every config.ROLLUP_FLUSH_SECONDS; see rollup.py.
+    """
+    key = config.extract_key(self.get_summary_proto())
+    duration = int((self.end_timestamp - self.start_timestamp) * 1000)
+    with self._lock:
+      rpc_durations = [(trace.service_call_name(),
+                        trace.duration_milliseconds())
+                       for trace in self.traces
+                       if trace.has_duration_milliseconds()]
+    store = get_rollup_store()
+    store.add_request(self.start_timestamp, key, duration, rpc_durations)
+    store.maybe_flush()
+
   def get_both_protos_encoded(self):
     """Return a string representing all recorded info an encoded protobuf.
 
@@ -591,6 +681,67 @@ class Recorder(object):
         break
       frame = frame.f_back
 
+  def get_raw_call_stack(self):
+    """Extract the current call stack without formatting it.
+
+    This is the cheap counterpart of get_call_stack() used when
+    config.SLOW_RPC_MILLISECONDS is set: it applies the same limits, but
+    only collects (code, lineno) pairs, which complete_deferred_trace() turns
+    into stack frames once the RPC turns out to be slow.
+
+    Returns:
+      A list of (code object, line number) tuples, innermost first.
+    """
+    raw_stack = []
+    max_stack = config.MAX_STACK
+    code_summaries = self.code_summaries
+    frame = sys._getframe(0)
+    while frame is not None and len(raw_stack) < max_stack:
+      code = frame.f_code
+      lineno = frame.f_lineno
+      summary = code_summaries.get((code, lineno))
+      if summary is None:
+        summary = self.get_code_summary(code, lineno)
+      kind = summary[2]
+      if kind == FRAME_BOTTOM:
+        break
+      if kind == FRAME_KEEP:
+        raw_stack.append((code, lineno))
+      frame = frame.f_back
+    return raw_stack
+
+  def complete_deferred_trace(self, index, trace, response, force=False):
+    """Fill in the details deferred by record_rpc_request(), if any.
+
+    When config.SLOW_RPC_MILLISECONDS is set, the request summary, the
+    response summary and the call stack are only filled in for RPCs that
+    took at least that long; local variables are never recorded.  The
+    caller must hold self._lock.
+
+    Args:
+      index: The index of the trace in self.traces.
+      trace: An IndividualRpcStatsProto instance that will be updated.
+      response: The response object, or None if there was no response.
+      force: If True, fill in the deferred details regardless of the
+        RPC's duration.
+    """
+    deferred = self.deferred.pop(index, None)
+    if deferred is None:
+      return
+    if (not force and
+        trace.duration_milliseconds() < config.SLOW_RPC_MILLISECONDS):
+      return
+    raw_stack, request = deferred
+    trace.set_request_data_summary(format_value(request))
+    if response is not None:
+      trace.set_response_data_summary(format_value(response))
+    for code, lineno in raw_stack:
+      filename, funcname, _ = self.get_code_summary(code, lineno)
+      entry = trace.add_call_stack()
+      entry.set_class_or_file_name(filename)
+      entry.set_line_number(lineno)
+      entry.set_function_name(funcname)
+
   sys_path_entries = None
 
   @classmethod
@@ -603,35 +754,70 @@ class Recorder(object):
     cls.sys_path_entries = sorted(enumerate(sys.path),
                                   key=lambda x: (-len(x[1]), x[0]))
 
-  def get_frame_summary(self, frame, trace):
-    """Return a frame summary.
+  code_summaries = {}
+
+  @classmethod
+  def get_code_summary(cls, code, lineno):
+    """Return the summary of a code object at a given line.
+
+    Summaries are cached in the class variable code_summaries, which is
+    emptied when it grows past MAX_CODE_SUMMARIES entries.
 
     Args:
-      frame: A Python stack frame object.
-      trace: An IndividualRpcStatsProto instance that will be updated.
+      code: A Python code object.
+      lineno: The line number being executed in that code object.
 
     Returns:
-      False if this stack frame matches config.RE_STACK_BOTTOM.
-      True otherwise.
+      A tuple (filename, funcname, kind), where filename is relative to
+      the matching sys.path entry and kind is FRAME_BOTTOM if the frame
+      matches config.RE_STACK_BOTTOM, FRAME_SKIP if it matches
+      config.RE_STACK_SKIP, and FRAME_KEEP otherwise.
     """
-    if self.sys_path_entries is None:
-      self.init_sys_path_entries()
-    filename = frame.f_code.co_filename
+    summary = cls.code_summaries.get((code, lineno))
+    if summary is not None:
+      return summary
+    if cls.sys_path_entries is None:
+      cls.init_sys_path_entries()
+    filename = code.co_filename
 
     if filename and not (filename.startswith('<') and filename.endswith('>')):
-      for i, entry in self.sys_path_entries:
+      for i, entry in cls.sys_path_entries:
         if filename.startswith(entry):
           filename = '<path[%s]>' % i + filename[len(entry):]
           break
       else:
         logging.info('No prefix for %s', filename)
-    funcname = frame.f_code.co_name
-    lineno = frame.f_lineno
+    funcname = code.co_name
 
     code_key = '%s:%s:%s' % (filename, funcname, lineno)
     if re.search(config.RE_STACK_BOTTOM, code_key):
+      kind = FRAME_BOTTOM
+    elif re.search(config.RE_STACK_SKIP, code_key):
+      kind = FRAME_SKIP
+    else:
+      kind = FRAME_KEEP
+    summary = (filename, funcname, kind)
+    if len(cls.code_summaries) >= MAX_CODE_SUMMARIES:
+      cls.code_summaries.clear()
+    cls.code_summaries[(code, lineno)] = summary
+    return summary
+
+  def get_frame_summary(self, frame, trace):
+    """Return a frame summary.
+
+    Args:
+      frame: A Python stack frame object.
+      trace: An IndividualRpcStatsProto instance that will be updated.
+
+    Returns:
+      False if this stack frame matches config.RE_STACK_BOTTOM.
+      True otherwise.
+    """
+    lineno = frame.f_lineno
+    filename, funcname, kind = self.get_code_summary(frame.f_code, lineno)
+    if kind == FRAME_BOTTOM:
       return False
-    if re.search(config.RE_STACK_SKIP, code_key):
+    if kind == FRAME_SKIP:
       return True
     entry = trace.add_call_stack()
     entry.set_class_or_file_name(filename)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+
+"""Long-horizon latency rollups for appstats.
+
+The per-request records kept in memcache by recording.py are overwritten
+within seconds under real traffic.  This module instead keeps latency
+histograms per path and per RPC, merged into fixed-size time buckets:
+
+- Histogram: request or RPC counts over a fixed set of logarithmic
+  latency buckets, so merging is element-wise addition and percentiles
+  can be read off the cumulative counts.
+- Rollup: the histograms of one time bucket, keyed by path key and by
+  'service.call' name, with a cap on the number of distinct keys.
+- RollupStore: accumulates rollups in memory and periodically merges
+  them into datastore entities that form a ring of time buckets, so
+  both memory and storage stay constant however long the app runs.
+"""
+
+
+import bisect
+import cPickle
+import logging
+import random
+import threading
+import time
+import zlib
+
+from google.appengine.api import datastore
+from google.appengine.api import datastore_errors
+from google.appengine.api import datastore_types
+
+
+
+
+LATENCY_BOUNDS = tuple(int(round(1.25 ** i)) for i in xrange(7, 60))
+
+
+OTHER_KEY = '(other)'
+
+
+class Histogram(object):
+  """Counts of latencies over the buckets bounded by LATENCY_BOUNDS.
+
+  Bucket i counts latencies up to LATENCY_BOUNDS[i] milliseconds; the
+  last bucket counts everything above LATENCY_BOUNDS[-1].
+  """
+
+  def __init__(self, counts=None, total_milliseconds=0):
+    """Constructor.
+
+    Args:
+      counts: Optional list of bucket counts, one more than there are
+        LATENCY_BOUNDS.
+      total_milliseconds: The sum of all the added latencies.
+    """
+    if counts is None:
+      counts = [0] * (len(LATENCY_BOUNDS) + 1)
+    self.counts = counts
+    self.total_milliseconds = total_milliseconds
+
+  def add(self, milliseconds, count=1):
+    """Add count occurrences of a latency."""
+    self.counts[bisect.bisect_left(LATENCY_BOUNDS, milliseconds)] += count
+    self.total_milliseconds += milliseconds * count
+
+  def merge(self, other):
+    """Add the counts of another Histogram to this one."""
+    counts = self.counts
+    for i, count in enumerate(other.counts):
+      if count:
+        counts[i] += count
+    self.total_milliseconds += other.total_milliseconds
+
+  def count(self):
+    """Return the number of latencies added."""
+    return sum(self.counts)
+
+  def mean(self):
+    """Return the mean latency in milliseconds, or 0 if empty."""
+    count = self.count()
+    if not count:
+      return 0
+    return self.total_milliseconds / count
+
+  def percentile(self, percent):
+    """Return an upper bound for a percentile of the latencies.
+
+    Args:
+      percent: A number between 0 and 100.
+
+    Returns:
+      The upper bound in milliseconds of the bucket holding the given
+      percentile, None if that is the unbounded last bucket, or 0 if the
+      histogram is empty.
+    """
+    count = self.count()
+    if not count:
+      return 0
+    rank = max(1, percent * count / 100.0)
+    seen = 0
+    for i, bucket_count in enumerate(self.counts):
+      seen += bucket_count
+      if seen >= rank:
+        break
+    if i < len(LATENCY_BOUNDS):
+      return LATENCY_BOUNDS[i]
+    return None
+
+
+class Rollup(object):
+  """Latency histograms per path key and per RPC for one time bucket."""
+
+  def __init__(self, start, max_keys):
+    """Constructor.
+
+    Args:
+      start: The start of the time bucket, in seconds since the epoch.
+      max_keys: The maximum number of distinct path keys, and of distinct
+        RPC names, to keep; further ones are counted under OTHER_KEY.
+    """
+    self.start = start
+    self.max_keys = max_keys
+    self.paths = {}
+    self.rpcs = {}
+
+  def __get_histogram(self, histograms, key):
+    histogram = histograms.get(key)
+    if histogram is None:
+      if len(histograms) >= self.max_keys and key != OTHER_KEY:
+        return self.__get_histogram(histograms, OTHER_KEY)
+      histogram = histograms[key] = Histogram()
+    return histogram
+
+  def add_request(self, path_key, duration, rpc_durations):
+    """Add the latencies of one request.
+
+    Args:
+      path_key: The path key of the request, see config.extract_key().
+      duration: The duration of the request in milliseconds.
+      rpc_durations: A list of ('service.call', milliseconds) tuples.
+    """
+    self.__get_histogram(self.paths, path_key).add(duration)
+    for name, rpc_duration in rpc_durations:
+      self.__get_histogram(self.rpcs, name).add(rpc_duration)
+
+  def merge(self, other):
+    """Add the histograms of another Rollup to this one."""
+    for mine, theirs in ((self.paths, other.paths), (self.rpcs, other.rpcs)):
+      for key, histogram in theirs.iteritems():
+        self.__get_histogram(mine, key).merge(histogram)
+
+  def encode(self):
+    """Return this Rollup's histograms as a compressed string."""
+    data = {}
+    for name, histograms in (('paths', self.paths), ('rpcs', self.rpcs)):
+      data[name] = dict((key, (h.counts, h.total_milliseconds))
+                        for key, h in histograms.iteritems())
+    return zlib.compress(cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL))
+
+  @classmethod
+  def decode(cls, start, max_keys, encoded):
+    """Create a Rollup from a string returned by encode()."""
+    rollup = cls(start, max_keys)
+    data = cPickle.loads(zlib.decompress(encoded))
+    for name, histograms in (('paths', rollup.paths), ('rpcs', rollup.rpcs)):
+      for key, (counts, total_milliseconds) in data[name].iteritems():
+        if len(counts) == len(LATENCY_BOUNDS) + 1:
+          histograms[key] = Histogram(counts, total_milliseconds)
+    return rollup
+
+
+class RollupStore(object):
+  """Accumulates Rollups and persists them in a ring of datastore entities.
+
+  Time bucket number n (the one starting at n * bucket_seconds) is stored
+  in the entities named '<n % num_buckets>:<shard>', so storage is bounded
+  by num_buckets * num_shards entities; an entity holding an older bucket
+  is overwritten instead of merged into.  Spreading flushes over several
+  shards keeps instances from contending on one entity.
+  """
+
+  def __init__(self, kind, namespace='', bucket_seconds=300, num_buckets=288,
+               num_shards=4, max_keys=100, flush_seconds=60):
+    """Constructor.
+
+    Args:
+      kind: The datastore kind of the rollup entities.
+      namespace: The datastore namespace of the rollup entities.
+      bucket_seconds: The length of a time bucket.
+      num_buckets: The number of time buckets kept.
+      num_shards: The number of entities per time bucket.
+      max_keys: The maximum number of path keys and of RPC names per bucket.
+      flush_seconds: The minimum time between flushes to the datastore.
+    """
+    self.kind = kind
+    self.namespace = namespace
+    self.bucket_seconds = bucket_seconds
+    self.num_buckets = num_buckets
+    self.num_shards = num_shards
+    self.max_keys = max_keys
+    self.flush_seconds = flush_seconds
+    self._lock = threading.Lock()
+    self._pending = {}
+    self._last_flush = time.time()
+
+  def bucket_start(self, timestamp):
+    """Return the start of the time bucket containing a timestamp."""
+    return int(timestamp) // self.bucket_seconds * self.bucket_seconds
+
+  def make_key(self, start, shard):
+    """Return the datastore Key of a shard of a time bucket."""
+    slot = start // self.bucket_seconds % self.num_buckets
+    return datastore.Key.from_path(self.kind, '%d:%d' % (slot, shard),
+                                   namespace=self.namespace)
+
+  def add_request(self, timestamp, path_key, duration, rpc_durations):
+    """Add the latencies of one request; see Rollup.add_request().
+
+    Args:
+      timestamp: The start of the request, in seconds since the epoch.
+      path_key: The path key of the request.
+      duration: The duration of the request in milliseconds.
+      rpc_durations: A list of ('service.call', milliseconds) tuples.
+    """
+    start = self.bucket_start(timestamp)
+    self._lock.acquire()
+    try:
+      rollup = self._pending.get(start)
+      if rollup is None:
+        rollup = self._pending[start] = Rollup(start, self.max_keys)
+      rollup.add_request(path_key, duration, rpc_durations)
+    finally:
+      self._lock.release()
+
+  def maybe_flush(self):
+    """Flush if flush_seconds have passed since the last flush."""
+    if time.time() - self._last_flush >= self.flush_seconds:
+      self.flush()
+
+  def flush(self):
+    """Merge the accumulated Rollups into their datastore entities.
+
+    Rollups that cannot be written are dropped rather than retried, so
+    that a datastore outage cannot make memory use grow.
+    """
+    self._lock.acquire()
+    try:
+      pending = self._pending
+      self._pending = {}
+      self._last_flush = time.time()
+    finally:
+      self._lock.release()
+    oldest = self.bucket_start(time.time()) - (
+        (self.num_buckets - 1) * self.bucket_seconds)
+    for start, rollup in sorted(pending.iteritems()):
+      if start < oldest:
+        continue
+      key = self.make_key(start, random.randrange(self.num_shards))
+      try:
+        datastore.RunInTransaction(self._merge_entity, key, rollup)
+      except (datastore_errors.Error, AssertionError), err:
+        logging.warn('Failed to save appstats rollup %s: %s', start, err)
+
+  def _merge_entity(self, key, rollup):
+    """Transaction function merging a Rollup into its entity."""
+    try:
+      entity = datastore.Get(key)
+    except datastore_errors.EntityNotFoundError:
+      entity = None
+    if entity is not None and entity.get('start') == rollup.start:
+      stored = Rollup.decode(rollup.start, self.max_keys, entity['data'])
+      stored.merge(rollup)
+      rollup = stored
+    entity = datastore.Entity(self.kind, name=key.name(),
+                              namespace=self.namespace)
+    entity['start'] = rollup.start
+    entity['data'] = datastore_types.Blob(rollup.encode())
+    datastore.Put(entity)
+
+  def load(self, start, end):
+    """Return a Rollup merging the time buckets overlapping [start, end).
+
+    Args:
+      start: The start of the time range, in seconds since the epoch.
+      end: The end of the time range, in seconds since the epoch.
+
+    Returns:
+      A Rollup whose start is the start of the first bucket loaded.  It
+      includes the requests not yet flushed from this instance.
+    """
+    first = max(self.bucket_start(start), self.bucket_start(end - 1) -
+                (self.num_buckets - 1) * self.bucket_seconds)
+    starts = range(first, self.bucket_start(end - 1) + 1, self.bucket_seconds)
+    result = Rollup(first, self.max_keys)
+    keys = [self.make_key(bucket, shard)
+            for bucket in starts for shard in xrange(self.num_shards)]
+    wanted = set(starts)
+    for entity in datastore.Get(keys):
+      if entity is not None and entity.get('start') in wanted:
+        result.merge(Rollup.decode(entity['start'], self.max_keys,
+                                   entity['data']))
+    self._lock.acquire()
+    try:
+      for bucket, rollup in self._pending.iteritems():
+        if bucket in wanted:
+          result.merge(rollup)
+    finally:
+      self._lock.release()
+    return result
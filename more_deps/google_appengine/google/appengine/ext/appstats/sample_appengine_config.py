@@ -144,6 +144,36 @@ appstats_stats_url = '/_ah/stats'
 
 appstats_RECORD_FRACTION = 1.0
 
+# Stack capture threshold, in milliseconds.  When None, the call stack
+# (including local variables, see MAX_LOCALS) is saved for every RPC.
+# When set to a number, only a raw stack of code locations is taken
+# when an RPC starts, and it is turned into a saved call stack only if
+# the RPC takes at least this many milliseconds (or never completes).
+# Local variables are not saved in this mode.  Combined with a
+# RECORD_FRACTION below 1.0 this keeps the recording overhead low on
+# RPC-heavy requests.
+
+appstats_SLOW_RPC_MILLISECONDS = None
+
+# Long-horizon rollups.  When ROLLUP_ENABLED is True, the latency of
+# every recorded request and RPC is also added to histograms per path
+# key and per RPC, kept in time buckets of ROLLUP_BUCKET_SECONDS.  The
+# last ROLLUP_NUM_BUCKETS buckets (a day, by default) are stored in
+# the datastore, as entities of kind ROLLUP_KIND in KEY_NAMESPACE,
+# spread over ROLLUP_SHARDS entities per bucket.  Each instance merges
+# its histograms into the datastore at most every ROLLUP_FLUSH_SECONDS.
+# At most ROLLUP_MAX_KEYS paths and RPCs are kept per bucket; the rest
+# are counted as '(other)'.  The percentiles are shown on the
+# /rollup page of the Appstats UI.
+
+appstats_ROLLUP_ENABLED = False
+appstats_ROLLUP_KIND = '_AE_Appstats_Rollup'
+appstats_ROLLUP_BUCKET_SECONDS = 300
+appstats_ROLLUP_NUM_BUCKETS = 288
+appstats_ROLLUP_SHARDS = 4
+appstats_ROLLUP_MAX_KEYS = 100
+appstats_ROLLUP_FLUSH_SECONDS = 60
+
 # List of dicts mapping env vars to regular expressions.  Each dict
 # specifies a set of filters to be 'and'ed together.  The keys are
 # environment variables, the values are *match* regular expressions.
@@ -47,6 +47,7 @@ from google.appengine.ext.webapp import _template
 from google.appengine.ext.webapp import util
 
 from google.appengine.ext.appstats import recording
+from google.appengine.ext.appstats import rollup
 
 DEBUG = recording.config.DEBUG
 
@@ -205,6 +206,50 @@ class DetailsHandler(webapp.RequestHandler):
     self.response.out.write(render('details.html', data))
 
 
+class RollupHandler(webapp.RequestHandler):
+  """Request handler for the long-horizon rollups page (/stats/rollup)."""
+
+  def get(self):
+    recording.dont_record()
+
+    if not recording.config.ROLLUP_ENABLED:
+      self.response.out.write(render('rollup.html', {'disabled': True}))
+      return
+
+    store = recording.get_rollup_store()
+    max_hours = store.num_buckets * store.bucket_seconds / 3600.0
+    try:
+      hours = float(self.request.get('hours') or 1)
+    except ValueError:
+      hours = 1
+    hours = max(0, min(hours, max_hours))
+    end = time.time()
+    merged = store.load(end - hours * 3600, end)
+
+    def percentile(histogram, percent):
+      value = histogram.percentile(percent)
+      if value is None:
+        return '>%d' % rollup.LATENCY_BOUNDS[-1]
+      return value
+
+    def rows(histograms):
+      result = []
+      for key, histogram in histograms.iteritems():
+        result.append((key, histogram.count(), histogram.mean(),
+                       percentile(histogram, 50), percentile(histogram, 90),
+                       percentile(histogram, 99)))
+      result.sort(key=lambda x: (-x[1], x[0]))
+      return result
+
+    data = {'hours': hours,
+            'max_hours': max_hours,
+            'start': merged.start,
+            'pathstats': rows(merged.paths),
+            'rpcstats': rows(merged.rpcs),
+            }
+    self.response.out.write(render('rollup.html', data))
+
+
 class FileHandler(webapp.RequestHandler):
   """Request handler for displaying any text file in the system.
 
@@ -288,6 +333,7 @@ class StaticHandler(webapp.RequestHandler):
 URLMAP = [
   ('.*/details', DetailsHandler),
   ('.*/file', FileHandler),
+  ('.*/rollup', RollupHandler),
   ('.*/static/.*', StaticHandler),
   ('.*', SummaryHandler),
   ]
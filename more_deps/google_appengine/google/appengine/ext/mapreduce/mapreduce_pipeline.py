@@ -126,12 +126,14 @@ class ShufflePipeline(base_handler.PipelineBase):
     filenames: list of file names to sort. Files have to be of records format
       defined by Files API and contain serialized file_service_pb.KeyValue
       protocol messages.
+    memory_budget: approximate number of bytes of records each sort holds in
+      memory at once, or None for the shuffler's default.
 
   Returns:
     The list of filenames as string. Resulting files have the same format as
     input and are sorted by key.
   """
-  def run(self, shards):
+  def run(self, shards, memory_budget=None):
     result = []
 
 
@@ -141,7 +143,7 @@ class ShufflePipeline(base_handler.PipelineBase):
         shuffled_shards[i].append(filename)
 
     for filenames in shuffled_shards:
-      sorted_files = yield shuffler.SortPipeline(filenames)
+      sorted_files = yield shuffler.SortPipeline(filenames, memory_budget)
       result.append(sorted_files)
     yield pipeline_common.Append(*result)
 
@@ -178,6 +180,8 @@ class MapreducePipeline(base_handler.PipelineBase):
     mapper_params: parameters to use for mapper phase.
     reducer_params: parameters to use for reduce phase.
     shards: number of shards to use as int.
+    shuffle_memory_budget: approximate number of bytes of records the shuffle
+      sorts in memory at once, or None for the shuffler's default.
 
   Returns:
     filenames from output writer.
@@ -191,13 +195,15 @@ class MapreducePipeline(base_handler.PipelineBase):
           output_writer_spec=None,
           mapper_params=None,
           reducer_params=None,
-          shards=None):
+          shards=None,
+          shuffle_memory_budget=None):
     map_pipeline = yield MapPipeline(job_name,
                                      mapper_spec,
                                      input_reader_spec,
                                      params=mapper_params,
                                      shards=shards)
-    shuffler_pipeline = yield ShufflePipeline(map_pipeline)
+    shuffler_pipeline = yield ShufflePipeline(map_pipeline,
+                                              shuffle_memory_budget)
     reducer_pipeline = yield ReducePipeline(job_name,
                                             reducer_spec,
                                             output_writer_spec,
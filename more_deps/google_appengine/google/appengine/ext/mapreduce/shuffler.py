@@ -36,7 +36,6 @@ from __future__ import with_statement
 
 
 
-import gc
 import heapq
 import logging
 import time
@@ -79,53 +78,145 @@ class _OutputFile(db.Model):
     return db.Key.from_path(cls.kind(), job_id)
 
 
-def _compare_keys(proto1, proto2):
-  """Compare two KeyValue protos by key."""
-  return cmp(proto1.key(), proto2.key())
+def _parse_key_value(binary_record):
+  """Parses a serialized KeyValue proto.
+
+  Args:
+    binary_record: serialized file_service_pb.KeyValue as string.
+
+  Returns:
+    (key, value) tuple of strings.
+  """
+  proto = file_service_pb.KeyValue()
+  proto.ParseFromString(binary_record)
+  return (proto.key(), proto.value())
+
+
+def _get_key(binary_record):
+  """Returns the key of a serialized KeyValue proto.
+
+  KeyValue.Encode() writes the key field first, so its length prefix is read
+  and the key sliced out of the record without decoding the value. Records
+  which do not start with the key are parsed in full.
+
+  Args:
+    binary_record: serialized file_service_pb.KeyValue as string.
+
+  Returns:
+    The key as string.
+  """
+  if binary_record[:1] == "\n":
+    length = 0
+    shift = 0
+    pos = 1
+    while pos < len(binary_record):
+      byte = ord(binary_record[pos])
+      pos += 1
+      length |= (byte & 0x7f) << shift
+      if not byte & 0x80:
+        if pos + length <= len(binary_record):
+          return binary_record[pos:pos + length]
+        break
+      shift += 7
+  return _parse_key_value(binary_record)[0]
 
 
 class _BatchRecordsReader(input_readers.RecordsReader):
-  """Records reader that reads in big batches."""
+  """Records reader that reads in big batches.
+
+  Each batch holds as many records as fit into the memory budget, which is
+  taken from the MEMORY_BUDGET_PARAM mapper parameter (BATCH_SIZE bytes by
+  default). Every batch is sorted and written out as a separate sorted run,
+  which _MergingReader later merges with the others.
+  """
 
   BATCH_SIZE = 1024*1024 * 3
 
+  MEMORY_BUDGET_PARAM = "memory_budget"
+
+
+
+  RECORD_OVERHEAD = 128
+
+  def __init__(self, filenames, position, memory_budget=None):
+    """Constructor.
+
+    Args:
+      filenames: list of filenames.
+      position: file position to start reading from as int.
+      memory_budget: approximate number of bytes a single batch may use.
+        Defaults to BATCH_SIZE.
+    """
+    input_readers.RecordsReader.__init__(self, filenames, position)
+    self._memory_budget = memory_budget or self.BATCH_SIZE
+
   def __iter__(self):
     records = []
     size = 0
     for record in input_readers.RecordsReader.__iter__(self):
       records.append(record)
-      size += len(record)
-      if size > self.BATCH_SIZE:
+      size += len(record) + self.RECORD_OVERHEAD
+      if size > self._memory_budget:
         yield records
         size = 0
         records = []
-        gc.collect()
     if records:
       yield records
 
+  @classmethod
+  def from_json(cls, json):
+    """Creates an instance of the InputReader for the given input shard state.
+
+    Args:
+      json: The InputReader state as a dict-like object.
+
+    Returns:
+      An instance of the InputReader configured using the values of json.
+    """
+    return cls(json["filenames"], json["position"],
+               json.get("memory_budget"))
+
+  def to_json(self):
+    """Returns an input shard state for the remaining inputs.
+
+    Returns:
+      A json-izable version of the remaining InputReader.
+    """
+    result = input_readers.RecordsReader.to_json(self)
+    result["memory_budget"] = self._memory_budget
+    return result
+
+  @classmethod
+  def split_input(cls, mapper_spec):
+    """Returns a list of input readers for the input spec.
+
+    Args:
+      mapper_spec: The MapperSpec for this InputReader.
+
+    Returns:
+      A list of InputReaders.
+    """
+    memory_budget = mapper_spec.params.get(cls.MEMORY_BUDGET_PARAM)
+    return [cls(reader._filenames, 0, memory_budget)
+            for reader in input_readers.RecordsReader.split_input(mapper_spec)]
+
 
 def _sort_records(records):
   """Map function sorting records.
 
-  Converts records to KeyValue protos, sorts them by key and writes them
-  into new blobstore file. Creates _OutputFile entity to record resulting
-  file name.
+  Sorts a batch of serialized KeyValue protos by key and writes them into new
+  blobstore file, which becomes one sorted run for _MergingReader. Creates
+  _OutputFile entity to record resulting file name.
 
   Args:
     records: list of records which are serialized KeyValue protos.
   """
   ctx = context.get()
-  l = len(records)
-  proto_records = [None] * l
-
-  logging.debug("Parsing")
-  for i in range(l):
-    proto = file_service_pb.KeyValue()
-    proto.ParseFromString(records[i])
-    proto_records[i] = proto
 
   logging.debug("Sorting")
-  proto_records.sort(cmp=_compare_keys)
+
+
+  records.sort(key=_get_key)
 
   logging.debug("Writing")
   blob_file_name = (ctx.mapreduce_spec.name + "-" +
@@ -133,8 +224,8 @@ def _sort_records(records):
   output_path = files.blobstore.create(
       _blobinfo_uploaded_filename=blob_file_name)
   with output_writers.RecordsPool(output_path, ctx=ctx) as pool:
-    for proto in proto_records:
-      pool.append(proto.Encode())
+    for binary_record in records:
+      pool.append(binary_record)
 
   logging.debug("Finalizing")
   files.finalize(output_path)
@@ -170,22 +261,27 @@ class SortPipeline(base_handler.PipelineBase):
     filenames: list of file names to sort. Files have to be of records format
     defined by Files API and contain serialized file_service_pb.KeyValue
     protocol messages.
+    memory_budget: approximate number of bytes of records to sort in memory
+      at once. Each full budget is written out as a separate sorted file.
 
   Returns:
     The list of filenames as string. Resulting files have the same format as
     input and are sorted by key.
   """
 
-  def run(self, filenames):
+  def run(self, filenames, memory_budget=None):
+    params = {
+        "files": filenames,
+        "processing_rate": 1000000,
+        }
+    if memory_budget:
+      params[_BatchRecordsReader.MEMORY_BUDGET_PARAM] = memory_budget
     mapper = yield mapper_pipeline.MapperPipeline(
         "sort",
         __name__ + "._sort_records",
         __name__ + "._BatchRecordsReader",
         None,
-        {
-            "files": filenames,
-            "processing_rate": 1000000,
-        },
+        params,
         shards=1)
 
     with pipeline.After(mapper):
@@ -196,7 +292,8 @@ class _MergingReader(input_readers.InputReader):
   """Reader which merge-reads multiple sorted KeyValue files.
 
   Reads list of lists of filenames. Each filename list constitutes one shard
-  and is merged together.
+  and is merged together with a k-way heap merge, so only one record per file
+  is held in memory.
 
   Yields (key, values) tuple.
   """
@@ -263,11 +360,9 @@ class _MergingReader(input_readers.InputReader):
           operation.counters.Increment(
               input_readers.COUNTER_IO_READ_MSEC,
               int((time.time() - start_time) * 1000))(context.get())
-        proto = file_service_pb.KeyValue()
-        proto.ParseFromString(binary_record)
+        (key, value) = _parse_key_value(binary_record)
 
-        heapq.heapreplace(readers,
-                          (proto.key(), proto.value(), index, reader))
+        heapq.heapreplace(readers, (key, value, index, reader))
       except EOFError:
         heapq.heappop(readers)
 
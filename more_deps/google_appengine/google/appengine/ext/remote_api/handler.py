@@ -67,6 +67,7 @@ import sys
 import wsgiref.handlers
 import yaml
 import hashlib
+import zlib
 
 from google.appengine.api import api_base_pb
 from google.appengine.api import apiproxy_stub
@@ -289,30 +290,68 @@ class ApiCallHandler(webapp.RequestHandler):
     self.response.out.write(yaml.dump(app_info))
 
   def post(self):
-    """Handle POST requests by executing the API call."""
+    """Handle POST requests by executing the API call.
+
+    A request with a 'batch' query parameter carries a BatchRequest, whose
+    calls are executed in order and answered with a BatchResponse. With
+    'compression=zlib' both bodies are zlib compressed.
+    """
     if not self.CheckIsAdmin():
       return
 
+    compression = self.request.get('compression')
+    if compression and compression != 'zlib':
+      self.response.set_status(400)
+      self.response.out.write('Unsupported compression %s' % compression)
+      self.response.headers['Content-Type'] = 'text/plain'
+      return
+
     self.response.headers['Content-Type'] = 'application/octet-stream'
+    body = self.request.body
+    if compression:
+      body = zlib.decompress(body)
+    if self.request.get('batch'):
+      batch_request = remote_api_pb.BatchRequest()
+      batch_request.ParseFromString(body)
+      batch_response = remote_api_pb.BatchResponse()
+      for request in batch_request.request_list():
+        batch_response.add_response().CopyFrom(self.HandleRequest(request))
+      output = batch_response.Encode()
+    else:
+      output = self.HandleRequest(body).Encode()
+    if compression:
+      output = zlib.compress(output)
+    self.response.set_status(200)
+    self.response.out.write(output)
+
+  def HandleRequest(self, request):
+    """Executes an API invocation, capturing any exception in the response.
+
+    Args:
+      request: a remote_api_pb.Request, or its encoded form.
+
+    Returns:
+      A remote_api_pb.Response.
+    """
     response = remote_api_pb.Response()
     try:
-      request = remote_api_pb.Request()
+      if isinstance(request, str):
+        encoded_request = request
+        request = remote_api_pb.Request()
 
 
 
-      request.ParseFromString(self.request.body)
+        request.ParseFromString(encoded_request)
       response_data = self.ExecuteRequest(request)
       response.set_response(response_data.Encode())
-      self.response.set_status(200)
     except Exception, e:
       logging.exception('Exception while handling %s', request)
-      self.response.set_status(200)
       response.set_exception(pickle.dumps(e))
       if isinstance(e, apiproxy_errors.ApplicationError):
         application_error = response.mutable_application_error()
         application_error.set_code(e.application_error)
         application_error.set_detail(e.error_detail)
-    self.response.out.write(response.Encode())
+    return response
 
   def ExecuteRequest(self, request):
     """Executes an API invocation and returns the response object."""
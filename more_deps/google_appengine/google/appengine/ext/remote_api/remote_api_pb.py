@@ -897,7 +897,235 @@ class TransactionRequest(ProtocolBuffer.ProtocolMessage):
   _STYLE = """"""
   _STYLE_CONTENT_TYPE = """"""
   _PROTO_DESCRIPTOR_NAME = 'apphosting.ext.remote_api.TransactionRequest'
+class BatchRequest(ProtocolBuffer.ProtocolMessage):
+
+  def __init__(self, contents=None):
+    self.request_ = []
+    if contents is not None: self.MergeFromString(contents)
+
+  def request_size(self): return len(self.request_)
+  def request_list(self): return self.request_
+
+  def request(self, i):
+    return self.request_[i]
+
+  def mutable_request(self, i):
+    return self.request_[i]
+
+  def add_request(self):
+    x = Request()
+    self.request_.append(x)
+    return x
+
+  def clear_request(self):
+    self.request_ = []
+
+  def MergeFrom(self, x):
+    assert x is not self
+    for i in xrange(x.request_size()): self.add_request().CopyFrom(x.request(i))
+
+  def Equals(self, x):
+    if x is self: return 1
+    if len(self.request_) != len(x.request_): return 0
+    for e1, e2 in zip(self.request_, x.request_):
+      if e1 != e2: return 0
+    return 1
+
+  def IsInitialized(self, debug_strs=None):
+    initialized = 1
+    for p in self.request_:
+      if not p.IsInitialized(debug_strs): initialized=0
+    return initialized
+
+  def ByteSize(self):
+    n = 0
+    n += 1 * len(self.request_)
+    for i in xrange(len(self.request_)): n += self.lengthString(self.request_[i].ByteSize())
+    return n
+
+  def ByteSizePartial(self):
+    n = 0
+    n += 1 * len(self.request_)
+    for i in xrange(len(self.request_)): n += self.lengthString(self.request_[i].ByteSizePartial())
+    return n
+
+  def Clear(self):
+    self.clear_request()
+
+  def OutputUnchecked(self, out):
+    for i in xrange(len(self.request_)):
+      out.putVarInt32(10)
+      out.putVarInt32(self.request_[i].ByteSize())
+      self.request_[i].OutputUnchecked(out)
+
+  def OutputPartial(self, out):
+    for i in xrange(len(self.request_)):
+      out.putVarInt32(10)
+      out.putVarInt32(self.request_[i].ByteSizePartial())
+      self.request_[i].OutputPartial(out)
+
+  def TryMerge(self, d):
+    while d.avail() > 0:
+      tt = d.getVarInt32()
+      if tt == 10:
+        length = d.getVarInt32()
+        tmp = ProtocolBuffer.Decoder(d.buffer(), d.pos(), d.pos() + length)
+        d.skip(length)
+        self.add_request().TryMerge(tmp)
+        continue
+
+
+      if (tt == 0): raise ProtocolBuffer.ProtocolBufferDecodeError
+      d.skipData(tt)
+
+
+  def __str__(self, prefix="", printElemNumber=0):
+    res=""
+    cnt=0
+    for e in self.request_:
+      elm=""
+      if printElemNumber: elm="(%d)" % cnt
+      res+=prefix+("request%s <\n" % elm)
+      res+=e.__str__(prefix + "  ", printElemNumber)
+      res+=prefix+">\n"
+      cnt+=1
+    return res
+
+
+  def _BuildTagLookupTable(sparse, maxtag, default=None):
+    return tuple([sparse.get(i, default) for i in xrange(0, 1+maxtag)])
+
+  krequest = 1
+
+  _TEXT = _BuildTagLookupTable({
+    0: "ErrorCode",
+    1: "request",
+  }, 1)
+
+  _TYPES = _BuildTagLookupTable({
+    0: ProtocolBuffer.Encoder.NUMERIC,
+    1: ProtocolBuffer.Encoder.STRING,
+  }, 1, ProtocolBuffer.Encoder.MAX_TYPE)
+
+
+  _STYLE = """"""
+  _STYLE_CONTENT_TYPE = """"""
+  _PROTO_DESCRIPTOR_NAME = 'apphosting.ext.remote_api.BatchRequest'
+class BatchResponse(ProtocolBuffer.ProtocolMessage):
+
+  def __init__(self, contents=None):
+    self.response_ = []
+    if contents is not None: self.MergeFromString(contents)
+
+  def response_size(self): return len(self.response_)
+  def response_list(self): return self.response_
+
+  def response(self, i):
+    return self.response_[i]
+
+  def mutable_response(self, i):
+    return self.response_[i]
+
+  def add_response(self):
+    x = Response()
+    self.response_.append(x)
+    return x
+
+  def clear_response(self):
+    self.response_ = []
+
+  def MergeFrom(self, x):
+    assert x is not self
+    for i in xrange(x.response_size()): self.add_response().CopyFrom(x.response(i))
+
+  def Equals(self, x):
+    if x is self: return 1
+    if len(self.response_) != len(x.response_): return 0
+    for e1, e2 in zip(self.response_, x.response_):
+      if e1 != e2: return 0
+    return 1
+
+  def IsInitialized(self, debug_strs=None):
+    initialized = 1
+    for p in self.response_:
+      if not p.IsInitialized(debug_strs): initialized=0
+    return initialized
+
+  def ByteSize(self):
+    n = 0
+    n += 1 * len(self.response_)
+    for i in xrange(len(self.response_)): n += self.lengthString(self.response_[i].ByteSize())
+    return n
+
+  def ByteSizePartial(self):
+    n = 0
+    n += 1 * len(self.response_)
+    for i in xrange(len(self.response_)): n += self.lengthString(self.response_[i].ByteSizePartial())
+    return n
+
+  def Clear(self):
+    self.clear_response()
+
+  def OutputUnchecked(self, out):
+    for i in xrange(len(self.response_)):
+      out.putVarInt32(10)
+      out.putVarInt32(self.response_[i].ByteSize())
+      self.response_[i].OutputUnchecked(out)
+
+  def OutputPartial(self, out):
+    for i in xrange(len(self.response_)):
+      out.putVarInt32(10)
+      out.putVarInt32(self.response_[i].ByteSizePartial())
+      self.response_[i].OutputPartial(out)
+
+  def TryMerge(self, d):
+    while d.avail() > 0:
+      tt = d.getVarInt32()
+      if tt == 10:
+        length = d.getVarInt32()
+        tmp = ProtocolBuffer.Decoder(d.buffer(), d.pos(), d.pos() + length)
+        d.skip(length)
+        self.add_response().TryMerge(tmp)
+        continue
+
+
+      if (tt == 0): raise ProtocolBuffer.ProtocolBufferDecodeError
+      d.skipData(tt)
+
+
+  def __str__(self, prefix="", printElemNumber=0):
+    res=""
+    cnt=0
+    for e in self.response_:
+      elm=""
+      if printElemNumber: elm="(%d)" % cnt
+      res+=prefix+("response%s <\n" % elm)
+      res+=e.__str__(prefix + "  ", printElemNumber)
+      res+=prefix+">\n"
+      cnt+=1
+    return res
+
+
+  def _BuildTagLookupTable(sparse, maxtag, default=None):
+    return tuple([sparse.get(i, default) for i in xrange(0, 1+maxtag)])
+
+  kresponse = 1
+
+  _TEXT = _BuildTagLookupTable({
+    0: "ErrorCode",
+    1: "response",
+  }, 1)
+
+  _TYPES = _BuildTagLookupTable({
+    0: ProtocolBuffer.Encoder.NUMERIC,
+    1: ProtocolBuffer.Encoder.STRING,
+  }, 1, ProtocolBuffer.Encoder.MAX_TYPE)
+
+
+  _STYLE = """"""
+  _STYLE_CONTENT_TYPE = """"""
+  _PROTO_DESCRIPTOR_NAME = 'apphosting.ext.remote_api.BatchResponse'
 if _extension_runtime:
   pass
 
-__all__ = ['Request','ApplicationError','Response','TransactionRequest','TransactionRequest_Precondition']
+__all__ = ['Request','ApplicationError','Response','TransactionRequest','TransactionRequest_Precondition','BatchRequest','BatchResponse']
@@ -74,6 +74,7 @@ import thread
 import threading
 import yaml
 import hashlib
+import zlib
 
 from google.appengine.api import apiproxy_rpc
 from google.appengine.api import apiproxy_stub_map
@@ -140,25 +141,62 @@ class TransactionData(object):
     self.entities = {}
 
 
+class _PendingCall(object):
+  """A pipelined API call waiting to be sent, or to have its result taken."""
+
+  def __init__(self, request, request_pb):
+    self.request = request
+    self.request_pb = request_pb
+    self.response_pb = None
+    self.exc_info = None
+    self.done = threading.Event()
+
+
+class _PipelinedRPC(apiproxy_rpc.RPC):
+  """An RPC that is queued on its RemoteStub when it is made.
+
+  Queued calls travel to the server together, in one BatchRequest, as soon as
+  any of them is waited on.
+  """
+
+  def _MakeCallImpl(self):
+    self.stub._QueueCall(self.package, self.call, self.request)
+    super(_PipelinedRPC, self)._MakeCallImpl()
+
+
 class RemoteStub(object):
   """A stub for calling services on a remote server over HTTP.
 
   You can use this to stub out any service that the remote server supports.
+
+  When max_batch_size is greater than 1, the RPCs returned by CreateRPC are
+  pipelined: every outstanding call is sent in a single round trip, in batches
+  of up to max_batch_size calls, when the first of them is waited on. This
+  requires a remote_api handler that understands BatchRequest.
   """
 
-  def __init__(self, server, path, _test_stub_map=None):
+  def __init__(self, server, path, _test_stub_map=None, max_batch_size=1,
+               compress=False):
     """Constructs a new RemoteStub that communicates with the specified server.
 
     Args:
       server: An instance of a subclass of
         google.appengine.tools.appengine_rpc.AbstractRpcServer.
       path: The path to the handler this stub should send requests to.
+      max_batch_size: The maximum number of pipelined calls to send in one
+        request. 1 sends every call on its own.
+      compress: If True, batched requests and responses are zlib compressed.
     """
 
 
     self._server = server
     self._path = path
     self._test_stub_map = _test_stub_map
+    self._max_batch_size = max_batch_size
+    self._compress = compress
+    self.__pending_lock = threading.Lock()
+    self.__pending = []
+    self.__pending_calls = {}
 
   def _PreHookHandler(self, service, call, request, response):
     pass
@@ -178,16 +216,98 @@ class RemoteStub(object):
     finally:
       self._PostHookHandler(service, call, request, response)
 
-  def _MakeRealSyncCall(self, service, call, request, response):
+  def _CanPipeline(self, service, call, request):
+    """Returns True if the call can be sent ahead of being waited on.
+
+    Calls that this stub handles locally, in whole or in part, must run when
+    they are waited on instead.
+    """
+    return not (self._test_stub_map and self._test_stub_map.GetStub(service))
+
+  def _QueueCall(self, service, call, request):
+    """Queues a call made through a pipelined RPC, if it can be pipelined."""
+    if self._max_batch_size <= 1 or not self._CanPipeline(service, call,
+                                                          request):
+      return
+    pending_call = _PendingCall(request,
+                                self.__MakeRequestPb(service, call, request))
+    self.__pending_lock.acquire()
+    try:
+      self.__pending.append(pending_call)
+      self.__pending_calls[id(request)] = pending_call
+    finally:
+      self.__pending_lock.release()
+
+  def __MakeRequestPb(self, service, call, request):
     request_pb = remote_api_pb.Request()
     request_pb.set_service_name(service)
     request_pb.set_method(call)
     request_pb.set_request(request.Encode())
+    return request_pb
+
+  def __SendPending(self):
+    """Sends every queued call, in batches of at most max_batch_size."""
+    self.__pending_lock.acquire()
+    try:
+      pending = self.__pending
+      self.__pending = []
+    finally:
+      self.__pending_lock.release()
 
+    for i in xrange(0, len(pending), self._max_batch_size):
+      batch = pending[i:i + self._max_batch_size]
+      try:
+        if len(batch) == 1:
+          batch[0].response_pb = self.__Send(batch[0].request_pb)
+        else:
+          batch_request = remote_api_pb.BatchRequest()
+          for pending_call in batch:
+            batch_request.add_request().CopyFrom(pending_call.request_pb)
+          batch_response = self.__SendBatch(batch_request)
+          assert batch_response.response_size() == len(batch)
+          for pending_call, response_pb in zip(batch,
+                                               batch_response.response_list()):
+            pending_call.response_pb = response_pb
+      except Exception:
+        exc_info = sys.exc_info()
+        for pending_call in batch:
+          pending_call.exc_info = exc_info
+      for pending_call in batch:
+        pending_call.done.set()
+
+  def __Send(self, request_pb):
     response_pb = remote_api_pb.Response()
-    encoded_request = request_pb.Encode()
-    encoded_response = self._server.Send(self._path, encoded_request)
+    encoded_response = self._server.Send(self._path, request_pb.Encode())
     response_pb.ParseFromString(encoded_response)
+    return response_pb
+
+  def __SendBatch(self, batch_request):
+    payload = batch_request.Encode()
+    url_args = {'batch': '1'}
+    if self._compress:
+      payload = zlib.compress(payload)
+      url_args['compression'] = 'zlib'
+    encoded_response = self._server.Send(self._path, payload, **url_args)
+    if self._compress:
+      encoded_response = zlib.decompress(encoded_response)
+    return remote_api_pb.BatchResponse(encoded_response)
+
+  def _MakeRealSyncCall(self, service, call, request, response):
+    self.__pending_lock.acquire()
+    try:
+      pending_call = self.__pending_calls.pop(id(request), None)
+    finally:
+      self.__pending_lock.release()
+
+    if pending_call is None:
+      response_pb = self.__Send(self.__MakeRequestPb(service, call, request))
+    else:
+      self.__SendPending()
+      pending_call.done.wait()
+      if pending_call.exc_info:
+        exc_class, exc, tb = pending_call.exc_info
+        raise exc_class, exc, tb
+      response_pb = pending_call.response_pb
 
     if response_pb.has_application_error():
       error_pb = response_pb.application_error()
@@ -202,6 +322,8 @@ class RemoteStub(object):
       response.ParseFromString(response_pb.response())
 
   def CreateRPC(self):
+    if self._max_batch_size > 1:
+      return _PipelinedRPC(stub=self)
     return apiproxy_rpc.RPC(stub=self)
 
 
@@ -214,7 +336,7 @@ class RemoteDatastoreStub(RemoteStub):
   """
 
   def __init__(self, server, path, default_result_count=20,
-               _test_stub_map=None):
+               _test_stub_map=None, max_batch_size=1, compress=False):
     """Constructor.
 
     Args:
@@ -223,8 +345,12 @@ class RemoteDatastoreStub(RemoteStub):
       default_result_count: The number of items to fetch, by default, in a
         datastore Query or Next operation. This affects the batch size of
         query iterators.
+      max_batch_size: The maximum number of pipelined calls to send in one
+        request.
+      compress: If True, batched requests and responses are zlib compressed.
     """
-    super(RemoteDatastoreStub, self).__init__(server, path, _test_stub_map)
+    super(RemoteDatastoreStub, self).__init__(server, path, _test_stub_map,
+                                              max_batch_size, compress)
     self.default_result_count = default_result_count
     self.__queries = {}
     self.__transactions = {}
@@ -252,6 +378,22 @@ class RemoteDatastoreStub(RemoteStub):
 
     assert response.IsInitialized(explanation), explanation
 
+  def _CanPipeline(self, service, call, request):
+    """Only non-transactional Get, Put and Delete calls can be pipelined.
+
+    Every other call has a local handler that must run when it is waited on.
+    """
+    if call == 'Get':
+      if request.has_transaction() or request.key_size() == 0:
+        return False
+    elif call in ('Put', 'Delete'):
+      if request.has_transaction():
+        return False
+    elif hasattr(self, '_Dynamic_' + call):
+      return False
+    return super(RemoteDatastoreStub, self)._CanPipeline(service, call,
+                                                         request)
+
   def _Dynamic_RunQuery(self, query, query_result, cursor_id = None):
     if query.has_transaction():
       raise apiproxy_errors.ApplicationError(
@@ -510,7 +652,8 @@ def GetRemoteAppIdFromServer(server, path, remote_token=None):
 
 
 def ConfigureRemoteApiFromServer(server, path, app_id, services=None,
-                                 default_auth_domain=None):
+                                 default_auth_domain=None, max_batch_size=1,
+                                 compress=False):
   """Does necessary setup to allow easy remote access to App Engine APIs.
 
   Args:
@@ -521,6 +664,9 @@ def ConfigureRemoteApiFromServer(server, path, app_id, services=None,
     services: A list of services to set up stubs for. If specified, only those
       services are configured; by default all supported services are configured.
     default_auth_domain: The authentication domain to use by default.
+    max_batch_size: The maximum number of outstanding asynchronous calls to
+      send to the server in one request. 1 disables pipelining.
+    compress: If True, batched requests and responses are zlib compressed.
 
   Raises:
     urllib2.HTTPError: if app_id is not provided and there is an error while
@@ -541,9 +687,12 @@ def ConfigureRemoteApiFromServer(server, path, app_id, services=None,
   apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
   if 'datastore_v3' in services:
     services.remove('datastore_v3')
-    datastore_stub = RemoteDatastoreStub(server, path)
+    datastore_stub = RemoteDatastoreStub(server, path,
+                                         max_batch_size=max_batch_size,
+                                         compress=compress)
     apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', datastore_stub)
-  stub = RemoteStub(server, path)
+  stub = RemoteStub(server, path, max_batch_size=max_batch_size,
+                    compress=compress)
   for service in services:
     apiproxy_stub_map.apiproxy.RegisterStub(service, stub)
 
@@ -594,7 +743,9 @@ def ConfigureRemoteApi(app_id,
                        secure=False,
                        services=None,
                        default_auth_domain=None,
-                       save_cookies=False):
+                       save_cookies=False,
+                       max_batch_size=1,
+                       compress=False):
   """Does necessary setup to allow easy remote access to App Engine APIs.
 
   Either servername must be provided or app_id must not be None.  If app_id
@@ -624,6 +775,9 @@ def ConfigureRemoteApi(app_id,
       services are configured; by default all supported services are configured.
     default_auth_domain: The authentication domain to use by default.
     save_cookies: Forwarded to rpc_server_factory function.
+    max_batch_size: The maximum number of outstanding asynchronous calls to
+      send to the server in one request. 1 disables pipelining.
+    compress: If True, batched requests and responses are zlib compressed.
 
   Returns:
     server, the server created by rpc_server_factory, which may be useful for
@@ -645,7 +799,7 @@ def ConfigureRemoteApi(app_id,
     app_id = GetRemoteAppIdFromServer(server, path, rtok)
 
   ConfigureRemoteApiFromServer(server, path, app_id, services,
-                               default_auth_domain)
+                               default_auth_domain, max_batch_size, compress)
   return server
 
 
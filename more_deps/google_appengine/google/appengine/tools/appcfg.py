@@ -41,10 +41,12 @@ import logging
 import mimetypes
 import optparse
 import os
+import Queue
 import random
 import re
 import sys
 import tempfile
+import threading
 import time
 import urllib
 import urllib2
@@ -86,6 +88,15 @@ UPDATE_CHECK_TIMEOUT = 3
 NAG_FILE = '.appcfg_nag'
 
 
+HASH_CACHE_FILE = '.appcfg_hashes'
+
+
+HASH_CACHE_MIN_AGE = 2
+
+
+CHECKPOINT_DIR = '.appcfg_checkpoints'
+
+
 MAX_LOG_LEVEL = 4
 
 
@@ -1308,7 +1319,7 @@ def FindSentinel(filename, blocksize=2**16):
 class UploadBatcher(object):
   """Helper to batch file uploads."""
 
-  def __init__(self, what, rpcserver, params):
+  def __init__(self, what, rpcserver, params, sent_callback=None):
     """Constructor.
 
     Args:
@@ -1316,11 +1327,14 @@ class UploadBatcher(object):
         objects this batcher uploads.  Used in messages and URLs.
       rpcserver: The RPC server.
       params: A dictionary object containing URL params to add to HTTP requests.
+      sent_callback: If given, called with the list of keys of the objects
+        each request has delivered, once the server has accepted it.
     """
     assert what in ('file', 'blob', 'errorblob'), repr(what)
     self.what = what
     self.params = params
     self.rpcserver = rpcserver
+    self.sent_callback = sent_callback
     self.single_url = '/api/appversion/add' + what
     self.batch_url = self.single_url + 's'
     self.batching = True
@@ -1337,7 +1351,7 @@ class UploadBatcher(object):
     """
     boundary = 'boundary'
     parts = []
-    for path, payload, mime_type in self.batch:
+    for path, payload, mime_type, unused_key in self.batch:
       while boundary in payload:
         boundary += '%04x' % random.randint(0, 0xffff)
         assert len(boundary) < 80, 'Unexpected error, please try again.'
@@ -1366,10 +1380,12 @@ class UploadBatcher(object):
                         payload=payload,
                         content_type='message/rfc822',
                         **self.params)
+    if self.sent_callback:
+      self.sent_callback([key for _, _, _, key in self.batch])
     self.batch = []
     self.batch_size = 0
 
-  def SendSingleFile(self, path, payload, mime_type):
+  def SendSingleFile(self, path, payload, mime_type, key=None):
     """Send a single file on its way."""
     logging.info('Uploading %s %s (%s bytes, type=%s) to %s.',
                  self.what, path, len(payload), mime_type, self.single_url)
@@ -1378,6 +1394,8 @@ class UploadBatcher(object):
                         content_type=mime_type,
                         path=path,
                         **self.params)
+    if self.sent_callback:
+      self.sent_callback([key])
 
   def Flush(self):
     """Flush the current batch.
@@ -1401,25 +1419,29 @@ class UploadBatcher(object):
       self.batching = False
 
 
-      for path, payload, mime_type in self.batch:
-        self.SendSingleFile(path, payload, mime_type)
+      for path, payload, mime_type, key in self.batch:
+        self.SendSingleFile(path, payload, mime_type, key)
 
 
       self.batch = []
       self.batch_size = 0
 
-  def AddToBatch(self, path, payload, mime_type):
+  def AddToBatch(self, path, payload, mime_type, key=None):
     """Batch a file, possibly flushing first, or perhaps upload it directly.
 
     Args:
       path: The name of the file.
       payload: The contents of the file.
       mime_type: The MIME Content-type of the file, or None.
+      key: The value passed to sent_callback once the file has been sent;
+        defaults to path.
 
     If mime_type is None, application/octet-stream is substituted.
     """
     if not mime_type:
       mime_type = 'application/octet-stream'
+    if key is None:
+      key = path
     size = len(payload)
     if size <= MAX_BATCH_FILE_SIZE:
       if (len(self.batch) >= MAX_BATCH_COUNT or
@@ -1428,10 +1450,10 @@ class UploadBatcher(object):
       if self.batching:
         logging.info('Adding %s %s (%s bytes, type=%s) to batch.',
                      self.what, path, size, mime_type)
-        self.batch.append((path, payload, mime_type))
+        self.batch.append((path, payload, mime_type, key))
         self.batch_size += size + BATCH_OVERHEAD
         return
-    self.SendSingleFile(path, payload, mime_type)
+    self.SendSingleFile(path, payload, mime_type, key)
 
 
 def _FormatHash(h):
@@ -1484,6 +1506,234 @@ def _HashFromFileHandle(file_handle):
   return content_hash
 
 
+def _ReplaceFile(temp_name, filename):
+  """Moves temp_name over filename, which may already exist."""
+  if sys.platform == 'win32' and os.path.exists(filename):
+    os.remove(filename)
+  os.rename(temp_name, filename)
+
+
+class FileHashCache(object):
+  """Remembers file content hashes by path, modification time and size.
+
+  Lets an update skip reading files that have not changed since the last one.
+  The cache is stored in the user's home directory with one line per file:
+  'mtime|size|hash|path'.  Files modified within HASH_CACHE_MIN_AGE seconds of
+  being hashed are not cached, since a later change could leave the mtime
+  unchanged.
+  """
+
+  def __init__(self, filename=None):
+    """Creates an empty FileHashCache; call Load() to read the stored one.
+
+    Args:
+      filename: The file to store the cache in, by default HASH_CACHE_FILE in
+        the user's home directory.
+    """
+    self.filename = filename or os.path.expanduser('~/' + HASH_CACHE_FILE)
+    self.entries = {}
+    self.dirty = False
+
+  def Load(self):
+    """Reads the cache file, if there is one."""
+    self.entries = {}
+    self.dirty = False
+    try:
+      fp = open(self.filename, 'r')
+    except IOError:
+      return
+    try:
+      for line in fp:
+        try:
+          mtime, size, content_hash, path = line.rstrip('\n').split('|', 3)
+          self.entries[path] = (float(mtime), int(size), content_hash)
+        except ValueError:
+          logging.info('Ignoring malformed line in %s: %r',
+                       self.filename, line)
+    finally:
+      fp.close()
+
+  def Save(self):
+    """Writes the cache file if it has changed, dropping deleted files."""
+    if not self.dirty:
+      return
+    try:
+      fd, temp_name = tempfile.mkstemp(
+          prefix=os.path.basename(self.filename),
+          dir=os.path.dirname(self.filename))
+      fp = os.fdopen(fd, 'w')
+      try:
+        for path, (mtime, size, content_hash) in sorted(
+            self.entries.iteritems()):
+          if os.path.exists(path):
+            fp.write('%r|%d|%s|%s\n' % (mtime, size, content_hash, path))
+      finally:
+        fp.close()
+      _ReplaceFile(temp_name, self.filename)
+      self.dirty = False
+    except EnvironmentError, e:
+      logging.warning('Could not save file hashes to %s: %s',
+                      self.filename, e)
+
+  def GetHash(self, file_handle):
+    """Returns the hash of the content of file_handle.
+
+    The content is only read if file_handle is not a file on disk or the file
+    has changed since its hash was cached.
+
+    Args:
+      file_handle: File-like object positioned at the start of its content.
+
+    Returns:
+      The string representation of the hash.
+    """
+    try:
+      path = os.path.abspath(file_handle.name)
+      stat = os.fstat(file_handle.fileno())
+      position = file_handle.tell()
+    except (AttributeError, TypeError, EnvironmentError):
+      return _HashFromFileHandle(file_handle)
+    if position != 0 or '\n' in path:
+      return _HashFromFileHandle(file_handle)
+
+    entry = self.entries.get(path)
+    if entry and entry[:2] == (stat.st_mtime, stat.st_size):
+      return entry[2]
+
+    content_hash = _HashFromFileHandle(file_handle)
+    if time.time() - stat.st_mtime >= HASH_CACHE_MIN_AGE:
+      self.entries[path] = (stat.st_mtime, stat.st_size, content_hash)
+      self.dirty = True
+    return content_hash
+
+
+class UploadCheckpoint(object):
+  """Records the progress of an update so that it can be resumed.
+
+  There is one checkpoint file per app version (or backend), in CHECKPOINT_DIR
+  in the user's home directory.  Its first line is a fingerprint of the
+  update: the app configuration and the hashes of all its files.  Then come
+  'P <path>' lines for the files Begin() asked to upload, an 'R' line once that
+  list is complete, and 'U <path>' lines for the files the server has
+  accepted.  Paths are URL-quoted.
+  """
+
+  def __init__(self, app_id, version, backend=None, directory=None):
+    """Creates a checkpoint for the given app version or backend.
+
+    Args:
+      app_id: The application id.
+      version: The version being updated.
+      backend: The backend being updated, if any.
+      directory: The directory holding checkpoint files, by default
+        CHECKPOINT_DIR in the user's home directory.
+    """
+    self.directory = directory or os.path.expanduser('~/' + CHECKPOINT_DIR)
+    name = '%s@%s' % (urllib.quote(app_id or '', safe=''),
+                      urllib.quote(backend or version or '', safe=''))
+    if backend:
+      name += '@backend'
+    self.filename = os.path.join(self.directory, name)
+    self.lock = threading.Lock()
+
+  def Exists(self):
+    """Returns True if a checkpoint has been recorded."""
+    return os.path.exists(self.filename)
+
+  def Start(self, fingerprint, paths=None):
+    """Records the start of an update, replacing any earlier checkpoint.
+
+    Args:
+      fingerprint: A string identifying the update.
+      paths: The files that need uploading, or None if they are not yet known.
+    """
+    lines = [fingerprint + '\n']
+    if paths is not None:
+      lines.extend('P %s\n' % urllib.quote(path) for path in paths)
+      lines.append('R\n')
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+      fd, temp_name = tempfile.mkstemp(dir=self.directory)
+      fp = os.fdopen(fd, 'w')
+      try:
+        fp.writelines(lines)
+      finally:
+        fp.close()
+      _ReplaceFile(temp_name, self.filename)
+    except EnvironmentError, e:
+      logging.warning('Could not record upload checkpoint %s: %s',
+                      self.filename, e)
+
+  def MarkUploaded(self, paths):
+    """Records that the server has accepted the given files.
+
+    May be called from several threads at once.
+
+    Args:
+      paths: A list of paths.
+    """
+    if not paths:
+      return
+    lines = ['U %s\n' % urllib.quote(path) for path in paths]
+    self.lock.acquire()
+    try:
+      try:
+        fp = open(self.filename, 'a')
+        try:
+          fp.writelines(lines)
+        finally:
+          fp.close()
+      except EnvironmentError, e:
+        logging.warning('Could not update upload checkpoint %s: %s',
+                        self.filename, e)
+    finally:
+      self.lock.release()
+
+  def Load(self, fingerprint):
+    """Reads the checkpoint of an interrupted update.
+
+    Args:
+      fingerprint: The fingerprint of the update about to be made.
+
+    Returns:
+      The set of paths that still need uploading, or None if there is no
+      complete checkpoint with the given fingerprint.
+    """
+    try:
+      fp = open(self.filename, 'r')
+    except IOError:
+      return None
+    try:
+      lines = fp.read().split('\n')
+    finally:
+      fp.close()
+    if lines[0] != fingerprint:
+      return None
+
+    pending = set()
+    ready = False
+    for line in lines[1:]:
+      if line.startswith('P '):
+        pending.add(urllib.unquote(line[2:]))
+      elif line == 'R':
+        ready = True
+      elif line.startswith('U ') and ready:
+        pending.discard(urllib.unquote(line[2:]))
+    if not ready:
+      return None
+    return pending
+
+  def Clear(self):
+    """Removes the checkpoint."""
+    try:
+      os.remove(self.filename)
+    except OSError, e:
+      if e.errno != errno.ENOENT:
+        logging.warning('Could not remove upload checkpoint %s: %s',
+                        self.filename, e)
+
+
 def EnsureDir(path):
   """Makes sure that a directory exists at the given path.
 
@@ -1639,10 +1889,14 @@ class AppVersionUpload(object):
       An AppVersionUpload can do only one transaction at a time.
     deployed: True iff the Deploy method has been called.
     started: True iff the StartServing method has been called.
+    num_workers: The number of threads uploading files concurrently.
+    hash_cache: The FileHashCache used to hash files, or None.
+    checkpoint: The UploadCheckpoint recording upload progress, or None.
   """
 
   def __init__(self, rpcserver, config, version=None, backend=None,
-               error_fh=None):
+               error_fh=None, num_workers=1, hash_cache=None,
+               checkpoint=None):
     """Creates a new AppVersionUpload.
 
     Args:
@@ -1654,12 +1908,21 @@ class AppVersionUpload(object):
       backend: If specified, indicates the update applies to the given backend.
         The backend name must match an entry in the backends: stanza.
       error_fh: Unexpected HTTPErrors are printed to this file handle.
+      num_workers: The number of threads to upload files with.  Each has its
+        own batchers, so up to this many requests are in flight at once.
+      hash_cache: If given, a FileHashCache used to avoid re-reading files
+        that have not changed since they were last hashed.
+      checkpoint: If given, an UploadCheckpoint in which to record progress so
+        that an interrupted update can be resumed.
     """
     self.rpcserver = rpcserver
     self.config = config
     self.app_id = self.config.application
     self.backend = backend
     self.error_fh = error_fh or sys.stderr
+    self.num_workers = max(1, num_workers)
+    self.hash_cache = hash_cache
+    self.checkpoint = checkpoint
 
     if version:
       self.version = version
@@ -1682,14 +1945,25 @@ class AppVersionUpload(object):
 
     self.all_files = set()
 
+
+    self.file_hashes = {}
+
+
+    self.pending_sends = {}
+    self.lock = threading.Lock()
+
     self.in_transaction = False
     self.deployed = False
     self.started = False
     self.batching = True
-    self.file_batcher = UploadBatcher('file', self.rpcserver, self.params)
-    self.blob_batcher = UploadBatcher('blob', self.rpcserver, self.params)
-    self.errorblob_batcher = UploadBatcher('errorblob', self.rpcserver,
-                                           self.params)
+    (self.file_batcher, self.blob_batcher,
+     self.errorblob_batcher) = self._MakeBatchers()
+
+  def _MakeBatchers(self):
+    """Returns a (file, blob, errorblob) tuple of new UploadBatchers."""
+    return tuple(UploadBatcher(what, self.rpcserver, self.params,
+                               sent_callback=self._FilesSent)
+                 for what in ('file', 'blob', 'errorblob'))
 
   def Send(self, url, payload=''):
     """Sends a request to the server, with common params."""
@@ -1711,9 +1985,13 @@ class AppVersionUpload(object):
       logging.error(reason)
       return
 
-    content_hash = _HashFromFileHandle(file_handle)
+    if self.hash_cache:
+      content_hash = self.hash_cache.GetHash(file_handle)
+    else:
+      content_hash = _HashFromFileHandle(file_handle)
 
     self.files[path] = content_hash
+    self.file_hashes[path] = content_hash
     self.all_files.add(path)
 
   def Describe(self):
@@ -1738,6 +2016,8 @@ class AppVersionUpload(object):
 
     self.Send('/api/appversion/create', payload=self.config.ToYAML())
     self.in_transaction = True
+    if self.checkpoint:
+      self.checkpoint.Start(self.Fingerprint())
 
     files_to_clone = []
     blobs_to_clone = []
@@ -1797,9 +2077,74 @@ class AppVersionUpload(object):
     for (path, content_hash) in errorblobs.iteritems():
       files_to_upload[path] = content_hash
     self.files = files_to_upload
-    return sorted(files_to_upload.iterkeys())
+    missing_files = sorted(files_to_upload.iterkeys())
+    if self.checkpoint:
+      self.checkpoint.Start(self.Fingerprint(), missing_files)
+    return missing_files
+
+  def Fingerprint(self):
+    """Returns a string identifying this update for checkpointing.
+
+    It covers the app, version and backend, the app configuration, and the
+    path and hash of every file added with AddFile().
+    """
+    h = hashlib.sha1()
+    h.update('%s\n%s\n%s\n' % (self.app_id, self.version, self.backend))
+    h.update(self.config.ToYAML())
+    for path, content_hash in sorted(self.file_hashes.iteritems()):
+      h.update('%s|%s\n' % (path, content_hash))
+    return h.hexdigest()
+
+  def Resume(self):
+    """Resumes the transaction of an interrupted update of the same files.
+
+    All calls to AddFile must be made before calling Resume().  Files the
+    server accepted before the interruption are not uploaded again.
+
+    Returns:
+      A list of pathnames for files that should be uploaded using UploadFile()
+      before Commit() can be called, or None if there is no checkpoint of an
+      interrupted update with the same configuration and files.
+    """
+    assert not self.in_transaction, 'Already in a transaction.'
+    if not self.checkpoint:
+      return None
+    remaining = self.checkpoint.Load(self.Fingerprint())
+    if remaining is None:
+      return None
+    self.files = dict((path, self.file_hashes[path]) for path in remaining)
+    self.in_transaction = True
+    return sorted(remaining)
+
+  def _AbandonInterruptedUpdate(self):
+    """Rolls back the transaction left open by an interrupted update."""
+    StatusUpdate('Abandoning interrupted update of %s.' % self.Describe())
+    self.in_transaction = True
+    try:
+      self.Rollback()
+    except urllib2.HTTPError, e:
+
+      logging.info('Rollback of interrupted update failed: %s', e)
+      self.in_transaction = False
+    self.checkpoint.Clear()
+    self.files = dict(self.file_hashes)
+
+  def _FilesSent(self, paths):
+    """Called by the batchers with the paths of files the server accepted."""
+    done = []
+    self.lock.acquire()
+    try:
+      for path in paths:
+        self.pending_sends[path] -= 1
+        if not self.pending_sends[path]:
+          del self.pending_sends[path]
+          done.append(path)
+    finally:
+      self.lock.release()
+    if self.checkpoint:
+      self.checkpoint.MarkUploaded(done)
 
-  def UploadFile(self, path, file_handle):
+  def UploadFile(self, path, file_handle, batchers=None):
     """Uploads a file to the hosting service.
 
     Must only be called after Begin().
@@ -1808,23 +2153,34 @@ class AppVersionUpload(object):
     Args:
       path: The path the file is being uploaded as.
       file_handle: A file-like object containing the data to upload.
+      batchers: A (file, blob, errorblob) tuple of UploadBatchers to use, by
+        default this object's own.
 
     Raises:
       KeyError: The provided file is not amongst those to be uploaded.
     """
     assert self.in_transaction, 'Begin() must be called before UploadFile().'
-    if path not in self.files:
-      raise KeyError('File \'%s\' is not in the list of files to be uploaded.'
-                     % path)
+    if batchers is None:
+      batchers = (self.file_batcher, self.blob_batcher,
+                  self.errorblob_batcher)
+    file_batcher, blob_batcher, errorblob_batcher = batchers
+
+    self.lock.acquire()
+    try:
+      if path not in self.files:
+        raise KeyError('File \'%s\' is not in the list of files to be '
+                       'uploaded.' % path)
+
+      del self.files[path]
+    finally:
+      self.lock.release()
+
 
-    del self.files[path]
 
-    match_found = False
+    sends = []
     mime_type = GetMimeTypeIfStaticFile(self.config, path)
-    payload = file_handle.read()
     if mime_type is not None:
-      self.blob_batcher.AddToBatch(path, payload, mime_type)
-      match_found = True
+      sends.append((blob_batcher, path, mime_type))
 
 
 
@@ -1832,12 +2188,100 @@ class AppVersionUpload(object):
     if mime_type is not None:
 
 
-      self.errorblob_batcher.AddToBatch(error_code, payload, mime_type)
-      match_found = True
+      sends.append((errorblob_batcher, error_code, mime_type))
 
-    if not match_found:
+    if not sends:
 
-      self.file_batcher.AddToBatch(path, payload, None)
+      sends.append((file_batcher, path, None))
+
+    self.lock.acquire()
+    try:
+      self.pending_sends[path] = len(sends)
+    finally:
+      self.lock.release()
+
+    payload = file_handle.read()
+    for batcher, name, mime_type in sends:
+      batcher.AddToBatch(name, payload, mime_type, key=path)
+
+  def UploadFiles(self, paths, openfunc):
+    """Uploads files to the hosting service and flushes all the batchers.
+
+    Must only be called after Begin().  With more than one worker, the files
+    are uploaded by that many threads, each with its own batchers.
+
+    Args:
+      paths: The paths of the files to upload, as returned by Begin().
+      openfunc: A function that takes a path and returns a file-like object.
+
+    Returns:
+      The number of files uploaded.
+    """
+    progress = [0]
+
+    def UploadOne(path, batchers):
+      """Uploads one file and reports progress."""
+      file_handle = openfunc(path)
+      try:
+        self.UploadFile(path, file_handle, batchers)
+      finally:
+        file_handle.close()
+      self.lock.acquire()
+      try:
+        progress[0] += 1
+        if progress[0] % 500 == 0:
+          StatusUpdate('Processed %d out of %s.' % (progress[0], len(paths)))
+      finally:
+        self.lock.release()
+
+    num_workers = min(self.num_workers, len(paths))
+    if num_workers <= 1:
+      batchers = (self.file_batcher, self.blob_batcher,
+                  self.errorblob_batcher)
+      for path in paths:
+        UploadOne(path, batchers)
+      for batcher in batchers:
+        batcher.Flush()
+      return progress[0]
+
+    path_queue = Queue.Queue()
+    for path in paths:
+      path_queue.put(path)
+    errors = []
+
+    def Worker():
+      """Uploads files from path_queue until it is empty or a worker fails."""
+      try:
+        batchers = self._MakeBatchers()
+        while not errors:
+          try:
+            path = path_queue.get_nowait()
+          except Queue.Empty:
+            break
+          UploadOne(path, batchers)
+        if not errors:
+          for batcher in batchers:
+            batcher.Flush()
+      except:
+        errors.append(sys.exc_info())
+
+    logging.info('Uploading with %d threads.', num_workers)
+    threads = [threading.Thread(target=Worker) for _ in xrange(num_workers)]
+    for thread in threads:
+      thread.setDaemon(True)
+      thread.start()
+    try:
+      for thread in threads:
+
+
+        while thread.isAlive():
+          thread.join(1)
+    except KeyboardInterrupt:
+      errors.append(None)
+      raise
+    if errors:
+      raise errors[0][0], errors[0][1], errors[0][2]
+    return progress[0]
 
   def Precompile(self):
     """Handle bytecode precompilation."""
@@ -2018,13 +2462,34 @@ class AppVersionUpload(object):
     self.in_transaction = False
     self.files = {}
 
-  def DoUpload(self, paths, max_size, openfunc):
+  def _Abort(self):
+    """Rolls back the transaction and forgets its checkpoint."""
+    if self.checkpoint:
+      self.checkpoint.Clear()
+    self.Rollback()
+
+  def _Interrupt(self):
+    """Leaves the transaction open to be resumed, if that is possible."""
+    if not self.checkpoint or not self.in_transaction or self.deployed:
+      self._Abort()
+      return
+    print >>self.error_fh, (
+        'The update of %s was interrupted. Run the same command again to '
+        'resume it, or appcfg.py rollback to abandon it.' % self.Describe())
+
+  def DoUpload(self, paths, max_size, openfunc, resume=True):
     """Uploads a new appversion with the given config and files to the server.
 
+    If the update is interrupted by the user or by a network error, the
+    transaction is left open and, given a checkpoint, a later DoUpload of the
+    same files resumes it.
+
     Args:
       paths: An iterator that yields the relative paths of the files to upload.
       max_size: The maximum size file to upload.
       openfunc: A function that takes a path and returns a file-like object.
+      resume: Whether to resume an interrupted update.  If False, any such
+        update is rolled back and a new one started.
 
     Returns:
       An appinfo.AppInfoSummary if one was returned from the server, None
@@ -2065,26 +2530,30 @@ class AppVersionUpload(object):
 
     app_summary = None
     try:
+      missing_files = None
+      if resume:
+        missing_files = self.Resume()
+      if missing_files is not None:
+        StatusUpdate('Resuming interrupted update; %d files and blobs left.' %
+                     len(missing_files))
+        try:
+          num_files = self.UploadFiles(missing_files, openfunc)
+          StatusUpdate('Uploaded %d files and blobs' % num_files)
+        except urllib2.HTTPError, err:
 
-      missing_files = self.Begin()
-      if missing_files:
-        StatusUpdate('Uploading %d files and blobs.' % len(missing_files))
-        num_files = 0
-        for missing_file in missing_files:
-          file_handle = openfunc(missing_file)
-          try:
-            self.UploadFile(missing_file, file_handle)
-          finally:
-            file_handle.close()
-          num_files += 1
-          if num_files % 500 == 0:
-            StatusUpdate('Processed %d out of %s.' %
-                         (num_files, len(missing_files)))
+          logging.info('HTTP Error (%s)', err)
+          StatusUpdate('Could not resume the update; starting over.')
+          self._AbandonInterruptedUpdate()
+          missing_files = None
+      elif self.checkpoint and self.checkpoint.Exists():
+        self._AbandonInterruptedUpdate()
 
-        self.file_batcher.Flush()
-        self.blob_batcher.Flush()
-        self.errorblob_batcher.Flush()
-        StatusUpdate('Uploaded %d files and blobs' % num_files)
+      if missing_files is None:
+        missing_files = self.Begin()
+        if missing_files:
+          StatusUpdate('Uploading %d files and blobs.' % len(missing_files))
+          num_files = self.UploadFiles(missing_files, openfunc)
+          StatusUpdate('Uploaded %d files and blobs' % num_files)
 
 
       if (self.config.derived_file_type and
@@ -2111,21 +2580,28 @@ class AppVersionUpload(object):
 
 
       app_summary = self.Commit()
+      if self.checkpoint:
+        self.checkpoint.Clear()
       StatusUpdate('Completed update of %s' % self.Describe())
 
     except KeyboardInterrupt:
 
       logging.info('User interrupted. Aborting.')
-      self.Rollback()
+      self._Interrupt()
       raise
     except urllib2.HTTPError, err:
 
       logging.info('HTTP Error (%s)', err)
-      self.Rollback()
+      self._Abort()
+      raise
+    except EnvironmentError, err:
+
+      logging.info('Error (%s)', err)
+      self._Interrupt()
       raise
     except:
       logging.exception('An unexpected error occurred. Aborting.')
-      self.Rollback()
+      self._Abort()
       raise
 
     logging.info('Done!')
@@ -2841,12 +3317,27 @@ class AppCfgApp(object):
       updatecheck = self.update_check_class(rpcserver, appyaml)
       updatecheck.CheckForUpdates()
 
+    hash_cache = None
+    if self.options.hash_cache:
+      hash_cache = FileHashCache()
+      hash_cache.Load()
+    checkpoint = UploadCheckpoint(appyaml.application,
+                                  self.options.version or appyaml.version,
+                                  backend)
     appversion = AppVersionUpload(rpcserver, appyaml, self.options.version,
-                                  backend, self.error_fh)
-    return appversion.DoUpload(
-        self.file_iterator(basepath, appyaml.skip_files, appyaml.runtime),
-        self.options.max_size,
-        lambda path: self.opener(os.path.join(basepath, path), 'rb'))
+                                  backend, self.error_fh,
+                                  num_workers=self.options.num_upload_threads,
+                                  hash_cache=hash_cache,
+                                  checkpoint=checkpoint)
+    try:
+      return appversion.DoUpload(
+          self.file_iterator(basepath, appyaml.skip_files, appyaml.runtime),
+          self.options.max_size,
+          lambda path: self.opener(os.path.join(basepath, path), 'rb'),
+          resume=self.options.resume)
+    finally:
+      if hash_cache:
+        hash_cache.Save()
 
   def Update(self):
     """Updates and deploys a new appversion and global app configs."""
@@ -2914,6 +3405,17 @@ class AppCfgApp(object):
     parser.add_option('--backends', action='store_true',
                       dest='backends', default=False,
                       help='Update backends when performing appcfg update.')
+    parser.add_option('--num_upload_threads', type='int',
+                      dest='num_upload_threads', default=1, metavar='NUM',
+                      help='Number of threads to upload files with.')
+    parser.add_option('--no_hash_cache', action='store_false',
+                      dest='hash_cache', default=True,
+                      help='Do not use the cache of file hashes in ~/%s.' %
+                      HASH_CACHE_FILE)
+    parser.add_option('--no_resume', action='store_false',
+                      dest='resume', default=True,
+                      help='Start a new update rather than resuming an '
+                      'interrupted one.')
 
   def VacuumIndexes(self):
     """Deletes unused indexes."""
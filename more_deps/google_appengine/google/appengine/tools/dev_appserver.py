@@ -89,6 +89,7 @@ try:
 except ImportError:
   pass
 
+from google.appengine.api import apiproxy_rpc
 from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import appinfo
 from google.appengine.api import appinfo_includes
@@ -198,6 +199,20 @@ MAX_REQUEST_SIZE = 32 * 1024 * 1024
 COPY_BLOCK_SIZE = 1 << 20
 
 
+STATIC_FILE_CACHE_SIZE = 1000
+
+
+
+STATIC_FILE_HEADER = 'X-AppEngine-Dev-StaticFile'
+
+
+PATTERN_MATCH_CACHE_SIZE = 1000
+
+
+
+MAX_COMBINED_PATTERN_GROUPS = 90
+
+
 
 API_VERSION = '1'
 
@@ -431,6 +446,191 @@ class URLDispatcher(object):
     original_output.write(dispatched_output.read())
 
 
+class PatternIndex(object):
+  """Finds the first of an ordered list of regular expressions that matches.
+
+  Equivalent to trying re.match() with each pattern in the order they were
+  added, but:
+  - Patterns are filed in a trie under their literal prefix, so only the
+    patterns whose prefix the string starts with are considered.
+  - The patterns filed under each prefix are combined into as few
+    alternations as possible, one named group per pattern, so that one
+    regex match finds the first of them that matches.  Patterns with flags,
+    named groups or back-references cannot be combined and are tried on
+    their own.
+  - The results for recently matched strings are memoized.
+  """
+
+  def __init__(self, cache_size=PATTERN_MATCH_CACHE_SIZE):
+    """Initializer.
+
+    Args:
+      cache_size: Maximum number of strings whose match to remember.
+    """
+    self._cache_size = cache_size
+    self._patterns = []
+
+
+    self._trie = [{}, [], None]
+    self._cache = {}
+
+  def Add(self, url_re, value):
+    """Adds a pattern after those added so far.
+
+    Args:
+      url_re: Compiled regular expression object.
+      value: Value returned by Match() when this is the first pattern that
+        matches.
+    """
+    index = len(self._patterns)
+    parsed = sre_parse.parse(url_re.pattern, url_re.flags)
+    prefix = self._LiteralPrefix(parsed)
+    combinable = (not parsed.pattern.flags and not parsed.pattern.groupdict and
+                  not self._HasGroupRef(parsed))
+    self._patterns.append((url_re, value, combinable))
+
+    node = self._trie
+    for char in prefix:
+      node = node[0].setdefault(char, [{}, [], None])
+    node[1].append(index)
+    node[2] = None
+    self._cache.clear()
+
+  def Match(self, string):
+    """Matches a string against the patterns in the order they were added.
+
+    Args:
+      string: String to match.
+
+    Returns:
+      Tuple (match, value) of the match object and the value of the first
+      pattern that matches, or (None, None) if none does.
+    """
+    result = self._cache.get(string)
+    if result is None:
+      result = self._Match(string)
+      if len(self._cache) >= self._cache_size:
+        self._cache.clear()
+      self._cache[string] = result
+    return result
+
+  def _Match(self, string):
+    """Implementation of Match() without memoization."""
+    first = len(self._patterns)
+    node = self._trie
+    position = 0
+    while True:
+      if node[1] and node[1][0] < first:
+        first = self._MatchNode(node, string, first)
+      if position == len(string):
+        break
+      node = node[0].get(string[position])
+      if node is None:
+        break
+      position += 1
+    if first == len(self._patterns):
+      return None, None
+    url_re, value, unused_combinable = self._patterns[first]
+    return url_re.match(string), value
+
+  def _MatchNode(self, node, string, first):
+    """Returns the first index below first of a pattern in node that matches.
+
+    Args:
+      node: Trie node holding the indices of the patterns with a prefix.
+      string: String to match.
+      first: Index of the first pattern known to match so far.
+
+    Returns:
+      The index of the first pattern in node that matches if it is lower
+      than first, otherwise first.
+    """
+    segments = node[2]
+    if segments is None:
+      segments = node[2] = self._Combine(node[1])
+    for combined_re, indices in segments:
+      if indices[0] >= first:
+        break
+      the_match = combined_re.match(string)
+      if the_match:
+        if len(indices) == 1:
+          index = indices[0]
+        else:
+          index = indices[int(the_match.lastgroup[1:])]
+        return min(index, first)
+    return first
+
+  def _Combine(self, indices):
+    """Groups patterns into alternations.
+
+    Args:
+      indices: Sorted list of pattern indices.
+
+    Returns:
+      List of (compiled_re, indices) tuples to try in order.  When indices
+      holds several pattern indices, alternative i of compiled_re is the group
+      named '_<i>' and holds the pattern at indices[i].
+    """
+    segments = []
+    pending = []
+    pending_groups = 0
+    for index in indices + [None]:
+      if index is not None:
+        url_re, unused_value, combinable = self._patterns[index]
+        groups = url_re.groups + 1
+        if combinable and pending_groups + groups <= MAX_COMBINED_PATTERN_GROUPS:
+          pending.append(index)
+          pending_groups += groups
+          continue
+      if len(pending) == 1:
+        segments.append((self._patterns[pending[0]][0], tuple(pending)))
+      elif pending:
+        combined = '|'.join('(?P<_%d>%s)' % (i, self._patterns[p][0].pattern)
+                            for i, p in enumerate(pending))
+        segments.append((re.compile('(?:%s)' % combined), tuple(pending)))
+      pending = []
+      pending_groups = 0
+      if index is not None:
+        if combinable:
+          pending.append(index)
+          pending_groups = groups
+        else:
+          segments.append((url_re, (index,)))
+    return segments
+
+  @staticmethod
+  def _LiteralPrefix(parsed):
+    """Returns the literal string every match of a parsed pattern starts with."""
+    if parsed.pattern.flags & (re.IGNORECASE | re.LOCALE | re.UNICODE):
+      return ''
+    prefix = []
+    for op, av in parsed:
+      if op == sre_constants.AT and av == sre_constants.AT_BEGINNING:
+        continue
+
+
+
+      if op != sre_constants.LITERAL or av > 127:
+        break
+      prefix.append(chr(av))
+    return ''.join(prefix)
+
+  @staticmethod
+  def _HasGroupRef(parsed):
+    """Returns whether a parsed pattern refers back to one of its groups."""
+    pending = [parsed]
+    while pending:
+      item = pending.pop()
+      if isinstance(item, (sre_parse.SubPattern, list, tuple)):
+        for element in item:
+          if (isinstance(element, tuple) and element and
+              element[0] in (sre_constants.GROUPREF,
+                             sre_constants.GROUPREF_EXISTS)):
+            return True
+          pending.append(element)
+    return False
+
+
 class URLMatcher(object):
   """Matches an arbitrary URL using a list of URL patterns from an application.
 
@@ -446,6 +646,7 @@ class URLMatcher(object):
 
 
     self._url_patterns = []
+    self._url_index = PatternIndex()
 
   def AddURL(self, regex, dispatcher, path, requires_login, admin_only,
              auth_fail_action):
@@ -493,6 +694,7 @@ class URLMatcher(object):
     match_tuple = (url_re, dispatcher, path, requires_login, admin_only,
                    auth_fail_action)
     self._url_patterns.append(match_tuple)
+    self._url_index.Add(url_re, match_tuple)
 
   def Match(self,
             relative_url,
@@ -517,14 +719,12 @@ class URLMatcher(object):
 
     adjusted_url, unused_query_string = split_url(relative_url)
 
-    for url_tuple in self._url_patterns:
+    the_match, url_tuple = self._url_index.Match(adjusted_url)
+    if the_match:
       url_re, dispatcher, path, requires_login, admin_only, auth_fail_action = url_tuple
-      the_match = url_re.match(adjusted_url)
-
-      if the_match:
-        adjusted_path = the_match.expand(path)
-        return (dispatcher, adjusted_path, requires_login, admin_only,
-                auth_fail_action)
+      adjusted_path = the_match.expand(path)
+      return (dispatcher, adjusted_path, requires_login, admin_only,
+              auth_fail_action)
 
     return None, None, None, None, None
 
@@ -1719,6 +1919,8 @@ class StaticFileConfigMatcher(object):
 
 
     self._patterns = []
+    self._path_index = PatternIndex()
+    self._mime_type_index = PatternIndex()
 
     if url_map_list:
       for entry in url_map_list:
@@ -1750,6 +1952,9 @@ class StaticFileConfigMatcher(object):
           expiration = appinfo.ParseExpiration(entry.expiration)
 
         self._patterns.append((path_re, entry.mime_type, expiration))
+        self._path_index.Add(path_re, expiration)
+        if entry.mime_type is not None:
+          self._mime_type_index.Add(path_re, entry.mime_type)
 
   def IsStaticFile(self, path):
     """Tests if the given path points to a "static" file.
@@ -1760,10 +1965,8 @@ class StaticFileConfigMatcher(object):
     Returns:
       Boolean, True if the file was configured to be static.
     """
-    for (path_re, _, _) in self._patterns:
-      if path_re.match(path):
-        return True
-    return False
+    the_match, unused_expiration = self._path_index.Match(path)
+    return the_match is not None
 
   def GetMimeType(self, path):
     """Returns the mime type that we should use when serving the specified file.
@@ -1775,11 +1978,9 @@ class StaticFileConfigMatcher(object):
       String containing the mime type to use. Will be 'application/octet-stream'
       if we have no idea what it should be.
     """
-    for (path_re, mimetype, unused_expiration) in self._patterns:
-      if mimetype is not None:
-        the_match = path_re.match(path)
-        if the_match:
-          return mimetype
+    the_match, mimetype = self._mime_type_index.Match(path)
+    if the_match:
+      return mimetype
 
 
     unused_filename, extension = os.path.splitext(path)
@@ -1794,10 +1995,9 @@ class StaticFileConfigMatcher(object):
     Returns:
       Integer number of seconds to be used for browser cache expiration time.
     """
-    for (path_re, unused_mimetype, expiration) in self._patterns:
-      the_match = path_re.match(path)
-      if the_match:
-        return expiration
+    the_match, expiration = self._path_index.Match(path)
+    if the_match:
+      return expiration
 
 
     return self._default_expiration or 0
@@ -1838,14 +2038,117 @@ def ReadDataFile(data_path, openfile=file):
   return status, data
 
 
+class StaticFileCache(object):
+  """Cache of the size and ETag of static files.
+
+  Entries are keyed by path and validated against the modification time,
+  size and inode of the file, so the content of a file is only hashed again
+  after it changes.
+  """
+
+  def __init__(self, max_entries=STATIC_FILE_CACHE_SIZE, openfile=file):
+    """Initializer.
+
+    Args:
+      max_entries: Maximum number of files to remember.
+      openfile: Used for dependency injection.
+    """
+    self._max_entries = max_entries
+    self._openfile = openfile
+    self._entries = {}
+
+  def Open(self, data_path):
+    """Opens a file on disk, returning its HTTP status, size and ETag.
+
+    Args:
+      data_path: Path to the file on disk to open.
+
+    Returns:
+      Tuple (status, data_file, size, etag) where status is an HTTP response
+        code and data_file is the file open for reading at offset 0, or None
+        if an error occurred.
+    """
+    try:
+      data_file = self._openfile(data_path, 'rb')
+      try:
+        stat = os.fstat(data_file.fileno())
+        validator = (stat.st_mtime, stat.st_size, stat.st_ino)
+        entry = self._entries.get(data_path)
+        if entry is None or entry[0] != validator:
+          entry = (validator, self._ComputeEtag(data_file))
+          if len(self._entries) >= self._max_entries:
+            self._entries.clear()
+          self._entries[data_path] = entry
+      except:
+        data_file.close()
+        raise
+    except (OSError, IOError), e:
+      logging.error('Error encountered reading file "%s":\n%s', data_path, e)
+      if e.errno in FILE_MISSING_EXCEPTIONS:
+        status = httplib.NOT_FOUND
+      else:
+        status = httplib.FORBIDDEN
+      return status, None, 0, FileDispatcher.CreateEtag('')
+    return httplib.OK, data_file, stat.st_size, entry[1]
+
+  @staticmethod
+  def _ComputeEtag(data_file):
+    """Returns the same ETag as FileDispatcher.CreateEtag, reading in blocks."""
+    data_crc = 0
+    while True:
+      block = data_file.read(COPY_BLOCK_SIZE)
+      if not block:
+        break
+      data_crc = zlib.crc32(block, data_crc)
+    data_file.seek(0)
+    return base64.b64encode(str(data_crc))
+
+
+_static_file_bodies = {}
+
+
+def StaticFileRewriter(response):
+  """Replaces the body of a static file response with the file itself.
+
+  FileDispatcher does not copy file contents into the response.  It writes
+  a STATIC_FILE_HEADER naming an entry in _static_file_bodies instead, and
+  this rewriter swaps that entry in as the body so that it is streamed to
+  the client.  Only entries registered by FileDispatcher in this process
+  are honored, so applications cannot use the header to read other files.
+  """
+  token = response.headers.getheader(STATIC_FILE_HEADER)
+  if token is not None:
+    del response.headers[STATIC_FILE_HEADER]
+    body = _static_file_bodies.pop(token, None)
+    if body is not None:
+      response.body = body
+
+
+def _RegisterStaticFileBody(body):
+  """Registers a body for StaticFileRewriter and returns its token."""
+
+
+  while len(_static_file_bodies) >= 16:
+    _static_file_bodies.popitem()[1].close()
+  token = base64.b16encode(os.urandom(16))
+  _static_file_bodies[token] = body
+  return token
+
+
 class FileDispatcher(URLDispatcher):
-  """Dispatcher that reads data files from disk."""
+  """Dispatcher that serves data files from disk.
+
+  Files are streamed rather than read into memory, ETags are cached per
+  file by StaticFileCache, and single byte ranges requested with the Range
+  header are served as 206 Partial Content.
+  """
 
   def __init__(self,
                config,
                path_adjuster,
                static_file_config_matcher,
-               read_data_file=ReadDataFile):
+               read_data_file=None,
+               static_file_cache=None):
     """Initializer.
 
     Args:
@@ -1853,12 +2156,17 @@ class FileDispatcher(URLDispatcher):
       path_adjuster: Instance of PathAdjuster to use for finding absolute
         paths of data files on disk.
       static_file_config_matcher: StaticFileConfigMatcher object.
-      read_data_file: Used for dependency injection.
+      read_data_file: Used for dependency injection.  When given, files are
+        read whole through this function instead of being streamed.
+      static_file_cache: Used for dependency injection.
     """
     self._config = config
     self._path_adjuster = path_adjuster
     self._static_file_config_matcher = static_file_config_matcher
     self._read_data_file = read_data_file
+    if static_file_cache is None:
+      static_file_cache = StaticFileCache()
+    self._static_file_cache = static_file_cache
 
   def Dispatch(self,
                request,
@@ -1866,11 +2174,38 @@ class FileDispatcher(URLDispatcher):
                base_env_dict=None):
     """Reads the file and returns the response status and data."""
     full_path = self._path_adjuster.AdjustPath(request.path)
-    status, data = self._read_data_file(full_path)
+    if self._read_data_file is not None:
+      status, data = self._read_data_file(full_path)
+      data_file = cStringIO.StringIO(data)
+      size = len(data)
+      current_etag = self.CreateEtag(data)
+    else:
+      status, data_file, size, current_etag = (
+          self._static_file_cache.Open(full_path))
+    try:
+      self._WriteResponse(request, outfile, status, data_file, size,
+                          current_etag)
+    except:
+      if data_file is not None:
+        data_file.close()
+      raise
+
+  def _WriteResponse(self, request, outfile, status, data_file, size,
+                     current_etag):
+    """Writes the response for an opened file.
+
+    Args:
+      request: AppServerRequest being handled.
+      outfile: File-like object where output data should be written.
+      status: HTTP status of opening the file.
+      data_file: The file open for reading, or None on error.  It is closed,
+        or handed over to StaticFileRewriter.
+      size: The size of the file.
+      current_etag: The ETag of the file.
+    """
     content_type = self._static_file_config_matcher.GetMimeType(request.path)
     static_file = self._static_file_config_matcher.IsStaticFile(request.path)
     expiration = self._static_file_config_matcher.GetExpiration(request.path)
-    current_etag = self.CreateEtag(data)
     if_match_etag = request.headers.get('if-match', None)
     if_none_match_etag = request.headers.get('if-none-match', '').split(',')
 
@@ -1885,6 +2220,19 @@ class FileDispatcher(URLDispatcher):
       outfile.write('ETag: "%s"\r\n' % current_etag)
       outfile.write('\r\n')
     else:
+      start, end = 0, size
+      content_range = None
+      if status == httplib.OK:
+        byte_range = self._GetByteRange(request, size, current_etag)
+        if byte_range is not None:
+          start, end = byte_range
+          if start < end:
+            status = httplib.PARTIAL_CONTENT
+            content_range = 'bytes %d-%d/%d' % (start, end - 1, size)
+          else:
+            status = httplib.REQUESTED_RANGE_NOT_SATISFIABLE
+            content_range = 'bytes */%d' % size
+            start = end = 0
       outfile.write('Status: %d\r\n' % status)
       outfile.write('Content-type: %s\r\n' % content_type)
       if expiration:
@@ -1895,8 +2243,51 @@ class FileDispatcher(URLDispatcher):
         outfile.write('Cache-Control: public, max-age=%i\r\n' % expiration)
       if static_file:
         outfile.write('ETag: "%s"\r\n' % current_etag)
+      if data_file is not None:
+        outfile.write('Accept-Ranges: bytes\r\n')
+      if content_range:
+        outfile.write('Content-Range: %s\r\n' % content_range)
+      if data_file is not None and start < end:
+        body = dev_appserver_blobstore.FileRangeReader(data_file, start, end)
+        outfile.write('%s: %s\r\n' % (STATIC_FILE_HEADER,
+                                      _RegisterStaticFileBody(body)))
+        data_file = None
       outfile.write('\r\n')
-      outfile.write(data)
+    if data_file is not None:
+      data_file.close()
+
+  @staticmethod
+  def _GetByteRange(request, size, current_etag):
+    """Returns the byte range requested by the Range header, if any.
+
+    Only single ranges are supported; a Range header that cannot be parsed
+    or asks for several ranges is ignored and the whole file is served, as
+    is one whose If-Range validator does not match the current ETag.
+
+    Args:
+      request: AppServerRequest being handled.
+      size: The size of the file.
+      current_etag: The ETag of the file.
+
+    Returns:
+      Tuple (start, end) with end exclusive, where start >= end if the range
+      is not satisfiable, or None to serve the whole file.
+    """
+    range_header = request.headers.get('range')
+    if not range_header:
+      return None
+    if_range = request.headers.get('if-range')
+    if if_range and not FileDispatcher._CheckETagMatches([if_range],
+                                                         current_etag, False):
+      return None
+    start, end = dev_appserver_blobstore.ParseRangeHeader(range_header)
+    if start is None:
+      return None
+    if start < 0:
+      return max(0, size + start), size
+    if end is None:
+      end = size
+    return start, min(end, size)
 
   def __str__(self):
     """Returns a string representation of this dispatcher."""
@@ -2127,7 +2518,8 @@ def CreateResponseRewritersChain():
   Returns:
     List of response rewriters.
   """
-  rewriters = [dev_appserver_blobstore.DownloadRewriter,
+  rewriters = [StaticFileRewriter,
+               dev_appserver_blobstore.DownloadRewriter,
                IgnoreHeadersRewriter,
                ParseStatusRewriter,
                CacheRewriter,
@@ -2732,6 +3124,10 @@ def CreateRequestHandler(root_path,
 
 
             index_yaml_updater.UpdateIndexYaml()
+        finally:
+
+          if response.body is not None:
+            response.body.close()
 
     def log_error(self, format, *args):
       """Redirect error messages through the logging module."""
@@ -3051,9 +3447,16 @@ def SetupStubs(app_id, **config):
     login_url: Relative URL which should be used for handling user login/logout.
     blobstore_path: Path to the directory to store Blobstore blobs in.
     datastore_path: Path to the file to store Datastore file stub data in.
+    datastore_journal: Journal Datastore file stub changes instead of
+        rewriting the whole file on every put.
     prospective_search_path: Path to the file to store Prospective Search stub
         data in.
+    search_indexes_path: Path to the directory to store Search API indexes in.
+    clear_search_indexes: If the Search API indexes should be cleared on
+        startup.
     use_sqlite: Use the SQLite stub for the datastore.
+    sqlite_write_optimized: Use WAL journaling and batched writes in the
+        SQLite stub.
     high_replication: Use the high replication consistency model
     history_path: DEPRECATED, No-op.
     clear_datastore: If the datastore should be cleared on startup.
@@ -3079,16 +3482,22 @@ def SetupStubs(app_id, **config):
     port: The port that this dev_appserver is bound to. Defaults to 8080
     address: The host that this dev_appsever is running on. Defaults to
       localhost.
+    api_threads: The number of threads on which API stub calls start as soon
+      as they are made. 0 runs them when they are waited on.
   """
 
   root_path = config.get('root_path', None)
   login_url = config['login_url']
   blobstore_path = config['blobstore_path']
   datastore_path = config['datastore_path']
+  datastore_journal = config.get('datastore_journal', False)
   clear_datastore = config['clear_datastore']
   prospective_search_path = config.get('prospective_search_path', '')
   clear_prospective_search = config.get('clear_prospective_search', False)
+  search_indexes_path = config.get('search_indexes_path', None)
+  clear_search_indexes = config.get('clear_search_indexes', False)
   use_sqlite = config.get('use_sqlite', False)
+  sqlite_write_optimized = config.get('sqlite_write_optimized', False)
   high_replication = config.get('high_replication', False)
   require_indexes = config.get('require_indexes', False)
   mysql_host = config.get('mysql_host', None)
@@ -3108,6 +3517,7 @@ def SetupStubs(app_id, **config):
   trusted = config.get('trusted', False)
   serve_port = config.get('port', 8080)
   serve_address = config.get('address', 'localhost')
+  api_threads = config.get('api_threads', 0)
 
 
 
@@ -3119,6 +3529,8 @@ def SetupStubs(app_id, **config):
 
   os.environ['REQUEST_ID_HASH'] = ''
 
+  apiproxy_rpc.SetAsyncExecution(api_threads)
+
   if clear_prospective_search and prospective_search_path:
 
     if os.path.lexists(prospective_search_path):
@@ -3128,15 +3540,31 @@ def SetupStubs(app_id, **config):
       except OSError, e:
         logging.warning('Removing file failed: %s', e)
 
+  if clear_search_indexes and search_indexes_path:
+    if os.path.isdir(search_indexes_path):
+      logging.info('Attempting to remove search indexes at %s',
+                   search_indexes_path)
+      for filename in os.listdir(search_indexes_path):
+        if (filename != simple_search_stub.MANIFEST_FILENAME and
+            not filename.endswith(simple_search_stub.SEGMENT_SUFFIX)):
+          continue
+        try:
+          remove(os.path.join(search_indexes_path, filename))
+        except OSError, e:
+          logging.warning('Removing file failed: %s', e)
+
   if clear_datastore:
-    path = datastore_path
+    journal_path = datastore_path + datastore_file_stub.JOURNAL_SUFFIX
+    for path in (datastore_path, journal_path,
+                 journal_path + datastore_file_stub.JOURNAL_COMPACTING_SUFFIX,
+                 datastore_path + '-wal', datastore_path + '-shm'):
 
-    if os.path.lexists(path):
-      logging.info('Attempting to remove file at %s', path)
-      try:
-        remove(path)
-      except OSError, e:
-        logging.warning('Removing file failed: %s', e)
+      if os.path.lexists(path):
+        logging.info('Attempting to remove file at %s', path)
+        try:
+          remove(path)
+        except OSError, e:
+          logging.warning('Removing file failed: %s', e)
 
 
   if not multiprocess.GlobalProcess().MaybeConfigureRemoteDataApis():
@@ -3146,11 +3574,11 @@ def SetupStubs(app_id, **config):
     if use_sqlite:
       datastore = datastore_sqlite_stub.DatastoreSqliteStub(
           app_id, datastore_path, require_indexes=require_indexes,
-          trusted=trusted)
+          trusted=trusted, write_optimized=sqlite_write_optimized)
     else:
       datastore = datastore_file_stub.DatastoreFileStub(
           app_id, datastore_path, require_indexes=require_indexes,
-          trusted=trusted)
+          trusted=trusted, use_journal=datastore_journal)
 
     if high_replication:
       datastore.SetConsistencyPolicy(
@@ -3229,7 +3657,7 @@ def SetupStubs(app_id, **config):
 
   apiproxy_stub_map.apiproxy.RegisterStub(
       'search',
-      simple_search_stub.SearchServiceStub())
+      simple_search_stub.SearchServiceStub(index_path=search_indexes_path))
 
 
 
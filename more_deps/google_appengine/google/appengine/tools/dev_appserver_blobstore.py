@@ -22,6 +22,10 @@
 
 Classes:
 
+  FileRangeReader:
+    Read-only file-like view of a byte range of an open file, used to stream
+    large response bodies without reading them into memory.
+
   DownloadRewriter:
     Rewriter responsible for transforming an application response to one
     that serves a blob to the user.
@@ -189,6 +193,59 @@ else:
     return _FixedContentRange.parse(content_range_header)
 
 
+class FileRangeReader(object):
+  """Read-only file-like view of the bytes [start, end) of an open file.
+
+  Offsets passed to seek() and returned by tell() are relative to start, so
+  the view can be used wherever a response body is expected.  The underlying
+  file is closed by close().
+  """
+
+  def __init__(self, data_file, start, end):
+    """Initializer.
+
+    Args:
+      data_file: File object open for reading; must support seek().
+      start: Offset of the first byte of the range.
+      end: Offset one past the last byte of the range.
+    """
+    self._file = data_file
+    self._start = start
+    self._end = max(start, end)
+    self._position = start
+    data_file.seek(start)
+
+  def read(self, size=-1):
+    """Reads at most size bytes, or up to the end of the range if negative."""
+    remaining = self._end - self._position
+    if size < 0 or size > remaining:
+      size = remaining
+    if size <= 0:
+      return ''
+    data = self._file.read(size)
+    self._position += len(data)
+    return data
+
+  def seek(self, offset, whence=0):
+    """Moves to a position relative to the start of the range."""
+    if whence == 1:
+      position = self._position + offset
+    elif whence == 2:
+      position = self._end + offset
+    else:
+      position = self._start + offset
+    self._position = min(max(position, self._start), self._end)
+    self._file.seek(self._position)
+
+  def tell(self):
+    """Returns the current position relative to the start of the range."""
+    return self._position - self._start
+
+  def close(self):
+    """Closes the underlying file."""
+    self._file.close()
+
+
 def ParseRangeHeader(range_header):
   """Parse HTTP Range header.
 
@@ -299,8 +356,8 @@ def DownloadRewriter(response, request_headers):
           return
 
       blob_stream = GetBlobStorage().OpenBlob(blob_key)
-      blob_stream.seek(start)
-      response.body = cStringIO.StringIO(blob_stream.read(content_length))
+      response.body = FileRangeReader(blob_stream, start,
+                                      start + content_length)
       response.headers['Content-Length'] = str(content_length)
 
       content_type = response.headers.getheader('Content-Type')
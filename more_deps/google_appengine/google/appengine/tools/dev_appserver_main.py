@@ -35,6 +35,10 @@ Options:
 
   --allow_skipped_files      Allow access to files matched by app.yaml's
                              skipped_files (default False)
+  --api_threads=COUNT        Start API stub calls on a pool of COUNT threads
+                             as soon as they are made, so that asynchronous
+                             calls overlap. 0 runs them when waited on.
+                             (Default %(api_threads)s)
   --auth_domain              Authorization domain that this app runs in.
                              (Default gmail.com)
   --backends                 Run the dev_appserver with backends support
@@ -43,9 +47,15 @@ Options:
                              file stub data.
   --clear_prospective_search Clear the Prospective Search subscription index
                              (Default false).
+  --clear_search_indexes     Clear the Search API indexes on startup.
+                             (Default false)
   --datastore_path=DS_FILE   Path to file to use for storing Datastore file
                              stub data.
                              (Default %(datastore_path)s)
+  --datastore_journal        Append Datastore changes to a journal next to the
+                             Datastore file instead of rewriting the whole
+                             file on every put. Ignored with --use_sqlite.
+                             (Default false)
   --debug_imports            Enables debug logging for module imports, showing
                              search paths used for finding modules and any
                              errors encountered during the import process.
@@ -83,6 +93,9 @@ Options:
                              (Default '%(mysql_socket)s')
   --require_indexes          Disallows queries that require composite indexes
                              not defined in index.yaml.
+  --search_indexes_path=DIR  Path to directory to use for storing Search API
+                             indexes. If not given, the indexes are only
+                             kept in memory.
   --show_mail_body           Log the body of emails in mail stub.
                              (Default false)
   --skip_sdk_update_check    Skip checking for SDK updates. If false, fall back
@@ -103,6 +116,9 @@ Options:
                              (Default '%(task_retry_seconds)s')
   --use_sqlite               Use the new, SQLite based datastore stub.
                              (Default false)
+  --sqlite_write_optimized   Use WAL journaling and batched writes in the
+                             SQLite based datastore stub. Only used with
+                             --use_sqlite. (Default false)
 """
 
 
@@ -168,11 +184,14 @@ ARG_ADDRESS = 'address'
 ARG_ADMIN_CONSOLE_HOST = 'admin_console_host'
 ARG_ADMIN_CONSOLE_SERVER = 'admin_console_server'
 ARG_ALLOW_SKIPPED_FILES = 'allow_skipped_files'
+ARG_API_THREADS = 'api_threads'
 ARG_AUTH_DOMAIN = 'auth_domain'
 ARG_BACKENDS = 'backends'
 ARG_BLOBSTORE_PATH = 'blobstore_path'
 ARG_CLEAR_DATASTORE = 'clear_datastore'
 ARG_CLEAR_PROSPECTIVE_SEARCH = 'clear_prospective_search'
+ARG_CLEAR_SEARCH_INDEXES = 'clear_search_indexes'
+ARG_DATASTORE_JOURNAL = 'datastore_journal'
 ARG_DATASTORE_PATH = 'datastore_path'
 ARG_DEBUG_IMPORTS = 'debug_imports'
 ARG_DEFAULT_PARTITION = 'default_partition'
@@ -197,12 +216,14 @@ ARG_MYSQL_USER = 'mysql_user'
 ARG_PORT = 'port'
 ARG_PROSPECTIVE_SEARCH_PATH = 'prospective_search_path'
 ARG_REQUIRE_INDEXES = 'require_indexes'
+ARG_SEARCH_INDEXES_PATH = 'search_indexes_path'
 ARG_SHOW_MAIL_BODY = 'show_mail_body'
 ARG_SKIP_SDK_UPDATE_CHECK = 'skip_sdk_update_check'
 ARG_SMTP_HOST = 'smtp_host'
 ARG_SMTP_PASSWORD = 'smtp_password'
 ARG_SMTP_PORT = 'smtp_port'
 ARG_SMTP_USER = 'smtp_user'
+ARG_SQLITE_WRITE_OPTIMIZED = 'sqlite_write_optimized'
 ARG_STATIC_CACHING = 'static_caching'
 ARG_TASK_RETRY_SECONDS = 'task_retry_seconds'
 
@@ -228,11 +249,14 @@ DEFAULT_ARGS = {
   ARG_ADMIN_CONSOLE_HOST: None,
   ARG_ADMIN_CONSOLE_SERVER: DEFAULT_ADMIN_CONSOLE_SERVER,
   ARG_ALLOW_SKIPPED_FILES: False,
+  ARG_API_THREADS: 0,
   ARG_AUTH_DOMAIN: 'gmail.com',
   ARG_BLOBSTORE_PATH: os.path.join(tempfile.gettempdir(),
                                    'dev_appserver.blobstore'),
   ARG_CLEAR_DATASTORE: False,
   ARG_CLEAR_PROSPECTIVE_SEARCH: False,
+  ARG_CLEAR_SEARCH_INDEXES: False,
+  ARG_DATASTORE_JOURNAL: False,
   ARG_DATASTORE_PATH: os.path.join(tempfile.gettempdir(),
                                    'dev_appserver.datastore'),
   ARG_DEFAULT_PARTITION: 'dev',
@@ -252,12 +276,14 @@ DEFAULT_ARGS = {
   ARG_PROSPECTIVE_SEARCH_PATH: os.path.join(tempfile.gettempdir(),
                                             'dev_appserver.prospective_search'),
   ARG_REQUIRE_INDEXES: False,
+  ARG_SEARCH_INDEXES_PATH: None,
   ARG_SHOW_MAIL_BODY: False,
   ARG_SKIP_SDK_UPDATE_CHECK: False,
   ARG_SMTP_HOST: '',
   ARG_SMTP_PASSWORD: '',
   ARG_SMTP_PORT: 25,
   ARG_SMTP_USER: '',
+  ARG_SQLITE_WRITE_OPTIMIZED: False,
   ARG_STATIC_CACHING: True,
   ARG_TASK_RETRY_SECONDS: 30,
   ARG_TRUSTED: False,
@@ -302,11 +328,14 @@ def ParseArguments(argv):
         'admin_console_host=',
         'admin_console_server=',
         'allow_skipped_files',
+        'api_threads=',
         'auth_domain=',
         'backends',
         'blobstore_path=',
         'clear_datastore',
         'clear_prospective_search',
+        'clear_search_indexes',
+        'datastore_journal',
         'datastore_path=',
         'debug',
         'debug_imports',
@@ -331,12 +360,14 @@ def ParseArguments(argv):
         'mysql_user=',
         'port=',
         'require_indexes',
+        'search_indexes_path=',
         'show_mail_body',
         'skip_sdk_update_check',
         'smtp_host=',
         'smtp_password=',
         'smtp_port=',
         'smtp_user=',
+        'sqlite_write_optimized',
         'task_retry_seconds=',
         'trusted',
         'use_sqlite',
@@ -373,6 +404,9 @@ def ParseArguments(argv):
     if option == '--datastore_path':
       option_dict[ARG_DATASTORE_PATH] = expand_path(value)
 
+    if option == '--datastore_journal':
+      option_dict[ARG_DATASTORE_JOURNAL] = True
+
     if option == '--prospective_search_path':
       option_dict[ARG_PROSPECTIVE_SEARCH_PATH] = expand_path(value)
 
@@ -382,6 +416,9 @@ def ParseArguments(argv):
     if option == '--use_sqlite':
       option_dict[ARG_USE_SQLITE] = True
 
+    if option == '--sqlite_write_optimized':
+      option_dict[ARG_SQLITE_WRITE_OPTIMIZED] = True
+
     if option == '--high_replication':
       option_dict[ARG_HIGH_REPLICATION] = True
 
@@ -394,6 +431,12 @@ def ParseArguments(argv):
     if option == '--clear_prospective_search':
       option_dict[ARG_CLEAR_PROSPECTIVE_SEARCH] = True
 
+    if option == '--clear_search_indexes':
+      option_dict[ARG_CLEAR_SEARCH_INDEXES] = True
+
+    if option == '--search_indexes_path':
+      option_dict[ARG_SEARCH_INDEXES_PATH] = expand_path(value)
+
     if option == '--require_indexes':
       option_dict[ARG_REQUIRE_INDEXES] = True
 
@@ -460,6 +503,15 @@ def ParseArguments(argv):
         print >>sys.stderr, 'Invalid value supplied for task_retry_seconds'
         PrintUsageExit(1)
 
+    if option == '--api_threads':
+      try:
+        option_dict[ARG_API_THREADS] = int(value)
+        if option_dict[ARG_API_THREADS] < 0:
+          raise ValueError
+      except ValueError:
+        print >>sys.stderr, 'Invalid value supplied for api_threads'
+        PrintUsageExit(1)
+
     if option == '--trusted':
       option_dict[ARG_TRUSTED] = True
 
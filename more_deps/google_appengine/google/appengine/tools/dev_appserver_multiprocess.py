@@ -72,6 +72,9 @@ ARG_MULTIPROCESS_BACKEND_INSTANCE_ID = 'multiprocess_backend_instance_id'
 API_SERVER_HOST = 'localhost'
 PATH_DEV_API_SERVER = '/_ah/dev_api_server'
 
+
+API_SERVER_MAX_BATCH_SIZE = 100
+
 BACKEND_MAX_INSTANCES = 20
 
 
@@ -654,7 +657,7 @@ class DevProcess(object):
     remote_api_stub.ConfigureRemoteApi(
         self.app_id, PATH_DEV_API_SERVER, lambda: ('', ''),
         servername='%s:%d' % (API_SERVER_HOST, self.api_port),
-        services=services)
+        services=services, max_batch_size=API_SERVER_MAX_BATCH_SIZE)
     return True
 
   def NewAppInfo(self, appinfo):
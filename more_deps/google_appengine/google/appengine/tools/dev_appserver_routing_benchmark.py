@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+
+"""Benchmark of URL routing through the dev_appserver URLMatcher.
+
+Builds a URLMatcher from synthetic app.yaml-like handlers (literal paths,
+static directories, regexes with groups and a catch-all), then matches
+request paths against it and against a plain linear scan of the same
+regexes.  Checks that both return the same handler for every path, and
+reports the matches per second of each.
+
+Usage:
+  python dev_appserver_routing_benchmark.py [--handlers=N] [--requests=N]
+      [--distinct=N] [--seed=N]
+"""
+
+
+
+import getopt
+import random
+import re
+import sys
+import time
+
+from google.appengine.tools import dev_appserver
+
+
+class _Dispatcher(dev_appserver.URLDispatcher):
+  """Dispatcher that only records its position in the handler list."""
+
+  def __init__(self, number):
+    self.number = number
+
+
+def MakeHandlers(num_handlers, rng):
+  """Returns a list of (regex, path) pairs in app.yaml order."""
+  handlers = []
+  for i in xrange(num_handlers - 1):
+    kind = rng.randint(0, 3)
+    if kind == 0:
+      handlers.append(('/page%d' % i, 'page%d.py' % i))
+    elif kind == 1:
+      handlers.append((re.escape('/static%d' % i) + '/(.*)',
+                       'static%d/\\1' % i))
+    elif kind == 2:
+      handlers.append(('/api/v%d/(\\w+)/(\\d+)' % i, 'api.py'))
+    else:
+      handlers.append(('/(en|fr|de)/section%d/.*' % i, 'section.py'))
+  handlers.append(('/.*', 'main.py'))
+  return handlers
+
+
+def MakePaths(num_handlers, num_paths, rng):
+  """Returns a list of request paths hitting the handlers."""
+  paths = []
+  for _ in xrange(num_paths):
+    i = rng.randint(0, num_handlers)
+    kind = rng.randint(0, 4)
+    if kind == 0:
+      paths.append('/page%d' % i)
+    elif kind == 1:
+      paths.append('/static%d/img/%d.png' % (i, rng.randint(0, 99)))
+    elif kind == 2:
+      paths.append('/api/v%d/item/%d' % (i, rng.randint(0, 999)))
+    elif kind == 3:
+      paths.append('/fr/section%d/x/%d' % (i, rng.randint(0, 9)))
+    else:
+      paths.append('/unknown/%d' % rng.randint(0, 999))
+  return paths
+
+
+def LinearMatch(patterns, relative_url):
+  """Matches relative_url the way URLMatcher.Match used to, by linear scan.
+
+  Returns:
+    Tuple (number, matched_path) of the first handler matching, or
+    (None, None).
+  """
+  adjusted_url, unused_query_string = dev_appserver.SplitURL(relative_url)
+  for url_re, number, path in patterns:
+    the_match = url_re.match(adjusted_url)
+    if the_match:
+      return number, the_match.expand(path)
+  return None, None
+
+
+def main(argv):
+  num_handlers = 300
+  num_requests = 20000
+  num_distinct = 2000
+  seed = 0
+  opts, _ = getopt.getopt(argv[1:], '', ['handlers=', 'requests=',
+                                         'distinct=', 'seed='])
+  for option, value in opts:
+    if option == '--handlers':
+      num_handlers = int(value)
+    elif option == '--requests':
+      num_requests = int(value)
+    elif option == '--distinct':
+      num_distinct = int(value)
+    elif option == '--seed':
+      seed = int(value)
+
+  rng = random.Random(seed)
+  handlers = MakeHandlers(num_handlers, rng)
+  matcher = dev_appserver.URLMatcher()
+  patterns = []
+  for number, (regex, path) in enumerate(handlers):
+    matcher.AddURL(regex, _Dispatcher(number), path, False, False, None)
+    patterns.append((re.compile('^%s$' % regex), number, path))
+  distinct = MakePaths(num_handlers, num_distinct, rng)
+  paths = [rng.choice(distinct) for _ in xrange(num_requests)]
+
+  for path in distinct:
+    expected = LinearMatch(patterns, path)
+    dispatcher, matched_path = matcher.Match(path)[:2]
+    actual = (dispatcher and dispatcher.number, matched_path)
+    if actual != expected:
+      print 'Mismatch for %s: %s != %s' % (path, actual, expected)
+      return 1
+
+  start = time.time()
+  for path in paths:
+    LinearMatch(patterns, path)
+  linear = len(paths) / (time.time() - start)
+
+  matcher = dev_appserver.URLMatcher()
+  for number, (regex, path) in enumerate(handlers):
+    matcher.AddURL(regex, _Dispatcher(number), path, False, False, None)
+  start = time.time()
+  for path in paths:
+    matcher.Match(path)
+  compiled = len(paths) / (time.time() - start)
+
+  print '%-16s %10.1f matches/s' % ('linear scan', linear)
+  print '%-16s %10.1f matches/s' % ('URLMatcher', compiled)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
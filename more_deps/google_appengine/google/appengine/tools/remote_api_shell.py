@@ -66,14 +66,17 @@ def auth_func():
   return (raw_input('Email: '), getpass.getpass('Password: '))
 
 
-def remote_api_shell(servername, appid, path, secure, rpc_server_factory):
+def remote_api_shell(servername, appid, path, secure, rpc_server_factory,
+                     max_batch_size=1, compress=False):
   """Actually run the remote_api_shell."""
 
 
   remote_api_stub.ConfigureRemoteApi(appid, path, auth_func,
                                      servername=servername,
                                      save_cookies=True, secure=secure,
-                                     rpc_server_factory=rpc_server_factory)
+                                     rpc_server_factory=rpc_server_factory,
+                                     max_batch_size=max_batch_size,
+                                     compress=compress)
   remote_api_stub.MaybeInvokeAuthentication()
 
 
@@ -106,6 +109,12 @@ def main(argv):
   parser.add_option('--secure', dest='secure', action="store_true",
                     default=False, help='Use HTTPS when communicating '
                                         'with the server.')
+  parser.add_option('--batch_size', dest='batch_size', type='int', default=1,
+                    help='The maximum number of outstanding asynchronous '
+                         'API calls to send to the server in one request. '
+                         'Requires a remote_api handler from this SDK.')
+  parser.add_option('--compress', dest='compress', action='store_true',
+                    default=False, help='Compress batched API calls.')
   (options, args) = parser.parse_args()
 
 
@@ -133,7 +142,8 @@ def main(argv):
 
       path = args[1]
   remote_api_shell(servername, appid, path, options.secure,
-                   appengine_rpc.HttpRpcServer)
+                   appengine_rpc.HttpRpcServer, options.batch_size,
+                   options.compress)
 
 
 if __name__ == '__main__':
@@ -33,6 +33,14 @@ __all__ = ['ProtocolMessage', 'Encoder', 'Decoder',
 
 URL_RE = re.compile('^(https?)://([^/]+)(/.*)$')
 
+
+
+_UNPACK_UINT16 = struct.Struct("<H").unpack_from
+_UNPACK_UINT32 = struct.Struct("<I").unpack_from
+_UNPACK_UINT64 = struct.Struct("<Q").unpack_from
+_UNPACK_FLOAT = struct.Struct("<f").unpack_from
+_UNPACK_DOUBLE = struct.Struct("<d").unpack_from
+
 class ProtocolMessage:
 
 
@@ -93,8 +101,10 @@ class ProtocolMessage:
     except AbstractMethod:
 
 
-      a = array.array('B')
+      a = _DecodeBuffer('B')
       a.fromstring(s)
+      if isinstance(s, str):
+        a.string = s
       d = Decoder(a, 0, len(a))
       self.TryMerge(d)
 
@@ -345,28 +355,17 @@ class Encoder:
 
   def put16(self, v):
     if v < 0 or v >= (1<<16): raise ProtocolBufferEncodeError, "u16 too big"
-    self.buf.append((v >> 0) & 255)
-    self.buf.append((v >> 8) & 255)
+    self.buf.fromstring(struct.pack("<H", v))
     return
 
   def put32(self, v):
     if v < 0 or v >= (1L<<32): raise ProtocolBufferEncodeError, "u32 too big"
-    self.buf.append((v >> 0) & 255)
-    self.buf.append((v >> 8) & 255)
-    self.buf.append((v >> 16) & 255)
-    self.buf.append((v >> 24) & 255)
+    self.buf.fromstring(struct.pack("<I", v))
     return
 
   def put64(self, v):
     if v < 0 or v >= (1L<<64): raise ProtocolBufferEncodeError, "u64 too big"
-    self.buf.append((v >> 0) & 255)
-    self.buf.append((v >> 8) & 255)
-    self.buf.append((v >> 16) & 255)
-    self.buf.append((v >> 24) & 255)
-    self.buf.append((v >> 32) & 255)
-    self.buf.append((v >> 40) & 255)
-    self.buf.append((v >> 48) & 255)
-    self.buf.append((v >> 56) & 255)
+    self.buf.fromstring(struct.pack("<Q", v))
     return
 
   def putVarInt32(self, v):
@@ -382,6 +381,10 @@ class Encoder:
     if v & 127 == v:
       buf_append(v)
       return
+    if v & 16383 == v:
+      buf_append((v & 127) | 128)
+      buf_append(v >> 7)
+      return
     if v >= 0x80000000 or v < -0x80000000:
       raise ProtocolBufferEncodeError, "int32 too big"
     if v < 0:
@@ -398,6 +401,9 @@ class Encoder:
 
   def putVarInt64(self, v):
     buf_append = self.buf.append
+    if v & 127 == v:
+      buf_append(v)
+      return
     if v >= 0x8000000000000000 or v < -0x8000000000000000:
       raise ProtocolBufferEncodeError, "int64 too big"
     if v < 0:
@@ -414,6 +420,9 @@ class Encoder:
 
   def putVarUint64(self, v):
     buf_append = self.buf.append
+    if v & 127 == v:
+      buf_append(v)
+      return
     if v < 0 or v >= 0x10000000000000000:
       raise ProtocolBufferEncodeError, "uint64 too big"
     while True:
@@ -432,15 +441,11 @@ class Encoder:
 
 
   def putFloat(self, v):
-    a = array.array('B')
-    a.fromstring(struct.pack("<f", v))
-    self.buf.extend(a)
+    self.buf.fromstring(struct.pack("<f", v))
     return
 
   def putDouble(self, v):
-    a = array.array('B')
-    a.fromstring(struct.pack("<d", v))
-    self.buf.extend(a)
+    self.buf.fromstring(struct.pack("<d", v))
     return
 
   def putBoolean(self, v):
@@ -480,11 +485,23 @@ class Encoder:
       TYPE_FIXED32: 4,
       TYPE_BOOL:    1 }
 
+class _DecodeBuffer(array.array):
+  """The array('B') of the bytes a Decoder reads, and the string it was filled
+  from, if any.
+
+  Numbers are read from the array, and string fields are sliced out of the
+  string, so that each one is copied only once. Decoders of submessages
+  share the buffer through Decoder.buffer().
+  """
+  string = None
+
+
 class Decoder:
   def __init__(self, buf, idx, limit):
     self.buf = buf
     self.idx = idx
     self.limit = limit
+    self.string = getattr(buf, 'string', None)
     return
 
   def avail(self):
@@ -535,54 +552,34 @@ class Decoder:
 
   def get16(self):
     if self.idx + 2 > self.limit: raise ProtocolBufferDecodeError, "truncated"
-    c = self.buf[self.idx]
-    d = self.buf[self.idx + 1]
+    c = _UNPACK_UINT16(self.buf, self.idx)[0]
     self.idx += 2
-    return (d << 8) | c
+    return c
 
   def get32(self):
     if self.idx + 4 > self.limit: raise ProtocolBufferDecodeError, "truncated"
-    c = self.buf[self.idx]
-    d = self.buf[self.idx + 1]
-    e = self.buf[self.idx + 2]
-    f = long(self.buf[self.idx + 3])
+    c = _UNPACK_UINT32(self.buf, self.idx)[0]
     self.idx += 4
-    return (f << 24) | (e << 16) | (d << 8) | c
+    return long(c)
 
   def get64(self):
     if self.idx + 8 > self.limit: raise ProtocolBufferDecodeError, "truncated"
-    c = self.buf[self.idx]
-    d = self.buf[self.idx + 1]
-    e = self.buf[self.idx + 2]
-    f = long(self.buf[self.idx + 3])
-    g = long(self.buf[self.idx + 4])
-    h = long(self.buf[self.idx + 5])
-    i = long(self.buf[self.idx + 6])
-    j = long(self.buf[self.idx + 7])
+    c = _UNPACK_UINT64(self.buf, self.idx)[0]
     self.idx += 8
-    return ((j << 56) | (i << 48) | (h << 40) | (g << 32) | (f << 24)
-            | (e << 16) | (d << 8) | c)
+    return long(c)
 
   def getVarInt32(self):
 
 
 
-    b = self.get8()
+    idx = self.idx
+    if idx >= self.limit: raise ProtocolBufferDecodeError, "truncated"
+    b = self.buf[idx]
     if not (b & 128):
+      self.idx = idx + 1
       return b
 
-    result = long(0)
-    shift = 0
-
-    while 1:
-      result |= (long(b & 127) << shift)
-      shift += 7
-      if not (b & 128):
-        if result >= 0x10000000000000000L:
-          raise ProtocolBufferDecodeError, "corrupted"
-        break
-      if shift >= 64: raise ProtocolBufferDecodeError, "corrupted"
-      b = self.get8()
+    result = self.getVarUint64()
 
     if result >= 0x8000000000000000L:
       result -= 0x10000000000000000L
@@ -597,29 +594,38 @@ class Decoder:
     return result
 
   def getVarUint64(self):
-    result = long(0)
+
+
+
+    buf = self.buf
+    idx = self.idx
+    limit = self.limit
+    result = 0
     shift = 0
     while 1:
       if shift >= 64: raise ProtocolBufferDecodeError, "corrupted"
-      b = self.get8()
-      result |= (long(b & 127) << shift)
+      if idx >= limit: raise ProtocolBufferDecodeError, "truncated"
+      b = buf[idx]
+      idx += 1
+      result |= (b & 127) << shift
       shift += 7
       if not (b & 128):
         if result >= (1L << 64): raise ProtocolBufferDecodeError, "corrupted"
-        return result
-    return result
+        self.idx = idx
+        return long(result)
+    return long(result)
 
   def getFloat(self):
     if self.idx + 4 > self.limit: raise ProtocolBufferDecodeError, "truncated"
-    a = self.buf[self.idx:self.idx+4]
+    a = _UNPACK_FLOAT(self.buf, self.idx)[0]
     self.idx += 4
-    return struct.unpack("<f", a)[0]
+    return a
 
   def getDouble(self):
     if self.idx + 8 > self.limit: raise ProtocolBufferDecodeError, "truncated"
-    a = self.buf[self.idx:self.idx+8]
+    a = _UNPACK_DOUBLE(self.buf, self.idx)[0]
     self.idx += 8
-    return struct.unpack("<d", a)[0]
+    return a
 
   def getBoolean(self):
     b = self.get8()
@@ -628,16 +634,21 @@ class Decoder:
 
   def getPrefixedString(self):
     length = self.getVarInt32()
-    if self.idx + length > self.limit:
+    idx = self.idx
+    end = idx + length
+    if end > self.limit:
       raise ProtocolBufferDecodeError, "truncated"
-    r = self.buf[self.idx : self.idx + length]
-    self.idx += length
-    return r.tostring()
+    self.idx = end
+    if self.string is not None:
+      return self.string[idx:end]
+    return self.buf[idx:end].tostring()
 
   def getRawString(self):
-    r = self.buf[self.idx:self.limit]
+    idx = self.idx
     self.idx = self.limit
-    return r.tostring()
+    if self.string is not None:
+      return self.string[idx:self.limit]
+    return self.buf[idx:self.limit].tostring()
 
   _TYPE_TO_METHOD = {
       TYPE_DOUBLE:   getDouble,
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+
+"""Micro-benchmark of the ProtocolBuffer Encoder and Decoder.
+
+Times entity_pb.EntityProto round-trips (Encode() followed by parsing the
+result) with the current Encoder and Decoder, and with a reference codec that
+writes and reads varints and fixed-width values one byte at a time.
+
+Usage:
+  python ProtocolBuffer_benchmark.py [--iterations=N] [--properties=N]
+"""
+
+
+
+import array
+import getopt
+import struct
+import sys
+import time
+
+from google.net.proto import ProtocolBuffer
+from google.appengine.datastore import entity_pb
+
+
+REPEAT = 5
+
+
+class _ReferenceEncoder(ProtocolBuffer.Encoder):
+  """An Encoder that writes varints and fixed-width values byte by byte."""
+
+  def put32(self, v):
+    if v < 0 or v >= (1L<<32):
+      raise ProtocolBuffer.ProtocolBufferEncodeError, "u32 too big"
+    self.buf.append((v >> 0) & 255)
+    self.buf.append((v >> 8) & 255)
+    self.buf.append((v >> 16) & 255)
+    self.buf.append((v >> 24) & 255)
+
+  def put64(self, v):
+    if v < 0 or v >= (1L<<64):
+      raise ProtocolBuffer.ProtocolBufferEncodeError, "u64 too big"
+    self.buf.append((v >> 0) & 255)
+    self.buf.append((v >> 8) & 255)
+    self.buf.append((v >> 16) & 255)
+    self.buf.append((v >> 24) & 255)
+    self.buf.append((v >> 32) & 255)
+    self.buf.append((v >> 40) & 255)
+    self.buf.append((v >> 48) & 255)
+    self.buf.append((v >> 56) & 255)
+
+  def putVarInt32(self, v):
+    buf_append = self.buf.append
+    if v & 127 == v:
+      buf_append(v)
+      return
+    if v >= 0x80000000 or v < -0x80000000:
+      raise ProtocolBuffer.ProtocolBufferEncodeError, "int32 too big"
+    if v < 0:
+      v += 0x10000000000000000
+    while True:
+      bits = v & 127
+      v >>= 7
+      if v:
+        bits |= 128
+      buf_append(bits)
+      if not v:
+        break
+
+  def putVarInt64(self, v):
+    buf_append = self.buf.append
+    if v >= 0x8000000000000000 or v < -0x8000000000000000:
+      raise ProtocolBuffer.ProtocolBufferEncodeError, "int64 too big"
+    if v < 0:
+      v += 0x10000000000000000
+    while True:
+      bits = v & 127
+      v >>= 7
+      if v:
+        bits |= 128
+      buf_append(bits)
+      if not v:
+        break
+
+  def putVarUint64(self, v):
+    buf_append = self.buf.append
+    if v < 0 or v >= 0x10000000000000000:
+      raise ProtocolBuffer.ProtocolBufferEncodeError, "uint64 too big"
+    while True:
+      bits = v & 127
+      v >>= 7
+      if v:
+        bits |= 128
+      buf_append(bits)
+      if not v:
+        break
+
+  def putFloat(self, v):
+    a = array.array('B')
+    a.fromstring(struct.pack("<f", v))
+    self.buf.extend(a)
+
+  def putDouble(self, v):
+    a = array.array('B')
+    a.fromstring(struct.pack("<d", v))
+    self.buf.extend(a)
+
+
+class _ReferenceDecoder(ProtocolBuffer.Decoder):
+  """A Decoder that reads varints and fixed-width values byte by byte, and
+  copies strings out of the array and then into a string."""
+
+  def getPrefixedString(self):
+    length = self.getVarInt32()
+    if self.idx + length > self.limit:
+      raise ProtocolBuffer.ProtocolBufferDecodeError, "truncated"
+    r = self.buf[self.idx : self.idx + length]
+    self.idx += length
+    return r.tostring()
+
+  def get32(self):
+    if self.idx + 4 > self.limit:
+      raise ProtocolBuffer.ProtocolBufferDecodeError, "truncated"
+    c = self.buf[self.idx]
+    d = self.buf[self.idx + 1]
+    e = self.buf[self.idx + 2]
+    f = long(self.buf[self.idx + 3])
+    self.idx += 4
+    return (f << 24) | (e << 16) | (d << 8) | c
+
+  def get64(self):
+    if self.idx + 8 > self.limit:
+      raise ProtocolBuffer.ProtocolBufferDecodeError, "truncated"
+    c = self.buf[self.idx]
+    d = self.buf[self.idx + 1]
+    e = self.buf[self.idx + 2]
+    f = long(self.buf[self.idx + 3])
+    g = long(self.buf[self.idx + 4])
+    h = long(self.buf[self.idx + 5])
+    i = long(self.buf[self.idx + 6])
+    j = long(self.buf[self.idx + 7])
+    self.idx += 8
+    return ((j << 56) | (i << 48) | (h << 40) | (g << 32) | (f << 24)
+            | (e << 16) | (d << 8) | c)
+
+  def getVarInt32(self):
+    b = self.get8()
+    if not (b & 128):
+      return b
+
+    result = long(0)
+    shift = 0
+
+    while 1:
+      result |= (long(b & 127) << shift)
+      shift += 7
+      if not (b & 128):
+        if result >= 0x10000000000000000L:
+          raise ProtocolBuffer.ProtocolBufferDecodeError, "corrupted"
+        break
+      if shift >= 64:
+        raise ProtocolBuffer.ProtocolBufferDecodeError, "corrupted"
+      b = self.get8()
+
+    if result >= 0x8000000000000000L:
+      result -= 0x10000000000000000L
+    if result >= 0x80000000L or result < -0x80000000L:
+      raise ProtocolBuffer.ProtocolBufferDecodeError, "corrupted"
+    return result
+
+  def getVarUint64(self):
+    result = long(0)
+    shift = 0
+    while 1:
+      if shift >= 64:
+        raise ProtocolBuffer.ProtocolBufferDecodeError, "corrupted"
+      b = self.get8()
+      result |= (long(b & 127) << shift)
+      shift += 7
+      if not (b & 128):
+        if result >= (1L << 64):
+          raise ProtocolBuffer.ProtocolBufferDecodeError, "corrupted"
+        return result
+    return result
+
+  def getFloat(self):
+    if self.idx + 4 > self.limit:
+      raise ProtocolBuffer.ProtocolBufferDecodeError, "truncated"
+    a = self.buf[self.idx:self.idx+4]
+    self.idx += 4
+    return struct.unpack("<f", a)[0]
+
+  def getDouble(self):
+    if self.idx + 8 > self.limit:
+      raise ProtocolBuffer.ProtocolBufferDecodeError, "truncated"
+    a = self.buf[self.idx:self.idx+8]
+    self.idx += 8
+    return struct.unpack("<d", a)[0]
+
+def MakeEntity(num_properties):
+  """Builds an EntityProto with a mix of property types.
+
+  Args:
+    num_properties: the number of properties to give the entity.
+
+  Returns:
+    An entity_pb.EntityProto.
+  """
+  entity = entity_pb.EntityProto()
+  key = entity.mutable_key()
+  key.set_app('benchmark')
+  element = key.mutable_path().add_element()
+  element.set_type('Benchmark')
+  element.set_id(1234567890123)
+  entity.mutable_entity_group().add_element().CopyFrom(element)
+
+  for i in xrange(num_properties):
+    prop = entity.add_property()
+    prop.set_name('property_%d' % i)
+    prop.set_multiple(False)
+    value = prop.mutable_value()
+    kind = i % 4
+    if kind == 0:
+      value.set_int64value(i * 1000003)
+    elif kind == 1:
+      value.set_stringvalue('value %d ' % i * 8)
+    elif kind == 2:
+      value.set_doublevalue(i / 7.0)
+    else:
+      ref = value.mutable_referencevalue()
+      ref.set_app('benchmark')
+      ref_element = ref.add_pathelement()
+      ref_element.set_type('Other')
+      ref_element.set_name('other-%d' % i)
+  return entity
+
+
+def TimeRoundTrips(entity, iterations, encoder_class, decoder_class):
+  """Times EntityProto round-trips using the given codec classes.
+
+  Args:
+    entity: the entity_pb.EntityProto to encode and decode.
+    iterations: the number of round-trips.
+    encoder_class: the class to use as ProtocolBuffer.Encoder.
+    decoder_class: the class to use as ProtocolBuffer.Decoder.
+
+  Returns:
+    A tuple (encode seconds, decode seconds), each the best of REPEAT runs.
+  """
+  saved = ProtocolBuffer.Encoder, ProtocolBuffer.Decoder
+  ProtocolBuffer.Encoder = encoder_class
+  ProtocolBuffer.Decoder = decoder_class
+  encode_seconds = decode_seconds = None
+  try:
+    for _ in xrange(REPEAT):
+      start = time.time()
+      for _ in xrange(iterations):
+        encoded = entity.Encode()
+      elapsed = time.time() - start
+      if encode_seconds is None or elapsed < encode_seconds:
+        encode_seconds = elapsed
+
+      start = time.time()
+      for _ in xrange(iterations):
+        decoded = entity_pb.EntityProto(encoded)
+      elapsed = time.time() - start
+      if decode_seconds is None or elapsed < decode_seconds:
+        decode_seconds = elapsed
+  finally:
+    ProtocolBuffer.Encoder, ProtocolBuffer.Decoder = saved
+
+  assert decoded.Equals(entity)
+  return encode_seconds, decode_seconds
+
+
+def main(argv):
+  iterations = 2000
+  num_properties = 40
+  opts, _ = getopt.getopt(argv[1:], '', ['iterations=', 'properties='])
+  for option, value in opts:
+    if option == '--iterations':
+      iterations = int(value)
+    elif option == '--properties':
+      num_properties = int(value)
+
+  entity = MakeEntity(num_properties)
+  print 'EntityProto of %d bytes, %d round-trips' % (
+      len(entity.Encode()), iterations)
+
+  results = [
+      ('reference', TimeRoundTrips(entity, iterations, _ReferenceEncoder,
+                                   _ReferenceDecoder)),
+      ('current', TimeRoundTrips(entity, iterations, ProtocolBuffer.Encoder,
+                                 ProtocolBuffer.Decoder)),
+      ]
+  for name, (encode_seconds, decode_seconds) in results:
+    print '%-10s encode %8.1f us  decode %8.1f us' % (
+        name, encode_seconds / iterations * 1e6,
+        decode_seconds / iterations * 1e6)
+
+
+if __name__ == '__main__':
+  main(sys.argv)